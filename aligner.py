@@ -0,0 +1,232 @@
+import bisect
+import json
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+
+from dataset_handler import write_dataset_jsonl
+
+# Aligns the OCR text of a whole book with its clean text, so evaluation pairs can be cut at any
+# granularity instead of relying on matching dict keys or line indices.
+#
+# Anchors are word n-grams that occur exactly once in both texts (the idea behind patience diff).
+# The longest chain of anchors that appear in the same order in both texts fixes the alignment;
+# the gaps between anchors are aligned the same way with n-grams unique inside the gap, falling
+# back to shorter n-grams and finally to difflib for small gaps. Every step is linear in the size
+# of the range it looks at, so a whole book aligns without a quadratic full-text comparison.
+
+# --- Configuration ---
+INPUT_OCR_PATH = "dataset/ita/original_ocr.json"
+INPUT_CLEAN_PATH = "dataset/ita/cleaned.json"
+OUTPUT_PATH = "dataset/ita/aligned_paragraphs.jsonl"
+GRANULARITY = "paragraph" # "paragraph", "line" or "sentence" of the clean text
+MIN_COVERAGE = 0.5 # Drop segment pairs with fewer aligned clean words than this fraction
+
+ANCHOR_NGRAM = 3 # Words per anchor n-gram at the top level; gaps retry down to single words
+MAX_GAP_CELLS = 250_000 # Largest anchorless gap (ocr words * clean words) handed to difflib
+
+_TOKEN_RE = re.compile(r"\w+")
+_SEGMENT_RES = {
+    "paragraph": re.compile(r".+?(?:\n\s*\n\s*|$)", re.DOTALL),
+    "line": re.compile(r".+?(?:\n\s*|$)", re.DOTALL),
+    "sentence": re.compile(r".+?(?:[.!?][\"'»”’)\]]*\s+|$)", re.DOTALL),
+}
+
+
+# ----------------------------------------------- Tokens and Anchors -----------------------------------------------
+
+def tokenize(text: str) -> tuple:
+    """
+    Lowercased word tokens and their character spans in `text`. Punctuation (apostrophes
+    included, so ' and ’ never matter) only separates words.
+
+    Returns:
+        tuple: (tokens, spans) where tokens[k] is text[spans[k][0]:spans[k][1]], lowercased.
+    """
+    tokens, spans = [], []
+    for match in _TOKEN_RE.finditer(text):
+        tokens.append(match.group().lower())
+        spans.append(match.span())
+    return tokens, spans
+
+def _unique_ngram_pairs(a: list, b: list, a_lo: int, a_hi: int, b_lo: int, b_hi: int, n: int) -> list:
+    """(i, j) start positions of the n-grams occurring exactly once in a[a_lo:a_hi] and once in b[b_lo:b_hi]."""
+    a_counts = Counter(tuple(a[i:i + n]) for i in range(a_lo, a_hi - n + 1))
+    b_positions = {}
+    b_counts = Counter()
+    for j in range(b_lo, b_hi - n + 1):
+        gram = tuple(b[j:j + n])
+        b_counts[gram] += 1
+        b_positions[gram] = j
+    pairs = []
+    for i in range(a_lo, a_hi - n + 1):
+        gram = tuple(a[i:i + n])
+        if a_counts[gram] == 1 and b_counts.get(gram) == 1:
+            pairs.append((i, b_positions[gram]))
+    return pairs
+
+def _longest_increasing_chain(pairs: list) -> list:
+    """Longest subsequence of (i, j) pairs, already sorted by i, whose j also increases. O(k log k)."""
+    tails = [] # tails[length - 1] = smallest j ending a chain of that length
+    tail_index = [] # index in `pairs` of that chain end
+    parents = [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        position = bisect.bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_index.append(k)
+        else:
+            tails[position] = j
+            tail_index[position] = k
+        parents[k] = tail_index[position - 1] if position else -1
+    chain = []
+    k = tail_index[-1] if tail_index else -1
+    while k != -1:
+        chain.append(pairs[k])
+        k = parents[k]
+    return chain[::-1]
+
+def _anchor_matches(a: list, b: list, a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> list:
+    """
+    Matched (i, j) token pairs of one range from its anchor chain, trying n-grams from
+    ANCHOR_NGRAM words down to one. Empty if the range has no anchors at all.
+    """
+    for n in range(ANCHOR_NGRAM, 0, -1):
+        chain = _longest_increasing_chain(_unique_ngram_pairs(a, b, a_lo, a_hi, b_lo, b_hi, n))
+        if not chain:
+            continue
+        matches = []
+        for i, j in chain:
+            for t in range(n):
+                # Consecutive anchors often overlap; keep the pairs monotonic.
+                if not matches or (i + t > matches[-1][0] and j + t > matches[-1][1]):
+                    matches.append((i + t, j + t))
+        return matches
+    return []
+
+def align_tokens(a: list, b: list) -> list:
+    """
+    Aligns two token lists.
+
+    Returns:
+        list: Matched (i, j) index pairs, increasing in both i and j, with a[i] == b[j].
+    """
+    matches = []
+    pending = [(0, len(a), 0, len(b))] # ranges still to align, processed left to right
+    while pending:
+        a_lo, a_hi, b_lo, b_hi = pending.pop()
+        if a_lo >= a_hi or b_lo >= b_hi:
+            continue
+        found = _anchor_matches(a, b, a_lo, a_hi, b_lo, b_hi)
+        if not found:
+            if (a_hi - a_lo) * (b_hi - b_lo) <= MAX_GAP_CELLS:
+                blocks = SequenceMatcher(None, a[a_lo:a_hi], b[b_lo:b_hi], autojunk=False).get_matching_blocks()
+                matches.extend((a_lo + block.a + t, b_lo + block.b + t) for block in blocks for t in range(block.size))
+            continue
+        # Matched pairs are final; the gaps around them are aligned on their own.
+        matches.extend(found)
+        bounds = [(a_lo - 1, b_lo - 1)] + found + [(a_hi, b_hi)]
+        for (i0, j0), (i1, j1) in reversed(list(zip(bounds, bounds[1:]))):
+            pending.append((i0 + 1, i1, j0 + 1, j1))
+    matches.sort()
+    return matches
+
+
+# ----------------------------------------------- Segment Pairs -----------------------------------------------
+
+def split_segments(text: str, granularity: str) -> list:
+    """(start, end) character spans of the paragraphs, lines or sentences of `text`; together they cover it."""
+    if granularity not in _SEGMENT_RES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    spans = []
+    for match in _SEGMENT_RES[granularity].finditer(text):
+        if match.end() > match.start():
+            spans.append((match.start(), match.end()))
+    return spans
+
+def align_segments(ocr_text: str, clean_text: str, granularity: str = GRANULARITY, min_coverage: float = MIN_COVERAGE) -> list:
+    """
+    Cuts the clean text into segments and finds the OCR text that corresponds to each one.
+
+    OCR boundaries are placed where the alignment maps each clean segment's first word (or at
+    the line break just before it, so a leading dash or quote stays with its line), which
+    means consecutive OCR slices never overlap or skip text. `coverage` is the fraction of the
+    segment's clean words that were aligned to an identical OCR word.
+
+    Returns:
+        list: {"ocr", "clean", "coverage"} dicts in text order, without empty or poorly aligned segments.
+    """
+    ocr_tokens, ocr_spans = tokenize(ocr_text)
+    clean_tokens, clean_spans = tokenize(clean_text)
+    clean_starts = [start for start, _ in clean_spans]
+    matches = align_tokens(ocr_tokens, clean_tokens)
+    matched_i = [i for i, _ in matches]
+    matched_j = [j for _, j in matches]
+
+    def ocr_boundary(j: int) -> int:
+        """OCR token index corresponding to clean token index j."""
+        k = bisect.bisect_left(matched_j, j)
+        if k < len(matches):
+            return max(matched_i[k] - (matched_j[k] - j), matched_i[k - 1] + 1 if k else 0)
+        if matches:
+            return min(matched_i[-1] + (j - matched_j[-1]), len(ocr_tokens))
+        return 0
+
+    def ocr_char_boundary(i: int) -> int:
+        """Character offset where the OCR slice starting at token i begins."""
+        if i == 0:
+            return 0
+        if i >= len(ocr_tokens):
+            return len(ocr_text)
+        gap_start, start = ocr_spans[i - 1][1], ocr_spans[i][0]
+        newline = ocr_text.rfind("\n", gap_start, start)
+        return newline + 1 if newline != -1 else start
+
+    segments = split_segments(clean_text, granularity)
+    token_bounds = [bisect.bisect_left(clean_starts, start) for start, _ in segments] + [len(clean_tokens)]
+    ocr_bounds = [0] + [ocr_boundary(j) for j in token_bounds[1:-1]] + [len(ocr_tokens)]
+    for k in range(1, len(ocr_bounds)):
+        ocr_bounds[k] = max(ocr_bounds[k], ocr_bounds[k - 1])
+    char_bounds = [ocr_char_boundary(i) for i in ocr_bounds]
+
+    pairs = []
+    for k, (start, end) in enumerate(segments):
+        j_lo, j_hi = token_bounds[k], token_bounds[k + 1]
+        if j_hi == j_lo:
+            continue
+        aligned = bisect.bisect_left(matched_j, j_hi) - bisect.bisect_left(matched_j, j_lo)
+        coverage = aligned / (j_hi - j_lo)
+        if coverage < min_coverage:
+            continue
+        pairs.append({
+            "ocr": ocr_text[char_bounds[k]:char_bounds[k + 1]].strip(),
+            "clean": clean_text[start:end].strip(),
+            "coverage": round(coverage, 4),
+        })
+    return pairs
+
+
+def main():
+    """Aligns a whole book (all chapters joined) and writes its segment pairs as a JSONL dataset."""
+    try:
+        with open(INPUT_OCR_PATH, 'r', encoding='utf-8') as f:
+            ocr_dict = json.load(f)
+        with open(INPUT_CLEAN_PATH, 'r', encoding='utf-8') as f:
+            clean_dict = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error loading input files: {e}")
+        return
+
+    # The two files do not list their chapters in the same order; join both in the OCR file's order.
+    keys = [key for key in ocr_dict if key in clean_dict]
+    ocr_text = "\n\n".join(ocr_dict[key] for key in keys)
+    clean_text = "\n\n".join(clean_dict[key] for key in keys)
+
+    print(f"Aligning {len(ocr_text)} OCR characters with {len(clean_text)} clean characters by {GRANULARITY}...")
+    pairs = align_segments(ocr_text, clean_text, GRANULARITY, MIN_COVERAGE)
+    count = write_dataset_jsonl(((str(k), pair) for k, pair in enumerate(pairs)), OUTPUT_PATH)
+    print(f"{count} segment pairs saved to: {OUTPUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
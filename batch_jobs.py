@@ -0,0 +1,197 @@
+import json
+import os
+import time
+
+# --- Configuration ---
+BATCH_DIR = "batch" # Where request/result JSONL files are written by default
+BATCH_POLL_SECONDS = 30 # How often to poll a submitted Gemini batch job
+
+# Every line of a requests file is {"key": ..., "request": GenerateContentRequest}, and every line
+# of a results file is {"key": ..., "response": GenerateContentResponse} or {"key": ..., "error": ...}.
+# This is the JSONL layout accepted and produced by the Gemini Batch API.
+#
+# Between the prepare and ingest phases of main.py and judge_LLM.py, a requests file is either sent
+# to the Gemini Batch API (`submit_gemini_batch`, then `download_gemini_batch` once the job is done)
+# or answered here, request by request, by any provider (`run_batch_locally`); `python cli.py batch`
+# runs these steps.
+
+
+def batch_path(name: str) -> str:
+    """Path of a batch file inside BATCH_DIR."""
+    return os.path.join(BATCH_DIR, name)
+
+
+def write_batch_requests(requests, path: str, system_instruction: str = None, response_schema: dict = None) -> int:
+    """
+    Writes prompts as a JSONL batch request file.
+
+    Args:
+        requests: Iterable of (key, prompt) pairs. Keys must be unique and are echoed back in the results.
+        path (str): Output JSONL path.
+        system_instruction (str): Sent with every request as its system instruction, if given.
+        response_schema (dict): JSON Schema every response must follow, if given.
+
+    Returns:
+        int: Number of requests written.
+    """
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    shared = {}
+    if system_instruction is not None:
+        shared["system_instruction"] = {"parts": [{"text": system_instruction}]}
+    if response_schema is not None:
+        shared["generation_config"] = {"response_mime_type": "application/json", "response_json_schema": response_schema}
+
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for key, prompt in requests:
+            line = {
+                "key": str(key),
+                "request": {"contents": [{"role": "user", "parts": [{"text": prompt}]}], **shared},
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Wrote {count} batch requests to '{path}'")
+    return count
+
+
+def read_batch_requests(path: str):
+    """
+    Yields (key, prompt, options) from a JSONL batch request file, where options holds the
+    request's `system_instruction` and `response_schema` (None when absent).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            request = entry["request"]
+            parts = request["contents"][0]["parts"]
+            system = request.get("system_instruction")
+            options = {
+                "system_instruction": "".join(part.get("text", "") for part in system["parts"]) if system else None,
+                "response_schema": request.get("generation_config", {}).get("response_json_schema"),
+            }
+            yield entry["key"], "".join(part.get("text", "") for part in parts), options
+
+
+def _response_text(response: dict) -> str:
+    """Concatenates the text parts of the first candidate of a GenerateContentResponse."""
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return None
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+
+def read_batch_results(path: str) -> dict:
+    """
+    Reads a JSONL batch results file.
+
+    Returns:
+        dict: Maps each request key to its response text. Failed requests map to a
+              "[BATCH_ERROR: ...]" placeholder so callers can treat them like API errors.
+    """
+    results = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Warning: skipping malformed line {line_number} in '{path}'.")
+                continue
+            key = entry.get("key")
+            if key is None:
+                print(f"Warning: skipping line {line_number} in '{path}' because it has no 'key'.")
+                continue
+            text = _response_text(entry["response"]) if "response" in entry else None
+            if text is None:
+                text = f"[BATCH_ERROR: {entry.get('error', 'no candidates returned')}]"
+            results[key] = text
+    print(f"Read {len(results)} batch results from '{path}'")
+    return results
+
+
+def run_batch_locally(requests_path: str, results_path: str, generate_fn) -> None:
+    """
+    Local stand-in for a batch endpoint: answers every request with
+    `generate_fn(prompt, system_instruction=..., response_schema=...)` (e.g. a provider's
+    `generate` with the model bound) and writes a results file in the same format the real
+    endpoint produces.
+    """
+    output_dir = os.path.dirname(results_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with open(results_path, "w", encoding="utf-8") as f:
+        for key, prompt, options in read_batch_requests(requests_path):
+            try:
+                text = generate_fn(prompt, **options)
+                entry = {"key": key, "response": {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}}
+            except Exception as e:
+                entry = {"key": key, "error": str(e)}
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"Local batch results written to '{results_path}'")
+
+
+def job_path(requests_path: str) -> str:
+    """File holding the name of the batch job submitted for a requests file."""
+    return f"{requests_path}.job"
+
+
+def read_job_name(requests_path: str) -> str:
+    """
+    The name of the batch job last submitted for a requests file (see `submit_gemini_batch`).
+
+    Raises:
+        FileNotFoundError: No job was submitted for it.
+    """
+    with open(job_path(requests_path), "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def submit_gemini_batch(client, requests_path: str, model_name: str, display_name: str = None):
+    """
+    Uploads a requests file and starts a Gemini batch job. Returns the job, whose name is also
+    saved next to the requests file (see `read_job_name`) for `download_gemini_batch`.
+    """
+    uploaded = client.files.upload(
+        file=requests_path,
+        config={"display_name": display_name or os.path.basename(requests_path), "mime_type": "jsonl"},
+    )
+    job = client.batches.create(model=model_name, src=uploaded.name, config={"display_name": display_name})
+    with open(job_path(requests_path), "w", encoding="utf-8") as f:
+        f.write(job.name + "\n")
+    print(f"Submitted batch job '{job.name}' for '{requests_path}'")
+    return job
+
+
+def download_gemini_batch(client, job_name: str, results_path: str) -> bool:
+    """
+    Waits for a Gemini batch job to finish and saves its results file.
+
+    Returns:
+        bool: True if the job succeeded and results were written.
+    """
+    finished_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+    job = client.batches.get(name=job_name)
+    while job.state.name not in finished_states:
+        print(f"Batch job '{job_name}' is {job.state.name}; checking again in {BATCH_POLL_SECONDS}s...")
+        time.sleep(BATCH_POLL_SECONDS)
+        job = client.batches.get(name=job_name)
+
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        print(f"Batch job '{job_name}' ended in state {job.state.name}: {job.error}")
+        return False
+
+    output_dir = os.path.dirname(results_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(results_path, "wb") as f:
+        f.write(client.files.download(file=job.dest.file_name))
+    print(f"Batch results for '{job_name}' saved to '{results_path}'")
+    return True
@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+try:
+    import resource # Unix only; peak RSS is not reported elsewhere
+except ImportError:
+    resource = None
+
+# Measures how the full clean -> metrics -> judge pipeline of main.py scales, without spending API
+# quota: every LLM call goes to a fake provider with configurable latency, errors and 429 bursts,
+# while pre-cleaning, triage, metrics, the response cache and the JSONL checkpoint all run for real.
+#
+# Each corpus size runs in its own process, so peak RSS is that run's own. Per-stage latency is
+# wall time around the stage's call in main.py, including the wait for its rate limiter token;
+# "item" is an item's whole time in the pipeline, queueing for a free request slot included.
+# Runs read this file's configuration in their own process: edit it here rather than patching it.
+
+# --- Configuration ---
+CORPUS_SIZES = [100, 10_000, 100_000] # Synthetic segments per run
+SOURCE_PATH = "dataset/eng/the_vampyre_subset.json" # Real pairs the synthetic corpora are built from
+OUTPUT_PATH = "results/benchmark_report.json"
+SEED = 42
+SEND_ALL_TO_LLM = True # Disable triage, so every segment is cleaned and judged
+
+# Fake provider: latency in seconds, drawn per request from
+#   {"distribution": "constant", "seconds": s}
+#   {"distribution": "uniform", "low": a, "high": b}
+#   {"distribution": "lognormal", "median": m, "sigma": s}
+LATENCY = {"distribution": "lognormal", "median": 0.02, "sigma": 0.5}
+ERROR_RATE = 0.01 # Fraction of requests failing with a server error
+RATE_LIMIT_BURST_EVERY_SECONDS = 30.0 # Every this many seconds...
+RATE_LIMIT_BURST_SECONDS = 1.0 # ...every request fails with a 429 for this long (0 disables bursts)
+ERROR_LATENCY_SECONDS = 0.005 # Failed requests return this fast
+MAX_CONCURRENT = 64 # Per-model limits given to main.py for the fake cleaner and judge
+REQUESTS_PER_MINUTE = 1_000_000
+
+STAGES = ["pre_process", "clean", "metrics", "judge", "write", "item"]
+
+
+# ----------------------------------------------- Fake Provider -----------------------------------------------
+
+class FakeLLMError(Exception):
+    """A simulated failure; `status` is the HTTP status a real backend would have returned."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status} {message}")
+        self.status = status
+
+
+def _make_fake_provider_class():
+    # Defined lazily so spawned benchmark processes import llm_providers only once they run.
+    from llm_providers import LLMProvider
+    from mock_llm_server import mock_completion
+
+    class FakeProvider(LLMProvider):
+        """Answers like the "mock" provider after a random delay, failing at ERROR_RATE and during 429 bursts."""
+
+        name = "fake"
+
+        def __init__(self, latency: dict = LATENCY, error_rate: float = ERROR_RATE, seed: int = SEED):
+            self.latency = latency
+            self.error_rate = error_rate
+            self._rng = random.Random(seed)
+            self._lock = threading.Lock()
+            self._start = time.monotonic()
+            self.requests = 0
+            self.errors = 0
+            self.rate_limited = 0
+
+        def _delay(self) -> float:
+            kind = self.latency["distribution"]
+            if kind == "constant":
+                return self.latency["seconds"]
+            if kind == "uniform":
+                return self._rng.uniform(self.latency["low"], self.latency["high"])
+            if kind == "lognormal":
+                return self._rng.lognormvariate(np.log(self.latency["median"]), self.latency["sigma"])
+            raise ValueError(f"Unknown latency distribution: {kind}")
+
+        def _in_burst(self) -> bool:
+            if not RATE_LIMIT_BURST_SECONDS:
+                return False
+            # Bursts close each interval, so short runs start with a healthy backend.
+            elapsed = time.monotonic() - self._start
+            return elapsed % RATE_LIMIT_BURST_EVERY_SECONDS >= RATE_LIMIT_BURST_EVERY_SECONDS - RATE_LIMIT_BURST_SECONDS
+
+        def generate(self, prompt: str, model: str, timeout: float = None,
+                     system_instruction: str = None, response_schema: dict = None) -> str:
+            with self._lock:
+                self.requests += 1
+                if self._in_burst():
+                    self.rate_limited += 1
+                    failure = FakeLLMError(429, "Too Many Requests")
+                elif self._rng.random() < self.error_rate:
+                    self.errors += 1
+                    failure = FakeLLMError(500, "Internal Server Error")
+                else:
+                    failure = None
+                    delay = self._delay()
+            if failure is not None:
+                time.sleep(ERROR_LATENCY_SECONDS)
+                raise failure
+            time.sleep(delay)
+            return mock_completion(prompt, model, system_instruction, structured=response_schema is not None)
+
+    return FakeProvider
+
+
+# ----------------------------------------------- Corpus and Timing -----------------------------------------------
+
+def synthetic_corpus(size: int, source_path: str = SOURCE_PATH, seed: int = SEED) -> dict:
+    """
+    `size` segments drawn at random from the real pairs of `source_path`. A segment number is
+    appended to both texts, so no two segments share a cache entry.
+    """
+    from dataset_handler import load_dataset
+    source = list(load_dataset(source_path).values())
+    rng = random.Random(seed)
+    corpus = {}
+    for k in range(size):
+        pair = rng.choice(source)
+        corpus[str(k)] = {"ocr": f"{pair['ocr']} ({k})", "clean": f"{pair['clean']} ({k})"}
+    return corpus
+
+class StageTimer:
+    """Collects wall-clock durations per stage, from any thread."""
+
+    def __init__(self):
+        self.durations = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    def wrap(self, stage: str, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def wrap_async(self, stage: str, function):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self) -> dict:
+        """{stage: {"count", "p50", "p95", "p99"}} in milliseconds."""
+        report = {}
+        for stage, values in self.durations.items():
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            report[stage] = {"count": len(values), "p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3)}
+        return report
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+
+# ----------------------------------------------- Benchmark Runs -----------------------------------------------
+
+def run_benchmark(size: int) -> dict:
+    """Runs main.py's async pipeline over a synthetic corpus of `size` segments and returns its report."""
+    import main
+    from llm_cache import response_cache
+    from llm_providers import register_provider
+    from native_rouge import NativeRouge
+    from result_writer import JsonlResultWriter, finalize_results
+    from stage_store import stage_store
+
+    corpus = synthetic_corpus(size)
+    fake = _make_fake_provider_class()()
+    register_provider("fake", lambda: fake)
+    limits = {"max_concurrent": MAX_CONCURRENT, "requests_per_minute": REQUESTS_PER_MINUTE}
+    main.MODEL_CONFIGS["Fake"] = {"provider": "fake", "model": "fake-cleaner", **limits}
+    main.MODELS_TO_RUN = ["Fake"]
+    main.JUDGE_CONFIG = {"provider": "fake", "model": "fake-judge", **limits}
+    if SEND_ALL_TO_LLM:
+        main.TRIAGE_THRESHOLD = None
+
+    # Stages are looked up in main's globals at call time, so wrapping them there times every call.
+    timer = StageTimer()
+    for stage, name in [("pre_process", "prepare_ocr_text"), ("clean", "clean_document"),
+                        ("metrics", "evaluate_cleaning"), ("judge", "judge_with_provider")]:
+        setattr(main, name, timer.wrap(stage, getattr(main, name)))
+    main.process_item_async = timer.wrap_async("item", main.process_item_async)
+
+    work_dir = tempfile.mkdtemp(prefix="ocr_benchmark_")
+    response_cache.cache_dir = os.path.join(work_dir, "cache")
+    stage_store.root = os.path.join(work_dir, "stages")
+    checkpoint_path = os.path.join(work_dir, "results.jsonl")
+    try:
+        start = time.perf_counter()
+        # The pipeline's per-item progress lines are discarded, so the console does not dominate.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+                JsonlResultWriter(checkpoint_path, resume=False) as writer:
+            writer.write = timer.wrap("write", writer.write)
+            asyncio.run(main.run_pipeline_async(NativeRouge(), corpus, writer))
+        pipeline_seconds = time.perf_counter() - start
+        finalize_start = time.perf_counter()
+        finalize_results(checkpoint_path, os.path.join(work_dir, "results.json"), order=list(corpus))
+        finalize_seconds = time.perf_counter() - finalize_start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "segments": size,
+        "pipeline_seconds": round(pipeline_seconds, 3),
+        "items_per_second": round(size / pipeline_seconds, 2),
+        "finalize_seconds": round(finalize_seconds, 3),
+        "llm_requests": fake.requests,
+        "llm_errors": fake.errors,
+        "llm_rate_limited": fake.rate_limited,
+        "stages_ms": timer.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_isolated(size: int) -> dict:
+    """`run_benchmark` in a fresh process, so memory from earlier runs does not inflate peak RSS."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_benchmark, size).result()
+
+def print_report(report: dict) -> None:
+    print(f"\n=== {report['segments']} segments ===")
+    print(f"Throughput: {report['items_per_second']} items/s ({report['pipeline_seconds']}s, "
+          f"finalize {report['finalize_seconds']}s), peak RSS {report['peak_rss_mb']} MB")
+    print(f"LLM requests: {report['llm_requests']} ({report['llm_errors']} errors, {report['llm_rate_limited']} rate limited)")
+    print(f"{'stage':<12}{'count':>9}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage, stats in report["stages_ms"].items():
+        print(f"{stage:<12}{stats['count']:>9}{stats['p50']:>11.2f}{stats['p95']:>11.2f}{stats['p99']:>11.2f}")
+
+
+def main():
+    """Benchmarks every size of CORPUS_SIZES and saves the reports to OUTPUT_PATH."""
+    print(f"Fake LLM: {LATENCY}, error rate {ERROR_RATE}, "
+          f"429 bursts of {RATE_LIMIT_BURST_SECONDS}s every {RATE_LIMIT_BURST_EVERY_SECONDS}s")
+    reports = []
+    for size in CORPUS_SIZES:
+        report = run_isolated(size)
+        print_report(report)
+        reports.append(report)
+
+    output_dir = os.path.dirname(OUTPUT_PATH)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    try:
+        with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+            json.dump({"latency": LATENCY, "error_rate": ERROR_RATE, "runs": reports}, f, indent=2)
+        print(f"\nBenchmark reports saved to: {OUTPUT_PATH}")
+    except IOError as e:
+        print(f"\nError saving benchmark reports: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import re
+
+# --- Configuration ---
+MAX_CHUNK_TOKENS = 1500 # Upper bound on the estimated prompt tokens of OCR text per chunk
+OVERLAP_TOKENS = 100 # Text repeated at the start of each chunk so the model sees context
+CHARS_PER_TOKEN = 4 # Rough chars-per-token ratio of Gemini tokenizers on Latin-script text
+MIN_OVERLAP_MATCH = 3 # Words that must match to recognise the overlap between cleaned chunks
+
+_PARAGRAPH_RE = re.compile(r".+?(?:\n\s*\n\s*|$)", re.DOTALL)
+_SENTENCE_RE = re.compile(r".+?(?:[.!?;:][\"'»”’)\]]*\s+|$)", re.DOTALL)
+_WORD_RE = re.compile(r"\S+\s*")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; no tokenizer round trip is needed to decide where to cut."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _split_units(text: str, max_tokens: int) -> list:
+    """
+    Splits text into units no larger than `max_tokens`: paragraphs, then sentences of paragraphs
+    that are too long, then words of sentences that are still too long. Each unit keeps its
+    trailing whitespace, so joining the units gives back the original text.
+    """
+    units = []
+    for paragraph in _PARAGRAPH_RE.findall(text):
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_RE.findall(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+                continue
+            piece = ""
+            for word in _WORD_RE.findall(sentence):
+                if piece and estimate_tokens(piece + word) > max_tokens:
+                    units.append(piece)
+                    piece = ""
+                piece += word
+            if piece:
+                units.append(piece)
+    # Blank lines stay with the unit before them, so every unit carries some text.
+    merged = []
+    for unit in units:
+        if merged and not unit.strip():
+            merged[-1] += unit
+        elif unit:
+            merged.append(unit)
+    return merged
+
+
+def _overlap_units(units: list, overlap_tokens: int) -> list:
+    """
+    The tail of a finished chunk that is carried over as the head of the next one: its last whole
+    units up to `overlap_tokens`, or, when those hold too few words for `stitch_chunks` to find
+    again, the chunk's last words up to `overlap_tokens`.
+    """
+    overlap, size = [], 0
+    for unit in reversed(units):
+        unit_tokens = estimate_tokens(unit)
+        if size + unit_tokens > overlap_tokens:
+            break
+        overlap.insert(0, unit)
+        size += unit_tokens
+    if len(_WORD_RE.findall("".join(overlap))) >= 2 * MIN_OVERLAP_MATCH:
+        return overlap
+    words = _WORD_RE.findall("".join(units[-len(overlap) - 1:]))
+    tail = ""
+    while words and estimate_tokens(words[-1] + tail) <= overlap_tokens:
+        tail = words.pop() + tail
+    return [tail] if tail else []
+
+
+def chunk_text(text: str, max_tokens: int = MAX_CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS) -> list:
+    """
+    Cuts text into chunks of at most `max_tokens` estimated tokens on paragraph or sentence
+    boundaries. Every chunk after the first starts with the last whole units of the previous
+    chunk, up to `overlap_tokens`, which `stitch_chunks` later removes again.
+
+    Returns:
+        list: The chunk strings. Text that already fits is returned as a single chunk.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks = []
+    current = [] # units of the chunk being built
+    current_tokens = 0
+    for unit in _split_units(text, max_tokens - overlap_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("".join(current))
+            overlap = _overlap_units(current, overlap_tokens)
+            current, current_tokens = overlap, sum(map(estimate_tokens, overlap))
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _find_seam(tail: list, head: list) -> tuple:
+    """
+    Finds where the end of `tail` and the start of `head` repeat the same text.
+
+    Every maximal run of at least MIN_OVERLAP_MATCH identical words is a candidate. The true
+    overlap is the one closest to the seam, so the run with the fewest words of `tail` after it
+    plus words of `head` before it wins; a longer run breaks ties. This keeps a phrase that
+    happens to repeat elsewhere in the window from cutting away real text.
+
+    Returns:
+        tuple: (index in tail, index in head) where the run starts, or None if there is none.
+    """
+    best, best_cost = None, None
+    run = [0] * (len(head) + 1) # length of the common run ending at (i, j), one row at a time
+    for i in range(1, len(tail) + 1):
+        previous_run, run = run, [0] * (len(head) + 1)
+        for j in range(1, len(head) + 1):
+            if tail[i - 1] == head[j - 1]:
+                run[j] = previous_run[j - 1] + 1
+        for j in range(1, len(head) + 1):
+            length = run[j]
+            # Only consider runs that cannot be extended further down the diagonal.
+            if length < MIN_OVERLAP_MATCH or (i < len(tail) and j < len(head) and tail[i] == head[j]):
+                continue
+            cost = (len(tail) - i) + (j - length)
+            if best_cost is None or (cost, -length) < (best_cost, -best[2]):
+                best, best_cost = (i - length, j - length, length), cost
+    return best[:2] if best else None
+
+
+def stitch_chunks(cleaned_chunks: list, overlap_tokens: int = OVERLAP_TOKENS) -> str:
+    """
+    Joins cleaned chunks, removing the text duplicated by the chunk overlap.
+
+    The model may have corrected words inside the overlap differently in the two chunks, so the
+    overlap is found as a run of identical words between the last `overlap_tokens` words
+    stitched so far and the first `overlap_tokens` words of the next chunk (see `_find_seam`);
+    the text is cut there and continues from the next chunk. If no run of MIN_OVERLAP_MATCH
+    words is found, the chunks are simply concatenated.
+    """
+    window = overlap_tokens # words searched on each side; a word is usually more than one token
+    stitched = []
+    for chunk in cleaned_chunks:
+        words = _WORD_RE.findall(chunk.strip())
+        if not stitched:
+            stitched = words
+            continue
+        tail_start = max(0, len(stitched) - window)
+        tail = [w.strip() for w in stitched[tail_start:]]
+        head = [w.strip() for w in words[:window]]
+        seam = _find_seam(tail, head)
+        if seam:
+            stitched = stitched[:tail_start + seam[0]] + words[seam[1]:]
+        else:
+            if stitched and not stitched[-1][-1:].isspace():
+                stitched[-1] += " "
+            stitched += words
+    return "".join(stitched)
@@ -1,8 +1,20 @@
 import json
-import os
-from google import genai
 from dotenv import load_dotenv
-import time # To handle potential rate limits
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from chunker import chunk_text, stitch_chunks
+from dataset_handler import load_dataset
+
+from instrumentation import record_cache_hit
+from llm_cache import response_cache
+from llm_client import get_client
+from llm_providers import GeminiProvider, LLMProvider, generate_with_retries, get_provider, is_llm_error
+from rate_limiter import AdaptiveLimiter
+
+if TYPE_CHECKING: # The Gemini SDK is only loaded when a client is created (llm_client.py)
+    from google import genai
 
 load_dotenv()
 
@@ -10,38 +22,93 @@ GEMINI_MODEL_NAME = "gemini-2.0-flash" # Or other suitable Gemini model
 INPUT_PATH = "dataset/eng/the_vampyre_subset.json" # Path to your dataset file
 OUTPUT_PATH = "clean_judge_files/cleaning_results.json" 
 NUM_ITEM_TO_PROCESS = 6
-
-api_key = os.getenv("GOOGLE_API_KEY")
+CLEAN_PROMPT_VERSION = "v1" # Bump whenever the cleaning prompt changes, to invalidate cached responses
+MAX_CHUNK_WORKERS = 4 # Chunks of one long text cleaned in parallel (see chunker.MAX_CHUNK_TOKENS)
+REQUESTS_PER_MINUTE = 60 # Ceiling of the adaptive limiter used when run as a script
 
 # ----------------------------------------------- LLM Cleaning Functions -----------------------------------------------
-def clean_with_gemini(client: genai.Client, ocr_text: str) -> str:
-    """Cleans OCR text using Google Gemini (Client API style)."""
+def build_clean_prompt(ocr_text: str) -> str:
+    """Builds the cleaning prompt; shared by the per-item calls and the batch request writer."""
+    return f"""Clean the following OCR text. Correct spelling errors, fix punctuation, remouve also the \n present in the text. Preserve the original
+    meaning and style. Do not add new information or summarize. Return only the cleaned text.
+
+OCR Text:
+---
+{ocr_text}
+---
+Cleaned Text:
+"""
+
+def clean_with_provider(provider: LLMProvider, model_name: str, ocr_text: str, limiter: AdaptiveLimiter = None) -> str:
+    """
+    Cleans OCR text with any backend of llm_providers.py, retrying transient failures (see
+    llm_providers.generate_with_retries). Cached texts need no request and no limiter slot.
+    Errors that outlast the retries are returned as an "[LLM_ERROR: ...]" placeholder instead of raised.
+    """
     if not ocr_text.strip():
         return ""
 
+    cache_key = response_cache.make_key(model_name, CLEAN_PROMPT_VERSION, ocr_text)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        record_cache_hit()
+        return cached
+
+    try:
+        cleaned_text = generate_with_retries(provider, build_clean_prompt(ocr_text), model_name, limiter)
+    except Exception as e:
+        return f"[LLM_ERROR: {provider.name}/{model_name}: {e}]"
+    if cleaned_text is None:
+        return f"[LLM_ERROR: {provider.name}/{model_name} returned no text]"
+    response_cache.put(cache_key, cleaned_text)
+    return cleaned_text
+
+def clean_with_gemini(client: "genai.Client", ocr_text: str) -> str:
+    """
+    Cleans OCR text using Google Gemini (Client API style).
+    If `client` is None, the shared pooled client is used.
+    """
     try:
-        # Initialize the client. Passing api_key explicitly is robust.
-        client = genai.Client(api_key=api_key)
+        # Reuse the pooled client instead of building a new one (and new connections) per call.
+        provider = get_provider("gemini") if client is None else GeminiProvider(client)
     except Exception as e:
         print(f"Error initializing Gemini Client (genai.Client): {e}")
         print("This could be due to an invalid API key, network issues, or problems with the 'google-generativeai' library.")
         return f"[GEMINI_CLIENT_INIT_ERROR: {e}]"
+    return clean_with_provider(provider, GEMINI_MODEL_NAME, ocr_text)
 
-    contents = f"""Clean the following OCR text. Correct spelling errors, fix punctuation, remouve also the \n present in the text. Preserve the original
-    meaning and style. Do not add new information or summarize. Return only the cleaned text.
+def clean_document(provider: LLMProvider, model_name: str, ocr_text: str, limiter: AdaptiveLimiter = None) -> str:
+    """
+    Cleans OCR text of any length. Text longer than chunker.MAX_CHUNK_TOKENS is cut into
+    overlapping chunks that are cleaned in parallel and stitched back together; shorter text
+    is a single `clean_with_provider` call.
+    If `limiter` is given, every request goes through it (see rate_limiter.AdaptiveLimiter).
 
-OCR Text:
----
-{ocr_text}
----
-Cleaned Text:
-"""
-    response = client.models.generate_content(
-        model=GEMINI_MODEL_NAME,
-        contents=contents
-    )
-    #print(response.text)
-    return response.text
+    Returns:
+        str: The cleaned text, or the first error placeholder returned for any chunk.
+    """
+    def clean_chunk(chunk: str) -> str:
+        return clean_with_provider(provider, model_name, chunk, limiter)
+
+    chunks = chunk_text(ocr_text)
+    if len(chunks) == 1:
+        return clean_chunk(ocr_text)
+
+    print(f"Cleaning {len(chunks)} chunks of a {len(ocr_text)}-character text with {model_name}...")
+    # Each chunk runs in a copy of the caller's context, so its requests count towards the caller's span.
+    contexts = [contextvars.copy_context() for _ in chunks]
+    with ThreadPoolExecutor(max_workers=MAX_CHUNK_WORKERS) as executor:
+        cleaned_chunks = list(executor.map(lambda context, chunk: context.run(clean_chunk, chunk), contexts, chunks))
+
+    for cleaned in cleaned_chunks:
+        if is_llm_error(cleaned):
+            return cleaned
+    return stitch_chunks(cleaned_chunks)
+
+def clean_document_with_gemini(client: "genai.Client", ocr_text: str, limiter: AdaptiveLimiter = None) -> str:
+    """`clean_document` with Gemini; if `client` is None, the shared pooled client is used."""
+    provider = get_provider("gemini") if client is None else GeminiProvider(client)
+    return clean_document(provider, GEMINI_MODEL_NAME, ocr_text, limiter)
 
 #--------------------------------------------------------------------------------------------------------------------------------
 
@@ -54,24 +121,29 @@ def main():
     """
   
     try:
-        with open(INPUT_PATH, 'r', encoding='utf-8') as f:
-            data_dict = json.load(f)
+        # Streamed: only the items to process are read, from a JSON object or a JSONL dataset.
+        data_dict = load_dataset(INPUT_PATH, NUM_ITEM_TO_PROCESS)
         print(f"Successfully loaded {len(data_dict)} items from '{INPUT_PATH}'")
     except FileNotFoundError:
         print(f"Error: Input file not found at '{INPUT_PATH}'")
         return
-    except json.JSONDecodeError:
+    except ValueError: # json.JSONDecodeError is a ValueError
         print(f"Error: Could not decode JSON from '{INPUT_PATH}'. Please check its format.")
         return
-    
 
-    list_of_items = list(data_dict.values())
-    print(f"Total items (segments with ocr/clean pairs) to process: {len(list_of_items)}")
-
-    subset_to_process = list_of_items[:NUM_ITEM_TO_PROCESS]
+    subset_to_process = list(data_dict.values())
     print(f"\nProcessing {len(subset_to_process)} items from the dataset...")
 
+    try:
+        client = get_client("gemini", GEMINI_MODEL_NAME)
+    except Exception as e:
+        print(f"Fatal Error: Could not initialize genai.Client. Check API Key. Error: {e}")
+        return
+
     results = []
+    # Paces the requests to the quota instead of a fixed sleep after each item: full speed while
+    # requests succeed, backing off when the API answers 429.
+    limiter = AdaptiveLimiter(REQUESTS_PER_MINUTE, MAX_CHUNK_WORKERS)
 
     # --- 3. Process Data ---
     for i, item in enumerate(subset_to_process):
@@ -83,15 +155,12 @@ def main():
         print(f"OCR Text (first 200 chars):\n{ocr_text[:200]}{'...' if len(ocr_text) > 200 else ''}")
 
         print("Cleaning with Gemini...")
-        gemini_cleaned_text = clean_with_gemini(ocr_text)
-        if "[GEMINI_" in gemini_cleaned_text: # Check if an error placeholder was returned
+        gemini_cleaned_text = clean_document_with_gemini(client, ocr_text, limiter)
+        if is_llm_error(gemini_cleaned_text): # Check if an error placeholder was returned
             print(f"Gemini cleaning failed for item {i+1}. Returned: {gemini_cleaned_text}")
         else:
             print(f"Gemini Cleaned Text (first 200 chars):\n{gemini_cleaned_text[:200]}{'...' if len(gemini_cleaned_text) > 200 else ''}")
 
-    # To avoid hitting rate limits, we can add a sleep here.
-        time.sleep(1)
-
         results.append({
             "original_ocr": ocr_text,
             "ground_truth": ground_truth_clean_text,
@@ -107,6 +176,8 @@ def main():
     except IOError as e:
         print(f"\nError saving results to {OUTPUT_PATH}: {e}")
 
+    response_cache.report()
+
 
 if __name__ == "__main__":
     main()
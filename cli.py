@@ -0,0 +1,250 @@
+import argparse
+import sys
+
+# One command-line entry point for the whole workflow:
+#
+#   python cli.py build-dataset --selection sample --size 500 --output dataset/eng/sample.jsonl
+#   python cli.py clean --input dataset/eng/sample.jsonl --num-items 20
+#   python cli.py run --input dataset/eng/sample.jsonl --models Mock --num-items all
+#   python cli.py batch submit --requests batch/clean_requests.jsonl --model gemini-2.0-flash
+#   python cli.py extract --input results/full_pipeline_results.json --output extracted_data.json
+#   python cli.py judge --input extracted_data.json --backend prometheus --engine stub
+#   python cli.py evaluate --input clean_judge_files/cleaning_result_human.json
+#
+# Each command imports its module only when it runs, so the commands that only reshape JSON
+# (build-dataset, extract) start without loading the LLM SDKs, NumPy or pyarrow. Options override
+# the module's configuration constants for this run; anything not given keeps the value set in the
+# module, so every script still runs on its own as before (`python main.py`).
+
+
+def _configure(module, **values) -> None:
+    """Sets the configuration constants of `module` given on the command line (those not None)."""
+    for name, value in values.items():
+        if value is not None:
+            setattr(module, name, value)
+
+def _item_count(value: str):
+    """A --num-items value: a positive number, or "all" (None in the modules' configuration)."""
+    if value == "all":
+        return "all"
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number or 'all', got '{value}'")
+    if count < 1:
+        raise argparse.ArgumentTypeError("expected at least 1 item")
+    return count
+
+def _set_item_count(module, name: str, value) -> None:
+    if value is not None:
+        setattr(module, name, None if value == "all" else value)
+
+
+# ----------------------------------------------- Commands -----------------------------------------------
+
+def build_dataset(args) -> int:
+    import dataset_handler
+    _configure(dataset_handler, INPUT_OCR_PATH=args.ocr, INPUT_CLEAN_PATH=args.clean, OUTPUT_PATH=args.output,
+               SELECTION=args.selection, SUBSET_SIZE=args.size, SAMPLE_SEED=args.seed,
+               NUM_SHARDS=args.shards, SHARD_INDEX=args.shard_index)
+    dataset_handler.main()
+    return 0
+
+def clean(args) -> int:
+    import cleaner_LLM
+    _configure(cleaner_LLM, INPUT_PATH=args.input, OUTPUT_PATH=args.output, GEMINI_MODEL_NAME=args.model,
+               REQUESTS_PER_MINUTE=args.rpm)
+    _set_item_count(cleaner_LLM, "NUM_ITEM_TO_PROCESS", args.num_items)
+    cleaner_LLM.main()
+    return 0
+
+def judge(args) -> int:
+    import judge_LLM
+    _configure(judge_LLM, INPUT_PATH=args.input, OUTPUT_PATH=args.output, STAGE_DATASET_PATH=args.from_stages,
+               JUDGE_BACKEND=args.backend, GEMINI_MODEL_NAME=args.model, JUDGED_MODELS=args.judged_models,
+               BATCH_PHASE=args.batch_phase, REQUESTS_PER_MINUTE=args.rpm, PROMETHEUS_ENGINE=args.engine,
+               PROMETHEUS_MODEL_NAME=args.prometheus_model, PROMETHEUS_LANGUAGE=args.language,
+               PROMETHEUS_BATCH_SIZE=args.batch_size)
+    if args.output_texts:
+        judge_LLM.OUTPUT_TEXTS = True
+    judge_LLM.main()
+    return 0
+
+def evaluate(args) -> int:
+    import evaluator
+    _configure(evaluator, INPUT_PATH=args.input, JUDGE_PATH=args.judge, REPORT_PATH=args.report, RATERS=args.raters,
+               BOOTSTRAP_RESAMPLES=args.resamples, CONFIDENCE=args.confidence, SEED=args.seed)
+    if args.no_judge:
+        evaluator.JUDGE_PATH = None
+    evaluator.main()
+    return 0
+
+def extract(args) -> int:
+    import extracter
+    _configure(extracter, INPUT_PATH=args.input, OUTPUT_PATH=args.output, STAGE_DATASET_PATH=args.from_stages)
+    _set_item_count(extracter, "NUM_ITEM_TO_PROCESS", args.num_items)
+    extracter.main()
+    return 0
+
+def batch(args) -> int:
+    import batch_jobs
+    if args.action != "download" and args.model is None:
+        print(f"Error: {args.action} needs the --model answering the requests.")
+        return 2
+    if args.action == "run-local":
+        from llm_providers import generate_with_retries, get_provider
+        provider = get_provider(args.provider)
+        batch_jobs.run_batch_locally(args.requests, args.results,
+                                     lambda prompt, **options: generate_with_retries(provider, prompt, args.model, **options))
+        return 0
+    from llm_client import get_client # Imported here: it loads the Gemini SDK
+    client = get_client("gemini")
+    if args.action == "submit":
+        batch_jobs.submit_gemini_batch(client, args.requests, args.model)
+        return 0
+    job_name = args.job
+    if job_name is None:
+        try:
+            job_name = batch_jobs.read_job_name(args.requests)
+        except FileNotFoundError:
+            print(f"Error: no batch job was submitted for '{args.requests}'; give its name with --job.")
+            return 2
+    return 0 if batch_jobs.download_gemini_batch(client, job_name, args.results) else 1
+
+def run(args) -> int:
+    import main as pipeline
+    if args.models is not None:
+        unknown = [name for name in args.models if name not in pipeline.MODEL_CONFIGS]
+        if unknown:
+            print(f"Error: unknown models {unknown}; choose from {list(pipeline.MODEL_CONFIGS)}.")
+            return 2
+    if args.judge_provider is not None or args.judge_model is not None:
+        judge_config = dict(pipeline.JUDGE_CONFIG)
+        if args.judge_provider is not None:
+            judge_config["provider"] = args.judge_provider
+        if args.judge_model is not None:
+            judge_config["model"] = args.judge_model
+        pipeline.JUDGE_CONFIG = judge_config
+    _configure(pipeline, INPUT_PATH=args.input, OUTPUT_PATH=args.output, CHECKPOINT_PATH=args.checkpoint,
+               MODELS_TO_RUN=args.models, LANGUAGE=args.language, BATCH_PHASE=args.batch_phase,
+               SHARD_QUEUE_DIR=args.shard_queue, SHARD_SIZE=args.shard_size, SHARD_WORKERS=args.workers,
+               METRICS_EXPORT=args.metrics_export, RESULTS_STORE_DIR=args.results_store)
+    _set_item_count(pipeline, "NUM_ITEM_TO_PROCESS", args.num_items)
+    if args.no_resume:
+        pipeline.RESUME = False
+    if args.sync:
+        pipeline.ASYNC_MODE = False
+    if args.no_stage_store:
+        pipeline.USE_STAGE_STORE = False
+    if args.no_results_store:
+        pipeline.RESULTS_STORE_DIR = None
+    if args.full_results:
+        pipeline.COMPACT_RESULTS = False
+    pipeline.main()
+    return 0
+
+
+# ----------------------------------------------- Arguments -----------------------------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="OCR cleaning, judging and evaluation pipeline.")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    p = commands.add_parser("build-dataset", help="Build a JSONL dataset from the OCR and clean dumps (dataset_handler.py)")
+    p.add_argument("--ocr", metavar="PATH", help="OCR dump (JSON object keyed by ID)")
+    p.add_argument("--clean", metavar="PATH", help="Ground-truth dump (JSON object keyed by ID)")
+    p.add_argument("--output", metavar="PATH", help="JSONL dataset to write")
+    p.add_argument("--selection", choices=["all", "subset", "sample", "shard"])
+    p.add_argument("--size", type=int, help="Pairs kept by the 'subset' and 'sample' selections")
+    p.add_argument("--seed", type=int, help="Seed of the 'sample' selection")
+    p.add_argument("--shards", type=int, help="Number of shards of the 'shard' selection")
+    p.add_argument("--shard-index", type=int, help="Shard kept by the 'shard' selection")
+    p.set_defaults(handler=build_dataset)
+
+    p = commands.add_parser("clean", help="Clean a dataset with Gemini (cleaner_LLM.py)")
+    p.add_argument("--input", metavar="PATH", help="Dataset (JSON object keyed by ID, or JSONL)")
+    p.add_argument("--output", metavar="PATH")
+    p.add_argument("--num-items", type=_item_count, metavar="N|all")
+    p.add_argument("--model", help="Gemini model name")
+    p.add_argument("--rpm", type=int, help="Requests per minute")
+    p.set_defaults(handler=clean)
+
+    p = commands.add_parser("judge", help="Judge cleaned texts against the ground truth (judge_LLM.py)")
+    p.add_argument("--input", metavar="PATH", help="Extracted data ({id: {'ground_truth', '<model>_cleaned'}}) or a results file of main.py")
+    p.add_argument("--output", metavar="PATH")
+    p.add_argument("--output-texts", action="store_true", help="Also copy the texts of each item into the output")
+    p.add_argument("--from-stages", metavar="DATASET", help="Judge the cleaned texts main.py stored for this dataset instead of --input")
+    p.add_argument("--backend", choices=["llm", "prometheus"])
+    p.add_argument("--model", help="Gemini judge model (llm backend)")
+    p.add_argument("--judged-models", nargs="+", metavar="MODEL", help="Model keys to judge, e.g. gemini llama mistral")
+    p.add_argument("--batch-phase", choices=["prepare", "ingest"])
+    p.add_argument("--rpm", type=int, help="Requests per minute (llm backend)")
+    p.add_argument("--engine", choices=["transformers", "vllm", "stub"], help="Prometheus engine")
+    p.add_argument("--prometheus-model", metavar="NAME")
+    p.add_argument("--language", choices=["eng", "ita"], help="Prometheus rubric language")
+    p.add_argument("--batch-size", type=int, help="Prometheus prompts per forward pass")
+    p.set_defaults(handler=judge)
+
+    p = commands.add_parser("evaluate", help="Agreement between human and LLM judges (evaluator.py)")
+    p.add_argument("--input", metavar="PATH", help="Judged results file")
+    p.add_argument("--judge", metavar="PATH", help="Results or judge_LLM.py output whose scores are joined to --input by item and model")
+    p.add_argument("--no-judge", action="store_true", help="Compare the score columns of --input alone")
+    p.add_argument("--report", metavar="PATH", help="Text report to write")
+    p.add_argument("--raters", nargs="+", metavar="COLUMN", help="Score columns to compare (default: every score column)")
+    p.add_argument("--resamples", type=int, help="Bootstrap resamples per rater pair")
+    p.add_argument("--confidence", type=float)
+    p.add_argument("--seed", type=int)
+    p.set_defaults(handler=evaluate)
+
+    p = commands.add_parser("extract", help="Extract the cleaned texts of a results file (extracter.py)")
+    p.add_argument("--input", metavar="PATH", help="Results file of main.py")
+    p.add_argument("--output", metavar="PATH")
+    p.add_argument("--from-stages", metavar="DATASET", help="Take the cleaned texts main.py stored for this dataset instead of --input")
+    p.add_argument("--num-items", type=_item_count, metavar="N|all", help="Items of --from-stages to extract")
+    p.set_defaults(handler=extract)
+
+    p = commands.add_parser("batch", help="Run a batch requests file: on the Gemini Batch API or locally (batch_jobs.py)")
+    p.add_argument("action", choices=["submit", "download", "run-local"],
+                   help="submit: start a Gemini batch job; download: wait for it and save its results; "
+                        "run-local: answer every request with --provider")
+    p.add_argument("--requests", metavar="PATH", default="batch/clean_requests.jsonl",
+                   help="Requests file written by a prepare phase (default: %(default)s)")
+    p.add_argument("--results", metavar="PATH", default="batch/clean_results.jsonl",
+                   help="Results file read by the next phase (default: %(default)s)")
+    p.add_argument("--model", help="Model answering the requests (submit, run-local)")
+    p.add_argument("--provider", default="gemini", help="Backend of llm_providers.py for run-local, e.g. mock (default: %(default)s)")
+    p.add_argument("--job", help="Batch job to download (default: the one last submitted for --requests)")
+    p.set_defaults(handler=batch)
+
+    p = commands.add_parser("run", help="Run the full clean, evaluate and judge pipeline (main.py)")
+    p.add_argument("--input", metavar="PATH", help="Dataset (JSON object keyed by ID, or JSONL)")
+    p.add_argument("--output", metavar="PATH", help="Final results file")
+    p.add_argument("--checkpoint", metavar="PATH", help="JSONL checkpoint, appended to as items finish")
+    p.add_argument("--num-items", type=_item_count, metavar="N|all")
+    p.add_argument("--models", nargs="+", metavar="MODEL", help="Keys of main.MODEL_CONFIGS, e.g. Mock")
+    p.add_argument("--judge-provider", help="Provider of the judge, e.g. gemini or mock")
+    p.add_argument("--judge-model")
+    p.add_argument("--language", choices=["eng", "ita"])
+    p.add_argument("--no-resume", action="store_true", help="Start a fresh checkpoint")
+    p.add_argument("--sync", action="store_true", help="One item at a time instead of concurrently")
+    p.add_argument("--batch-phase", choices=["prepare-clean", "prepare-judge", "ingest"])
+    p.add_argument("--shard-queue", metavar="DIR", help="Run as a worker of the shard queue in DIR")
+    p.add_argument("--shard-size", type=int)
+    p.add_argument("--workers", type=int, help="Shard workers started on this machine")
+    p.add_argument("--metrics-export", choices=["jsonl", "prometheus"])
+    p.add_argument("--no-stage-store", action="store_true", help="Recompute every stage")
+    p.add_argument("--full-results", action="store_true", help="Write the texts into every record of --output (the pre-compact layout)")
+    store = p.add_mutually_exclusive_group()
+    store.add_argument("--results-store", metavar="DIR", help="Parquet results store")
+    store.add_argument("--no-results-store", action="store_true")
+    p.set_defaults(handler=run)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,63 +1,257 @@
 import json
+import os
+import random
+import zlib
 
-# Path to the dataset file
-input_ocr_path = "dataset2/eng/the_vampyre_ocr.json"
-input_clear_path = "dataset2/eng/the_vampyre_clean.json"
+# Builds the unified {"ocr", "clean"} dataset from an OCR dump and its clean counterpart, both JSON
+# objects keyed by segment ID. Both files are parsed incrementally and the pairs are written as
+# JSONL, so memory stays bounded by the items in flight rather than by the size of the dumps.
 
-# Load the full JSON file
-with open(input_ocr_path, 'r', encoding='utf-8') as f:
-    ocr_data_dict = json.load(f) 
+# --- Configuration ---
+INPUT_OCR_PATH = "dataset/eng/the_vampyre_ocr.json"
+INPUT_CLEAN_PATH = "dataset/eng/the_vampyre_clean.json"
+OUTPUT_PATH = "dataset/eng/the_vampyre_subset.jsonl"
+READ_CHUNK_BYTES = 1 << 20 # Characters read from the source files per step
 
-with open(input_clear_path, 'r', encoding='utf-8') as f2:
-    clear_data_dict = json.load(f2)  
+# Selection: which pairs are written
+#   "all"    -> every pair
+#   "subset" -> the first SUBSET_SIZE pairs (stops reading as soon as they are found)
+#   "sample" -> SUBSET_SIZE pairs drawn uniformly at random (reservoir sampling, seeded by SAMPLE_SEED)
+#   "shard"  -> the pairs whose key hashes to SHARD_INDEX out of NUM_SHARDS
+SELECTION = "subset"
+SUBSET_SIZE = 24
+SAMPLE_SEED = 42
+NUM_SHARDS = 1
+SHARD_INDEX = 0
 
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+_NUMBER_CHARACTERS = "0123456789+-.eE"
 
-print(f"Loaded data type: {type(ocr_data_dict)}")
-print(f"Total key-value pairs in dictionary: {len(ocr_data_dict)}")
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
-print(f"Loaded data type: {type(clear_data_dict)}")
-print(f"Total key-value pairs in dictionary: {len(clear_data_dict)}")
 
+# ----------------------------------------------- Incremental JSON Reading -----------------------------------------------
 
-unified_dict = {}
+class _StreamBuffer:
+    """A read buffer over a text file that drops what has been consumed."""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """
+        Reads more text; returns False at end of file. The read size grows with the unparsed
+        buffer, so a single value much larger than `chunk_size` is re-parsed only O(log n) times.
+        """
+        if self.eof:
+            return False
+        if self.pos:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        data = self.f.read(max(self.chunk_size, len(self.text)))
+        if not data:
+            self.eof = True
+            return False
+        self.text += data
+        return True
+
+    def skip_whitespace(self) -> str:
+        """Advances past whitespace and returns the next character ("" at end of file)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        character = self.skip_whitespace()
+        if not character or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} at offset {self.pos}, found {character!r}")
+        self.pos += 1
+        return character
+
+    def decode(self):
+        """Decodes the JSON value starting at the current position, reading more text as needed."""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number followed only by characters that could still belong to it ("1." of
+                # "1.5", or nothing at all) may continue in the next chunk: read on until some other
+                # character follows it.
+                if self.eof or not _is_number(value) or self.text[end:].strip(_NUMBER_CHARACTERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
 
-print("\nBuilding final_dict...")
-for key in ocr_data_dict:  
-    if key in clear_data_dict:
-        unified_dict[key] = {
-            "ocr": ocr_data_dict[key],
-            "clean": clear_data_dict[key]
-        }
-    else:
-        print(f"Warning: Key '{key}' found in OCR data but not in clear data. Skipping this entry.")
 
+def iter_json_object(path: str, chunk_size: int = READ_CHUNK_BYTES):
+    """
+    Yields the (key, value) pairs of a top-level JSON object without loading the whole file.
+    Only the value being decoded and one read chunk are held in memory at a time.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = _StreamBuffer(f, chunk_size)
+        buffer.expect("{")
+        if buffer.skip_whitespace() == "}":
+            return
+        while True:
+            key = buffer.decode()
+            buffer.expect(":")
+            yield key, buffer.decode()
+            if buffer.expect(",}") == "}":
+                return
 
-for key in clear_data_dict:
-    if key not in ocr_data_dict:
+
+# ----------------------------------------------- Pairing and Selection -----------------------------------------------
+
+def iter_pairs(ocr_path: str, clean_path: str, chunk_size: int = READ_CHUNK_BYTES):
+    """
+    Yields (key, {"ocr": ..., "clean": ...}) for every key present in both files.
+
+    The two files are read in lockstep. A value whose key has not been seen in the other file
+    yet waits in a pending buffer, so files with the same key order (the usual case) keep the
+    buffer nearly empty; keys present in only one file are reported at the end.
+    """
+    ocr_items = iter_json_object(ocr_path, chunk_size)
+    clean_items = iter_json_object(clean_path, chunk_size)
+    pending_ocr, pending_clean = {}, {}
+    ocr_done = clean_done = False
+
+    while not (ocr_done and clean_done):
+        if not ocr_done:
+            entry = next(ocr_items, None)
+            if entry is None:
+                ocr_done = True
+            else:
+                key, ocr_text = entry
+                if key in pending_clean:
+                    yield key, {"ocr": ocr_text, "clean": pending_clean.pop(key)}
+                else:
+                    pending_ocr[key] = ocr_text
+        if not clean_done:
+            entry = next(clean_items, None)
+            if entry is None:
+                clean_done = True
+            else:
+                key, clean_text = entry
+                if key in pending_ocr:
+                    yield key, {"ocr": pending_ocr.pop(key), "clean": clean_text}
+                else:
+                    pending_clean[key] = clean_text
+
+    for key in pending_ocr:
+        print(f"Warning: Key '{key}' found in OCR data but not in clear data. Skipping this entry.")
+    for key in pending_clean:
         print(f"Warning: Key '{key}' found in clear data but not in OCR data. This entry was not added.")
 
-subset = []
-print("\nGenerating subset of final_dict...")
- 
-final_dict = {}
-subset_desired = 24 
-
-for i in range(subset_desired):
-    key = str(i)  
-    if key in unified_dict:
-        final_dict[key] = unified_dict[key]
-        subset.append(unified_dict[key])
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Stable shard number of a key (the same on every machine and run, unlike hash())."""
+    return zlib.crc32(str(key).encode("utf-8")) % num_shards
+
+
+def select_pairs(pairs, selection: str = SELECTION, size: int = SUBSET_SIZE, seed: int = SAMPLE_SEED,
+                 num_shards: int = NUM_SHARDS, shard_index: int = SHARD_INDEX):
+    """Applies one of the SELECTION modes to a stream of (key, item) pairs."""
+    if selection == "all":
+        yield from pairs
+    elif selection == "subset":
+        for i, pair in enumerate(pairs):
+            if i >= size:
+                return
+            yield pair
+    elif selection == "shard":
+        for key, item in pairs:
+            if shard_of(key, num_shards) == shard_index:
+                yield key, item
+    elif selection == "sample":
+        # Reservoir sampling (Algorithm R): only `size` items are ever held. The sample is
+        # written back in corpus order.
+        rng = random.Random(seed)
+        reservoir = []
+        for i, pair in enumerate(pairs):
+            if i < size:
+                reservoir.append((i, pair))
+            else:
+                j = rng.randint(0, i)
+                if j < size:
+                    reservoir[j] = (i, pair)
+        for _, pair in sorted(reservoir, key=lambda entry: entry[0]):
+            yield pair
+    else:
+        raise ValueError(f"Unknown selection mode: {selection}")
+
+
+# ----------------------------------------------- Dataset Files -----------------------------------------------
+
+def write_dataset_jsonl(pairs, output_path: str) -> int:
+    """Writes (key, item) pairs as JSONL lines {"id", "ocr", "clean"}. Returns the number written."""
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as outfile:
+        for key, item in pairs:
+            outfile.write(json.dumps({"id": key, **item}, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def iter_dataset(path: str):
+    """
+    Yields (id, {"ocr", "clean"}) from a dataset file: either the JSONL written by this module
+    or a JSON object keyed by ID, such as the_vampyre_subset.json. Neither is loaded whole.
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    item_id = str(record.pop("id"))
+                    yield item_id, record
     else:
-        print(f"Warning: Key '{key}' not found in unified_dict. Skipping this entry.")
+        yield from iter_json_object(path)
+
+
+def load_dataset(path: str, limit: int = None) -> dict:
+    """Loads the first `limit` items (all if None) of a dataset file into an {id: item} dict."""
+    items = {}
+    for item_id, item in iter_dataset(path):
+        if limit is not None and len(items) >= limit:
+            break
+        items[item_id] = item
+    return items
+
 
-print(f"\nNumber of items in subset: {len(final_dict)}")
+def main():
+    """Streams the OCR and clean dumps into a unified JSONL dataset using the configured selection."""
+    if not os.path.exists(INPUT_OCR_PATH) or not os.path.exists(INPUT_CLEAN_PATH):
+        print(f"Error: Input files not found: '{INPUT_OCR_PATH}', '{INPUT_CLEAN_PATH}'")
+        return
 
+    print(f"\nBuilding dataset from '{INPUT_OCR_PATH}' and '{INPUT_CLEAN_PATH}' (selection: {SELECTION})...")
+    try:
+        pairs = select_pairs(iter_pairs(INPUT_OCR_PATH, INPUT_CLEAN_PATH), SELECTION, SUBSET_SIZE, SAMPLE_SEED,
+                             NUM_SHARDS, SHARD_INDEX)
+        count = write_dataset_jsonl(pairs, OUTPUT_PATH)
+    except (ValueError, IOError) as e:
+        print(f"Error building dataset: {e}")
+        return
+    print(f"\nNumber of items written: {count}")
+    print(f"Dataset saved to: {OUTPUT_PATH}")
 
-# Display the first item in the subset
-print(f"example", final_dict["0"])
 
-#save this subset
-output_subset_path = "dataset2/eng/the_vampyre_subset.json"
-with open(output_subset_path, 'w', encoding='utf-8') as outfile:
-    json.dump(final_dict, outfile, indent=2, ensure_ascii=False)
-print(f"\nSubset dictionary saved to: {output_subset_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import json
+import os
+from collections import Counter
+
+from result_writer import iter_jsonl, load_results
+
+# Token-level diffs of cleaned texts against their ground truth, and a corpus-wide confusion
+# table of the errors they contain.
+#
+# Texts are split into words and every word is mapped to an integer ID, so the diff compares
+# ints. The diff itself is Myers' O(ND) algorithm in its linear-space form: common prefixes and
+# suffixes are trimmed, then the middle of the shortest edit path is found with a forward and a
+# backward search and each half is solved the same way. Time grows with the number of
+# differences, not with the square of the length, so a nearly correct book-length text diffs in
+# about linear time, where difflib.SequenceMatcher slows down badly.
+
+# --- Configuration ---
+RESULTS_PATH = "results/full_pipeline_results_24.json" # Used when run as a script
+OUTPUT_PATH = "results/confusion_table.json"
+TOP_N = 20 # Confusions listed per model and kind
+
+
+# ----------------------------------------------- Myers Diff -----------------------------------------------
+
+def _split_point(a: list, b: list, alo: int, ahi: int, blo: int, bhi: int):
+    """
+    A point (x, y) on a shortest edit path of a[alo:ahi] -> b[blo:bhi], near its middle, as
+    offsets from (alo, blo); None when the two ranges have nothing in common. Both ranges are
+    non-empty and differ at their first and last elements.
+    """
+    n, m = ahi - alo, bhi - blo
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    length = 2 * max_d + 2
+    forward = [-1] * length # furthest x reached on each diagonal k = x - y, from the start...
+    backward = [-1] * length # ...and from the end, with x counted back from the end
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    check_forward = delta % 2 != 0 # the paths meet on a forward step when delta is odd
+    # Diagonals that ran off the grid are skipped from then on.
+    k1_start = k1_end = k2_start = k2_end = 0
+
+    for d in range(max_d):
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            i = offset + k1
+            if k1 == -d or (k1 != d and forward[i - 1] < forward[i + 1]):
+                x1 = forward[i + 1]
+            else:
+                x1 = forward[i - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[alo + x1] == b[blo + y1]:
+                x1 += 1
+                y1 += 1
+            forward[i] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif check_forward:
+                j = offset + delta - k1
+                if 0 <= j < length and backward[j] != -1 and x1 >= n - backward[j]:
+                    return x1, y1
+
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            j = offset + k2
+            if k2 == -d or (k2 != d and backward[j - 1] < backward[j + 1]):
+                x2 = backward[j + 1]
+            else:
+                x2 = backward[j - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[ahi - 1 - x2] == b[bhi - 1 - y2]:
+                x2 += 1
+                y2 += 1
+            backward[j] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not check_forward:
+                i = offset + delta - k2
+                if 0 <= i < length and forward[i] != -1:
+                    x1 = forward[i]
+                    if x1 >= n - x2:
+                        return x1, x1 - (i - offset)
+    return None
+
+def _matching_blocks(a: list, b: list, alo: int, ahi: int, blo: int, bhi: int, blocks: list) -> None:
+    """Appends, in order, the (i, j, size) runs of equal elements of a shortest edit path."""
+    # Common prefix and suffix are matched without searching.
+    prefix = 0
+    while alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]:
+        prefix += 1
+    if prefix:
+        blocks.append((alo, blo, prefix))
+    alo, blo = alo + prefix, blo + prefix
+    suffix = 0
+    while alo < ahi - suffix and blo < bhi - suffix and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]:
+        suffix += 1
+    ahi, bhi = ahi - suffix, bhi - suffix
+
+    if alo < ahi and blo < bhi:
+        split = _split_point(a, b, alo, ahi, blo, bhi)
+        if split is not None:
+            x, y = split
+            _matching_blocks(a, b, alo, alo + x, blo, blo + y, blocks)
+            _matching_blocks(a, b, alo + x, ahi, blo + y, bhi, blocks)
+    if suffix:
+        blocks.append((ahi, bhi, suffix))
+
+def myers_opcodes(a: list, b: list) -> list:
+    """
+    How to turn sequence `a` into `b` with the fewest insertions and deletions, as difflib-style
+    opcodes: (tag, i1, i2, j1, j2) with tag "equal", "replace", "delete" or "insert".
+    """
+    blocks = []
+    _matching_blocks(a, b, 0, len(a), 0, len(b), blocks)
+    opcodes = []
+    i = j = 0
+    for block_i, block_j, size in blocks + [(len(a), len(b), 0)]:
+        if i < block_i and j < block_j:
+            opcodes.append(("replace", i, block_i, j, block_j))
+        elif i < block_i:
+            opcodes.append(("delete", i, block_i, j, j))
+        elif j < block_j:
+            opcodes.append(("insert", i, i, j, block_j))
+        if size:
+            # Adjacent blocks (split by the recursion) are merged into one "equal" run.
+            if opcodes and opcodes[-1][0] == "equal" and opcodes[-1][2] == block_i:
+                opcodes[-1] = ("equal", opcodes[-1][1], block_i + size, opcodes[-1][3], block_j + size)
+            else:
+                opcodes.append(("equal", block_i, block_i + size, block_j, block_j + size))
+        i, j = block_i + size, block_j + size
+    return opcodes
+
+def encode(tokens: list, vocabulary: dict) -> list:
+    """Integer IDs of tokens; unseen tokens are added to `vocabulary`."""
+    return [vocabulary.setdefault(token, len(vocabulary)) for token in tokens]
+
+def diff_words(reference: str, hypothesis: str) -> list:
+    """Word-level differences between the ground truth and a cleaned text, one {"type", "reference", "hypothesis"} per changed span."""
+    ref_words, hyp_words = reference.split(), hypothesis.split()
+    vocabulary = {}
+    opcodes = myers_opcodes(encode(ref_words, vocabulary), encode(hyp_words, vocabulary))
+    return [{"type": tag, "reference": " ".join(ref_words[i1:i2]), "hypothesis": " ".join(hyp_words[j1:j2])}
+            for tag, i1, i2, j1, j2 in opcodes if tag != "equal"]
+
+
+# ----------------------------------------------- Confusion Table -----------------------------------------------
+
+class ConfusionTable:
+    """
+    Corpus-wide counts of the errors left in cleaned texts, per model:
+
+    - "operations": words substituted, inserted and deleted, and spans whose word count differs
+      ("split_merge", e.g. "to day" for "today");
+    - "words": word confusions "<cleaned>→<ground truth>", e.g. "lhe→the";
+    - "chars": character confusions inside substituted words, e.g. "ſ→s" ("" for a missing or
+      extra character).
+    """
+
+    def __init__(self):
+        self.operations = {}
+        self.words = {}
+        self.chars = {}
+
+    def _counters(self, model: str) -> tuple:
+        return (self.operations.setdefault(model, Counter()), self.words.setdefault(model, Counter()),
+                self.chars.setdefault(model, Counter()))
+
+    def add_diffs(self, model: str, diffs: list) -> None:
+        """Counts the differences of one cleaned text (as produced by `diff_words`)."""
+        operations, words, chars = self._counters(model)
+        for diff in diffs:
+            ref_words, hyp_words = diff["reference"].split(), diff["hypothesis"].split()
+            if not hyp_words:
+                operations["deletion"] += len(ref_words)
+            elif not ref_words:
+                operations["insertion"] += len(hyp_words)
+            elif len(ref_words) != len(hyp_words):
+                operations["split_merge"] += 1
+                words[f"{diff['hypothesis']}→{diff['reference']}"] += 1
+            else:
+                for ref_word, hyp_word in zip(ref_words, hyp_words):
+                    if ref_word == hyp_word:
+                        continue
+                    operations["substitution"] += 1
+                    words[f"{hyp_word}→{ref_word}"] += 1
+                    for tag, i1, i2, j1, j2 in myers_opcodes(list(map(ord, hyp_word)), list(map(ord, ref_word))):
+                        if tag != "equal":
+                            chars[f"{hyp_word[i1:i2]}→{ref_word[j1:j2]}"] += 1
+
+    def add(self, model: str, reference: str, hypothesis: str) -> None:
+        """Diffs one cleaned text against its ground truth and counts the differences."""
+        self.add_diffs(model, diff_words(reference, hypothesis))
+
+    def to_dict(self, top: int = None) -> dict:
+        """{model: {"operations", "words", "chars"}}, confusions as [pair, count] lists, most frequent first."""
+        return {
+            model: {
+                "operations": dict(self.operations[model]),
+                "words": self.words[model].most_common(top),
+                "chars": self.chars[model].most_common(top),
+            }
+            for model in sorted(self.operations)
+        }
+
+
+def _output_diffs(result: dict, output: dict) -> list:
+    """The stored diffs of a model output (current or legacy layout), or diffs computed from its texts."""
+    if output.get("diffs") is not None:
+        return output["diffs"]
+    if output.get("differences") is not None: # older results: ground_truth_slice/model_cleaned_slice
+        return [{"type": diff["type"], "reference": diff.get("ground_truth_slice", ""),
+                 "hypothesis": diff.get("model_cleaned_slice", "")} for diff in output["differences"]]
+    return diff_words(result.get("ground_truth", ""), output.get("cleaned_text", ""))
+
+def build_confusion_table(results_path: str) -> ConfusionTable:
+    """
+    One pass over a results file (the JSONL checkpoint is streamed item by item) adding every
+    successfully cleaned output to a confusion table. Failed outputs are skipped.
+    """
+    if results_path.endswith(".jsonl"):
+        results = (record for _, record in iter_jsonl(results_path))
+    else:
+        results = load_results(results_path)
+    table = ConfusionTable()
+    for result in results:
+        for output in result.get("model_outputs", []):
+            if output.get("metrics") is None:
+                continue
+            table.add_diffs(output.get("model_name"), _output_diffs(result, output))
+    return table
+
+
+def main():
+    """Builds the confusion table of RESULTS_PATH, prints the top confusions and saves them to OUTPUT_PATH."""
+    try:
+        table = build_confusion_table(RESULTS_PATH)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error reading results file '{RESULTS_PATH}': {e}")
+        return
+
+    report = table.to_dict(TOP_N)
+    for model, counts in report.items():
+        print(f"\n=== {model} ===")
+        print(f"Operations: {counts['operations']}")
+        print("Words: " + ", ".join(f"{pair} ({count})" for pair, count in counts["words"]))
+        print("Chars: " + ", ".join(f"{pair} ({count})" for pair, count in counts["chars"]))
+
+    output_dir = os.path.dirname(OUTPUT_PATH)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    try:
+        with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nConfusion table saved to: {OUTPUT_PATH}")
+    except IOError as e:
+        print(f"\nError saving confusion table: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Agreement between raters of cleaning quality (human annotators and LLM judges): Cohen's kappa,
+# quadratic weighted kappa and Spearman's correlation, each with a bootstrap confidence interval.
+#
+# All three statistics are computed from the confusion matrix of the two raters' scores, so a
+# bootstrap resample only needs its own confusion matrix: every resample of a pair is drawn and
+# counted in one NumPy pass (a single bincount over resample x item indices), and the statistics
+# of all resamples come out of a few array operations. Thousands of labels and resamples take a
+# fraction of a second.
+
+# --- Configuration ---
+INPUT_PATH = "clean_judge_files/cleaning_result_human.json"
+# Judge scores joined to the records of INPUT_PATH by item and model (see `join_judge_scores`): a results
+# file of main.py or an output of judge_LLM.py. None compares the score columns of INPUT_PATH alone.
+JUDGE_PATH = "results/full_pipeline_results_24.json"
+REPORT_PATH = "results/kappa_analysis_report.txt"
+RATERS = None # Score columns to compare, e.g. ["human_score", "score_gemini"]; None finds them (see `find_raters`)
+SCORE_LEVELS = 6 # Scores are integers 0..SCORE_LEVELS-1; anything else (e.g. -1, unparseable) counts as missing
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
+SEED = 0
+
+
+# ----------------------------------------------- Loading -----------------------------------------------
+
+def _to_score(value) -> float:
+    """A rating as a number: ints, numeric strings and {"score": n} judge answers; NaN otherwise."""
+    if isinstance(value, bool) or value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return _to_score(value.get("score"))
+    if isinstance(value, str):
+        try:
+            return _to_score(json.loads(value))
+        except ValueError:
+            return np.nan
+    return np.nan
+
+def _flatten(records: list) -> list:
+    """
+    One flat record per item. Pipeline results (items with "model_outputs") get a
+    "<model>:score" column per model with its judge score, plus "<model>:<key>" for any score
+    an annotator added to an output (e.g. "human_score").
+    """
+    flat = []
+    for record in records:
+        if "model_outputs" not in record:
+            flat.append(record)
+            continue
+        row = {}
+        for output in record["model_outputs"]:
+            model = output.get("model_name")
+            row[f"{model}:score"] = (output.get("judgement") or {}).get("score")
+            for key, value in output.items():
+                if "score" in key:
+                    row[f"{model}:{key}"] = value
+        flat.append(row)
+    return flat
+
+def load_records(path: str) -> list:
+    """
+    The items of a judged results file: a JSON list of records, an {"items": [...]} results
+    file, or a {id: record} mapping (extracter.py and judge_LLM.py inputs).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["items"] if "items" in data else list(data.values())
+    return _flatten(data)
+
+def _judge_scores(path: str) -> dict:
+    """
+    The judge scores of a results file of main.py or a judge_LLM.py output, as
+    {(item, model): (score, cleaned_text)}.
+    Items are keyed both by ID and by ground truth text (older files have no IDs); models by
+    family ("gemini", "llama", "mistral").
+    """
+    # Imported here: the pipeline modules are only needed when judge scores are joined.
+    from extracter import model_family
+    from result_writer import is_results, results_of
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and not is_results(data):
+        data = [dict(record, id=item_id) for item_id, record in data.items()]
+    scores = {}
+    for record in results_of(data, diffs=False):
+        item_keys = [str(record[key]) for key in ("item_id", "id") if record.get(key) is not None]
+        if record.get("ground_truth"):
+            item_keys.append(record["ground_truth"])
+        if "model_outputs" in record:
+            model_scores = {model_family(output.get("model_name")): ((output.get("judgement") or {}).get("score"), output.get("cleaned_text"))
+                            for output in record["model_outputs"]}
+        else:
+            model_scores = {key[len("score_"):]: (value, record.get(f"{key[len('score_'):]}_cleaned"))
+                            for key, value in record.items() if key.startswith("score_")}
+        for model, score in model_scores.items():
+            if model is not None:
+                for item_key in item_keys:
+                    scores[(item_key, model)] = score
+    return scores
+
+def join_judge_scores(records: list, judge_path: str) -> list:
+    """
+    Adds a "score_<model>" column to every record for each model it has a "<model>_cleaned" text
+    of, with the judge's score of that item and model from `judge_path`. Records are matched by
+    "id"/"item_id", or by ground truth text when they have no ID (as in the human annotation files).
+    """
+    scores = _judge_scores(judge_path)
+    joined, different_texts = 0, 0
+    for record in records:
+        item_key = str(record.get("id", record.get("item_id", ""))) or None
+        for key in list(record):
+            if not key.endswith("_cleaned"):
+                continue
+            model = key[:-len("_cleaned")]
+            found = scores.get((item_key, model)) or scores.get((record.get("ground_truth"), model))
+            if found is None:
+                continue
+            score, cleaned_text = found
+            record[f"score_{model}"] = score
+            joined += 1
+            if cleaned_text is not None and cleaned_text != record[key]:
+                different_texts += 1
+    print(f"Joined {joined} judge scores from '{judge_path}'.")
+    if different_texts:
+        print(f"Warning: for {different_texts} of them the judge scored a different cleaned text than the one annotated.")
+    return records
+
+def find_raters(records: list) -> list:
+    """Columns holding scores: keys containing "score" with at least one numeric value, in first-seen order."""
+    raters = []
+    for record in records:
+        for key, value in record.items():
+            if "score" in key and key not in raters and not np.isnan(_to_score(value)):
+                raters.append(key)
+    return raters
+
+def ratings_matrix(records: list, raters: list) -> np.ndarray:
+    """
+    Scores as an (items, raters) int array; -1 where a rater gave no valid score
+    (missing, unparseable or outside 0..SCORE_LEVELS-1).
+    """
+    scores = np.array([[_to_score(record.get(rater)) for rater in raters] for record in records], dtype=float).reshape(len(records), len(raters))
+    valid = np.isfinite(scores) & (scores >= 0) & (scores < SCORE_LEVELS) & (scores == np.round(scores))
+    return np.where(valid, scores, -1).astype(np.int64)
+
+
+# ----------------------------------------------- Statistics -----------------------------------------------
+
+def confusion_counts(a: np.ndarray, b: np.ndarray, levels: int = SCORE_LEVELS) -> np.ndarray:
+    """The levels x levels matrix of how often rater A gave score i and rater B score j."""
+    return np.bincount(a * levels + b, minlength=levels * levels).reshape(levels, levels)
+
+def agreement_from_counts(counts: np.ndarray) -> dict:
+    """
+    Cohen's kappa, quadratic weighted kappa and Spearman's rho from confusion matrices of shape
+    (..., levels, levels), one value per matrix; NaN where a statistic is undefined (e.g. a rater
+    who always gives the same score).
+    """
+    counts = counts.astype(float)
+    levels = counts.shape[-1]
+    n = counts.sum(axis=(-2, -1))
+    rows, cols = counts.sum(axis=-1), counts.sum(axis=-2) # score distributions of A and B
+    expected = rows[..., :, None] * cols[..., None, :] / n[..., None, None]
+
+    grid = np.arange(levels)
+    disagreement = (grid[:, None] != grid[None, :]).astype(float)
+    quadratic = (grid[:, None] - grid[None, :]) ** 2.0
+
+    # Spearman's rho is Pearson's r of the ranks; tied scores share their average rank, which
+    # each rater's score distribution gives directly.
+    rank_a = np.cumsum(rows, axis=-1) - (rows - 1) / 2
+    rank_b = np.cumsum(cols, axis=-1) - (cols - 1) / 2
+    mean_a = (rows * rank_a).sum(axis=-1) / n
+    mean_b = (cols * rank_b).sum(axis=-1) / n
+    centred_a, centred_b = rank_a - mean_a[..., None], rank_b - mean_b[..., None]
+    covariance = np.einsum("...ij,...i,...j->...", counts, centred_a, centred_b)
+    variance_a = (rows * centred_a ** 2).sum(axis=-1)
+    variance_b = (cols * centred_b ** 2).sum(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "kappa": 1 - (counts * disagreement).sum(axis=(-2, -1)) / (expected * disagreement).sum(axis=(-2, -1)),
+            "weighted_kappa": 1 - (counts * quadratic).sum(axis=(-2, -1)) / (expected * quadratic).sum(axis=(-2, -1)),
+            "spearman": covariance / np.sqrt(variance_a * variance_b),
+        }
+
+def bootstrap_counts(a: np.ndarray, b: np.ndarray, resamples: int, rng: np.random.Generator,
+                     levels: int = SCORE_LEVELS) -> np.ndarray:
+    """Confusion matrices of `resamples` bootstrap resamples of the paired scores, as one (resamples, levels, levels) array."""
+    n = len(a)
+    indices = rng.integers(0, n, size=(resamples, n))
+    cells = a[indices] * levels + b[indices] + (np.arange(resamples) * levels * levels)[:, None]
+    return np.bincount(cells.ravel(), minlength=resamples * levels * levels).reshape(resamples, levels, levels)
+
+def pair_agreement(a: np.ndarray, b: np.ndarray, resamples: int = BOOTSTRAP_RESAMPLES, confidence: float = CONFIDENCE,
+                   rng: np.random.Generator = None) -> dict:
+    """
+    Agreement of two raters over the items both scored (scores of -1 are left out).
+
+    Returns:
+        dict: "n" and, for "kappa", "weighted_kappa" and "spearman", the value and its
+              percentile bootstrap interval as {"value", "low", "high"}.
+    """
+    if rng is None:
+        rng = np.random.default_rng(SEED)
+    both = (a >= 0) & (b >= 0)
+    a, b = a[both], b[both]
+    result = {"n": int(len(a))}
+    if not len(a):
+        return {**result, **{name: {"value": np.nan, "low": np.nan, "high": np.nan} for name in ("kappa", "weighted_kappa", "spearman")}}
+
+    point = agreement_from_counts(confusion_counts(a, b))
+    samples = agreement_from_counts(bootstrap_counts(a, b, resamples, rng))
+    tail = (1 - confidence) / 2 * 100
+    for name, value in point.items():
+        finite = samples[name][np.isfinite(samples[name])]
+        low, high = np.percentile(finite, [tail, 100 - tail]) if len(finite) else (np.nan, np.nan)
+        result[name] = {"value": float(value), "low": float(low), "high": float(high)}
+    return result
+
+def rater_pairs(raters: list) -> list:
+    """Every human rater (a column containing "human") against every other rater; all pairs if there is no human rater."""
+    humans = [rater for rater in raters if "human" in rater]
+    if humans:
+        return [(human, other) for human in humans for other in raters if other != human]
+    return [(a, b) for i, a in enumerate(raters) for b in raters[i + 1:]]
+
+def analyze_rater_agreement(json_file_path: str, raters: list = None, resamples: int = BOOTSTRAP_RESAMPLES,
+                            confidence: float = CONFIDENCE, seed: int = SEED, judge_path: str = None) -> dict:
+    """
+    Agreement statistics of every rater pair of a judged results file (see `rater_pairs`), with the
+    scores of `judge_path` joined in first if given (see `join_judge_scores`).
+
+    Returns:
+        dict: Maps (rater_a, rater_b) to the result of `pair_agreement`.
+    """
+    records = load_records(json_file_path)
+    if judge_path is not None:
+        records = join_judge_scores(records, judge_path)
+    if raters is None:
+        raters = find_raters(records)
+    scores = ratings_matrix(records, raters)
+    rng = np.random.default_rng(seed)
+    columns = {rater: scores[:, index] for index, rater in enumerate(raters)}
+    return {(a, b): pair_agreement(columns[a], columns[b], resamples, confidence, rng) for a, b in rater_pairs(raters)}
+
+
+# ----------------------------------------------- Report -----------------------------------------------
+
+def interpret_kappa(kappa: float) -> str:
+    """Landis & Koch's reading of a kappa value."""
+    if np.isnan(kappa):
+        return "undefined"
+    for limit, label in [(0.0, "poor"), (0.2, "slight"), (0.4, "fair"), (0.6, "moderate"), (0.8, "substantial")]:
+        if kappa <= limit:
+            return label
+    return "almost perfect"
+
+def format_report(agreement: dict, confidence: float = CONFIDENCE) -> str:
+    """A text table of the agreement of every rater pair, with each pair's kappa interpretation."""
+    percent = f"{confidence:.0%}"
+    lines = [f"{'Rater A':<22} {'Rater B':<22} {'n':>5}  {'kappa':<22} {'weighted kappa':<22} {'spearman':<22} agreement",
+             f"{'':<22} {'':<22} {'':>5}  ({percent} bootstrap CI)"]
+    for (a, b), result in agreement.items():
+        cells = [f"{result[name]['value']:6.3f} [{result[name]['low']:6.3f}, {result[name]['high']:6.3f}]"
+                 for name in ("kappa", "weighted_kappa", "spearman")]
+        lines.append(f"{a:<22} {b:<22} {result['n']:>5}  {cells[0]:<22} {cells[1]:<22} {cells[2]:<22} "
+                     f"{interpret_kappa(result['weighted_kappa']['value'])}")
+    return "\n".join(lines)
+
+
+def main():
+    """Analyzes INPUT_PATH, prints the agreement table and saves it to REPORT_PATH."""
+    start = time.perf_counter()
+    try:
+        agreement = analyze_rater_agreement(INPUT_PATH, RATERS, BOOTSTRAP_RESAMPLES, CONFIDENCE, SEED, JUDGE_PATH)
+    except FileNotFoundError:
+        print(f"Error: Input file not found at '{INPUT_PATH}' or '{JUDGE_PATH}'")
+        return
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"Error: Could not read ratings from '{INPUT_PATH}': {e}")
+        return
+    if not agreement:
+        print(f"Error: '{INPUT_PATH}' needs at least two score columns (e.g. 'human_score' and 'score_gemini').")
+        return
+
+    report = format_report(agreement, CONFIDENCE)
+    print(report)
+    print(f"\n{len(agreement)} rater pairs, {BOOTSTRAP_RESAMPLES} bootstrap resamples each, in {time.perf_counter() - start:.2f}s")
+
+    output_dir = os.path.dirname(REPORT_PATH)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    try:
+        with open(REPORT_PATH, "w", encoding="utf-8") as f:
+            f.write(f"Rater agreement of '{INPUT_PATH}'\n\n{report}\n")
+        print(f"Report saved to: {REPORT_PATH}")
+    except IOError as e:
+        print(f"Error saving report: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,30 @@
 import json
 
+from dataset_handler import load_dataset
+from result_writer import is_results, load_results, results_of
+from stage_store import stage_store
+
+# --- Configuration ---
+# Input and output file names for the eng dataset; for the ita dataset use
+# 'results/full_pipeline_results_12_ita.json' and 'extracted_data_ita.json'.
+INPUT_PATH = 'results/full_pipeline_results_24.json'
+OUTPUT_PATH = 'extracted_data.json'
+# A dataset path takes the cleaned texts straight from main.py's stage store, for the items of that
+# dataset, instead of reading INPUT_PATH; None reads INPUT_PATH.
+STAGE_DATASET_PATH = None # e.g. 'dataset/eng/the_vampyre_subset.json'
+NUM_ITEM_TO_PROCESS = None # Items of STAGE_DATASET_PATH to extract; None takes all
+
+def model_family(model_name: str) -> str:
+    """
+    The family key ("gemini", "llama", "mistral") of a model name, or None. Matched by prefix, so
+    any Gemini version (e.g. "Gemini-1.5-Flash", "Gemini-2.0-Flash") counts as gemini.
+    """
+    family = (model_name or "").lower()
+    for prefix in ("gemini", "llama", "mistral"):
+        if family.startswith(prefix):
+            return prefix
+    return None
+
 def process_pipeline_results(file_path):
     """
     Processes a JSON file with OCR pipeline results to extract specific data.
@@ -14,15 +39,20 @@ def process_pipeline_results(file_path):
               IT GENERATE THE TWO FILES EXTRACTED_DATA.JSON AND EXTRACTED_DATA_ITA.JSON
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_results(file_path, diffs=False) # any layout, compact files included; the diffs are not needed
     except FileNotFoundError:
         print(f"Error: The file '{file_path}' was not found.")
         return {}
     except json.JSONDecodeError:
         print(f"Error: The file '{file_path}' contains invalid JSON.")
         return {}
+    except ValueError as e:
+        print(f"Error: Could not read '{file_path}': {e}")
+        return {}
+    return extract_items(data)
 
+def extract_items(data: list) -> dict:
+    """The extracted data of the items of a results file (see `process_pipeline_results`)."""
     extracted_data = {}
 
     for item in data:
@@ -34,36 +64,82 @@ def process_pipeline_results(file_path):
         original_ocr = item.get("original_ocr", "")
         ground_truth = item.get("ground_truth", "")
 
-        # Initialize variables to store cleaned text from each model
-        gemini_cleaned = ""
-        llama_cleaned = ""
-        mistral_cleaned = ""
-
         # Loop through the model outputs to find the correct text for each model
-        model_outputs = item.get("model_outputs", [])
-        for output in model_outputs:
-            model_name = output.get("model_name")
-            cleaned_text = output.get("cleaned_text", "")
-
-            if model_name == "Gemini-1.5-Flash":
-                gemini_cleaned = cleaned_text
-            elif model_name == "Llama":
-                llama_cleaned = cleaned_text
-            elif model_name == "Mistral":
-                mistral_cleaned = cleaned_text
-
-        # Assemble the dictionary with named keys, as requested.
-        value_dict = {
-            "original_ocr": original_ocr,
-            "ground_truth": ground_truth,
-            "gemini_cleaned": gemini_cleaned,
-            "llama_cleaned": llama_cleaned,
-            "mistral_cleaned": mistral_cleaned
-        }
+        cleaned = {}
+        for output in item.get("model_outputs", []):
+            family = model_family(output.get("model_name"))
+            if family is not None:
+                cleaned[family] = output.get("cleaned_text", "")
 
         # Add the entry to the final dictionary
-        extracted_data[item_id] = value_dict
+        extracted_data[str(item_id)] = build_entry(original_ocr, ground_truth, cleaned) # str, as in the saved JSON
+
+    return extracted_data
+
+def build_entry(original_ocr: str, ground_truth: str, cleaned: dict) -> dict:
+    """One item of the extracted data: its texts and the cleaned text of each model family ("" if missing)."""
+    return {
+        "original_ocr": original_ocr,
+        "ground_truth": ground_truth,
+        "gemini_cleaned": cleaned.get("gemini", ""),
+        "llama_cleaned": cleaned.get("llama", ""),
+        "mistral_cleaned": cleaned.get("mistral", "")
+    }
+
+def extract_from_stages(dataset_path: str, num_items: int = None) -> dict:
+    """
+    Same output as `process_pipeline_results`, built from the cleaned texts main.py stored in
+    its stage store (the latest per item and model) instead of a results file, so no stage has
+    to be rerun or re-exported. Items with no stored cleaned text are left out.
+    """
+    try:
+        items_by_id = load_dataset(dataset_path, num_items)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error loading dataset '{dataset_path}': {e}")
+        return {}
+
+    # Only outputs recorded for these very texts: item IDs repeat across datasets.
+    sources = {item_id: stage_store.source_key(item.get("ocr", ""), item.get("clean", "")) for item_id, item in items_by_id.items()}
+    cleaned_by_item = {}
+    for (item_id, model_name), cleaned_text in stage_store.latest("clean", sources).items():
+        family = model_family(model_name)
+        if family is not None and item_id in items_by_id:
+            cleaned_by_item.setdefault(item_id, {})[family] = cleaned_text
+
+    return {
+        item_id: build_entry(item.get("ocr", ""), item.get("clean", ""), cleaned_by_item[item_id])
+        for item_id, item in items_by_id.items() if item_id in cleaned_by_item
+    }
 
+def load_extracted(path: str, judged_path: str = None) -> dict:
+    """
+    The extracted data judge_LLM.py and the notebooks read, {id: entry} as built by `build_entry`,
+    from a results file of main.py (any layout), an extracted data file or a judging output that
+    carries the texts (a list of entries with an "id", as the Prometheus notebooks write). The
+    texts are those of the file, not copies, so no extracted data file has to be written first.
+
+    With `judged_path`, the scores and feedback of a judge_LLM.py output, which refers to the
+    items by ID, are added to the entries.
+
+    Raises:
+        FileNotFoundError, ValueError: The file is missing or is not valid JSON.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list) and data and "id" in data[0] and "item_id" not in data[0]:
+        extracted_data = {str(record["id"]): record for record in data}
+    elif is_results(data):
+        extracted_data = extract_items(results_of(data, diffs=False))
+    else:
+        extracted_data = data
+
+    if judged_path is not None:
+        with open(judged_path, "r", encoding="utf-8") as f:
+            judged = json.load(f)
+        for record in judged if isinstance(judged, list) else judged.values():
+            entry = extracted_data.get(str(record.get("id")))
+            if entry is not None:
+                entry.update({key: value for key, value in record.items() if key.startswith(("score_", "feedback_"))})
     return extracted_data
 
 def save_dict_to_json(data_dict, file_path):
@@ -83,21 +159,20 @@ def save_dict_to_json(data_dict, file_path):
         print(f"Error writing to file '{file_path}': {e}")
 
 
-# --- Main execution block ---
-if __name__ == "__main__":
-    # Define input and output file names for the eng dataset
-    input_file = 'results/full_pipeline_results_24.json'
-    output_file = 'extracted_data.json'
-
-    # Define input and output file names for ita dataset
-    #input_file = 'results/full_pipeline_results_12_ita.json'
-    #output_file = 'extracted_data_ita.json'
-
-    # Process the file to get the dictionary
-    result_dict = process_pipeline_results(input_file)
+def main():
+    """Extracts the cleaned texts of INPUT_PATH (or of STAGE_DATASET_PATH's stored outputs) and saves them to OUTPUT_PATH."""
+    if STAGE_DATASET_PATH is not None:
+        result_dict = extract_from_stages(STAGE_DATASET_PATH, NUM_ITEM_TO_PROCESS)
+    else:
+        result_dict = process_pipeline_results(INPUT_PATH)
 
     # Save the resulting dictionary to the new JSON file
     if result_dict:
-        save_dict_to_json(result_dict, output_file)
+        save_dict_to_json(result_dict, OUTPUT_PATH)
     else:
-        print("No data was processed, so no output file was created.")
\ No newline at end of file
+        print("No data was processed, so no output file was created.")
+
+
+# --- Main execution block ---
+if __name__ == "__main__":
+    main()
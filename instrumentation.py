@@ -0,0 +1,196 @@
+import contextvars
+import json
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+# Structured telemetry of a pipeline run: every stage (pre-processing, cleaning, metrics, judging,
+# saving) is timed as a span labelled with its item and model, and the LLM providers add the
+# tokens, requests and retries of the calls made inside it. Spans are aggregated as they finish,
+# so memory stays flat on large runs; each one can also be streamed to a JSONL file.
+#
+# The current span travels in a context variable, so it follows asyncio tasks and
+# `asyncio.to_thread` calls; code that hands work to its own thread pool must copy the context
+# (see cleaner_LLM.clean_document).
+
+COUNTERS = ["requests", "prompt_tokens", "cached_tokens", "output_tokens", "retries", "cache_hits", "bytes"]
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class RunMetrics:
+    """Thread-safe aggregate of the spans of one run, by (stage, model)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._export = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Starts a new run: clears every aggregate (an open span export stays open)."""
+        with self._lock:
+            self.started = time.time()
+            self._start = time.perf_counter()
+            self.totals = {} # (stage, model) -> {counter: value}
+            self.durations = {} # (stage, model) -> array of span seconds
+            self.item_ids = set()
+
+    def export_spans(self, path: str) -> None:
+        """Also appends every finished span to `path`, one JSON object per line."""
+        self.close()
+        self._export = open(path, "w", encoding="utf-8")
+
+    def close(self) -> None:
+        if self._export is not None:
+            self._export.close()
+            self._export = None
+
+    def add_counts(self, span: dict, **counts) -> None:
+        """Adds to the counters of a span that may be shared by several threads."""
+        with self._lock:
+            for name, value in counts.items():
+                span[name] += value
+
+    def add(self, span: dict) -> None:
+        """Aggregates a finished span."""
+        key = (span["stage"], span["model"])
+        with self._lock:
+            totals = self.totals.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            for name in COUNTERS:
+                totals[name] += span[name]
+            self.durations.setdefault(key, array("d")).append(span["seconds"])
+            if span["item_id"] is not None:
+                self.item_ids.add(span["item_id"])
+            if self._export is not None:
+                self._export.write(json.dumps(span, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _stats(durations: array, totals: dict) -> dict:
+        import numpy as np # Imported here: only the summaries need it, not every script that records spans
+        seconds = np.frombuffer(durations, dtype=np.float64)
+        p50, p95, p99 = np.percentile(seconds * 1000, [50, 95, 99])
+        return {
+            "count": len(seconds),
+            "seconds": round(float(seconds.sum()), 4),
+            "p50_ms": round(p50, 3),
+            "p95_ms": round(p95, 3),
+            "p99_ms": round(p99, 3),
+            **totals,
+        }
+
+    def summary(self) -> dict:
+        """
+        Run summary: per-stage statistics over all models, and the same statistics per model.
+        Nested stages (e.g. "rouge" inside "metrics") are counted in both.
+        """
+        with self._lock:
+            keys = sorted(self.durations, key=lambda key: (key[0], str(key[1])))
+            stages, models = {}, {}
+            for stage in dict.fromkeys(stage for stage, _ in keys):
+                stage_keys = [key for key in keys if key[0] == stage]
+                durations = array("d")
+                totals = dict.fromkeys(COUNTERS, 0)
+                for key in stage_keys:
+                    durations.extend(self.durations[key])
+                    for name in COUNTERS:
+                        totals[name] += self.totals[key][name]
+                stages[stage] = self._stats(durations, totals)
+            for stage, model in keys:
+                if model is not None:
+                    models.setdefault(model, {})[stage] = self._stats(self.durations[(stage, model)], self.totals[(stage, model)])
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "wall_seconds": round(time.perf_counter() - self._start, 3),
+                "items": len(self.item_ids),
+                "stages": stages,
+                "models": models,
+            }
+
+    def write_prometheus(self, path: str, prefix: str = "ocr_pipeline") -> None:
+        """Writes the aggregates in the Prometheus text exposition format, labelled by stage and model."""
+        import numpy as np
+        def label_text(stage: str, model: str, **extra) -> str:
+            labels = {"stage": stage, "model": model, **extra}
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items() if value is not None) + "}"
+
+        lines = []
+        with self._lock:
+            keys = sorted(self.durations, key=lambda key: (key[0], str(key[1])))
+            lines += [f"# HELP {prefix}_stage_seconds Wall time of pipeline stages.",
+                      f"# TYPE {prefix}_stage_seconds summary"]
+            for stage, model in keys:
+                seconds = np.frombuffer(self.durations[(stage, model)], dtype=np.float64)
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(f"{prefix}_stage_seconds{label_text(stage, model, quantile=q)} {np.quantile(seconds, q):.6f}")
+                lines.append(f"{prefix}_stage_seconds_sum{label_text(stage, model)} {seconds.sum():.6f}")
+                lines.append(f"{prefix}_stage_seconds_count{label_text(stage, model)} {len(seconds)}")
+            for name in COUNTERS:
+                lines += [f"# HELP {prefix}_{name}_total Total {name.replace('_', ' ')} by stage and model.",
+                          f"# TYPE {prefix}_{name}_total counter"]
+                lines += [f"{prefix}_{name}_total{label_text(stage, model)} {self.totals[(stage, model)][name]}"
+                          for stage, model in keys]
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+run_metrics = RunMetrics() # Shared by every module, like llm_cache.response_cache
+
+
+# ----------------------------------------------- Spans -----------------------------------------------
+
+@contextmanager
+def stage(name: str, item_id: str = None, model: str = None):
+    """
+    Times the enclosed block as a span of stage `name`. A nested span inherits the item and
+    model of the span around it unless given its own.
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        item_id = item_id if item_id is not None else parent["item_id"]
+        model = model if model is not None else parent["model"]
+    span = {"stage": name, "item_id": item_id, "model": model, "seconds": 0.0, **dict.fromkeys(COUNTERS, 0)}
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span["seconds"] = round(time.perf_counter() - start, 6)
+        _current_span.reset(token)
+        run_metrics.add(span)
+
+def _count(**counts) -> None:
+    span = _current_span.get()
+    if span is not None:
+        run_metrics.add_counts(span, **counts)
+
+def record_usage(prompt_tokens: int, output_tokens: int, cached_tokens: int = 0) -> None:
+    """
+    Called by the providers once per LLM request, with the tokens it was billed for.
+    `cached_tokens` is the part of `prompt_tokens` the backend served from its prefix cache.
+    """
+    _count(requests=1, prompt_tokens=prompt_tokens or 0, cached_tokens=cached_tokens or 0, output_tokens=output_tokens or 0)
+
+def record_retry() -> None:
+    """Called once per retried LLM request."""
+    _count(retries=1)
+
+def record_cache_hit() -> None:
+    """Called when a response is served from llm_cache, or a stage output from stage_store, instead of being recomputed."""
+    _count(cache_hits=1)
+
+def record_bytes(count: int) -> None:
+    """Called with the bytes written to disk inside the current span."""
+    _count(bytes=count)
+
+
+def print_summary(summary: dict) -> None:
+    """Prints the per-stage table of a run summary."""
+    print(f"\nRun summary: {summary['items']} items in {summary['wall_seconds']}s")
+    print(f"{'stage':<12}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'requests':>10}"
+          f"{'in tok':>10}{'cached':>10}{'out tok':>10}{'retries':>9}{'bytes':>12}")
+    for name, stats in summary["stages"].items():
+        print(f"{name:<12}{stats['count']:>8}{stats['seconds']:>10.2f}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['requests']:>10}{stats['prompt_tokens']:>10}{stats['cached_tokens']:>10}{stats['output_tokens']:>10}"
+              f"{stats['retries']:>9}{stats['bytes']:>12}")
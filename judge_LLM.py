@@ -1,9 +1,21 @@
+import copy
 import os
 import json
-# Using 'import google.generativeai as genai' for clarity with older libraries
-from google import genai
+import re
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv # Recommended for API key management
 
+from batch_jobs import batch_path, read_batch_results, write_batch_requests
+from extracter import extract_from_stages, load_extracted
+from instrumentation import record_cache_hit
+from llm_cache import response_cache
+from llm_client import get_client
+from llm_providers import GeminiProvider, LLMProvider, generate_with_retries, get_provider, is_llm_error
+from rate_limiter import AdaptiveLimiter
+
+if TYPE_CHECKING: # The Gemini SDK is only loaded when a client is created (llm_client.py)
+    from google import genai
+
 # --- Configuration ---
 load_dotenv()
 
@@ -11,25 +23,45 @@ load_dotenv()
 # "gemini-pro" is also a very safe and common choice.
 GEMINI_MODEL_NAME = "gemini-1.5-flash" 
 #INPUT_PATH = "clean_judge_files/cleaning_results.json"
+# Extracted data (extracter.py), or a results file of main.py read directly in any layout.
 INPUT_PATH = "extracted_data_ita.json"
 OUTPUT_PATH = "clean_judge_files/judging_results.json"
+# False writes only each item's 'id' and its scores and feedback to OUTPUT_PATH: the texts stay in
+# INPUT_PATH, and extracter.load_extracted(INPUT_PATH, OUTPUT_PATH) joins the two. True also copies
+# the ground truth and the cleaned texts into every result, as earlier versions did.
+OUTPUT_TEXTS = False
+# A dataset path judges the cleaned texts main.py stored for its items (stage_store.py) instead of
+# reading INPUT_PATH, so no extraction step or cleaning rerun is needed; None reads INPUT_PATH.
+STAGE_DATASET_PATH = None
+JUDGE_PROMPT_VERSION = "v2" # Bump whenever the judging prompt changes, to invalidate cached responses
+JUDGED_MODELS = ["gemini", "llama", "mistral"] # Reads '<model>_cleaned' and writes 'score_<model>' for each
+REQUESTS_PER_MINUTE = 60 # Ceiling of the adaptive limiter pacing the judging requests
 
-api_key = os.getenv("GOOGLE_API_KEY")
+# Batch mode: None judges item by item. "prepare" writes every judging prompt to JUDGE_REQUESTS_PATH;
+# after the batch job has run (`python cli.py batch submit`, then `batch download`), "ingest" reads
+# JUDGE_RESULTS_PATH and writes OUTPUT_PATH as usual.
+BATCH_PHASE = None
+JUDGE_REQUESTS_PATH = batch_path("judge_requests.jsonl")
+JUDGE_RESULTS_PATH = batch_path("judge_results.jsonl")
 
-# ----------------------------------------------- LLM Judge Functions -----------------------------------------------
+# Judge backend: "llm" judges with GEMINI_MODEL_NAME through llm_providers.py; "prometheus" grades
+# the outputs of every model with a local Prometheus model, many prompts per forward pass (see
+# PrometheusJudge), with no API calls.
+JUDGE_BACKEND = "llm"
+PROMETHEUS_MODEL_NAME = "Unbabel/M-Prometheus-3B"
+# "transformers" runs on CPU (torch + transformers); "vllm" needs a GPU; "stub" loads no model and
+# answers with a WER-based score, to rehearse a run.
+PROMETHEUS_ENGINE = "transformers"
+PROMETHEUS_LANGUAGE = "eng" # Rubric and prompt language: "eng" or "ita"
+PROMETHEUS_BATCH_SIZE = 16 # Prompts per forward pass
+PROMETHEUS_MAX_NEW_TOKENS = 256
+PROMETHEUS_PROMPT_VERSION = "v1" # Bump whenever the Prometheus prompt or rubric changes, to invalidate cached grades
 
-def judge_with_gemini(client: genai.Client, gemini_cleaned: str, ground_truth: str) -> str:
-    """Judges the quality of Gemini-generated text using a pre-initialized Gemini client."""
-    
-    # Handle empty input gracefully
-    if not gemini_cleaned or not gemini_cleaned.strip():
-        return "0"
-    
-    # --- FIX ---
-    # The client is now passed in as an argument.
-    # We have REMOVED the inefficient 'client = genai.Client(api_key=api_key)' line from here.
+# ----------------------------------------------- LLM Judge Functions -----------------------------------------------
 
-    contents = f"""Evaluate the quality of the "cleaned text" against the "ground truth" reference.
+# The rubric is the same for every call: it goes out as the system instruction, a prefix the
+# backends can cache, and only the two texts change from one request to the next.
+JUDGE_SYSTEM_INSTRUCTION = """Evaluate the quality of the "cleaned text" against the "ground truth" reference.
 Provide a score from 0 to 5 based on the following scale:
 5: Perfect. The cleaned text fully and accurately matches the ground truth.
 4: Excellent. Very minor errors (e.g., one or two typos, a single punctuation mistake) that do not affect meaning.
@@ -38,20 +70,409 @@ Provide a score from 0 to 5 based on the following scale:
 1: Poor. Unacceptable quality; the output is mostly unrelated, unreadable, or nonsensical.
 0: Empty/No Output. The cleaned text was empty.
 
----
+Return ONLY a JSON object with the integer score, e.g. {"score": 3}."""
+
+JUDGE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {"score": {"type": "integer", "minimum": 0, "maximum": 5}},
+    "required": ["score"],
+}
+
+def build_judge_prompt(cleaned_text: str, ground_truth: str) -> str:
+    """Builds the per-item part of the judging prompt (see JUDGE_SYSTEM_INSTRUCTION); shared by the per-item calls and the batch request writer."""
+    return f"""---
 [GROUND TRUTH]:
 {ground_truth}
 ---
 [CLEANED TEXT]:
-{gemini_cleaned}
+{cleaned_text}
 ---
-
-Return ONLY the integer score (0-5) and nothing else.
 """
-    response = client.models.generate_content(
-        model=GEMINI_MODEL_NAME,
-        contents=contents
-    )
+
+def parse_score(response_text: str) -> int:
+    """
+    The score of a judge's response: the "score" field of a structured answer, or else the
+    first integer of a free-text one (older cached or batch responses). -1 indicates an error.
+    """
+    if is_llm_error(response_text):
+        return -1
+    try:
+        score = json.loads(response_text)["score"]
+        if isinstance(score, int):
+            return score
+    except (ValueError, TypeError, KeyError):
+        pass
+    numbers = re.findall(r'\d+', response_text)
+    return int(numbers[0]) if numbers else -1
+
+def judge_with_provider(provider: LLMProvider, model_name: str, cleaned_text: str, ground_truth: str,
+                        limiter: AdaptiveLimiter = None) -> str:
+    """
+    Judges a cleaned text against its ground truth with any backend of llm_providers.py,
+    retrying transient failures (see llm_providers.generate_with_retries).
+    Errors that outlast the retries are returned as an "[LLM_ERROR: ...]" placeholder instead of raised.
+    """
+    # Handle empty input gracefully
+    if not cleaned_text or not cleaned_text.strip():
+        return "0"
+
+    cache_key = response_cache.make_key(model_name, JUDGE_PROMPT_VERSION, cleaned_text, ground_truth)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        record_cache_hit()
+        return cached
+
+    try:
+        judgement = generate_with_retries(provider, build_judge_prompt(cleaned_text, ground_truth), model_name, limiter,
+                                          system_instruction=JUDGE_SYSTEM_INSTRUCTION, response_schema=JUDGE_RESPONSE_SCHEMA)
+    except Exception as e:
+        return f"[LLM_ERROR: {provider.name}/{model_name}: {e}]"
+    if judgement is None:
+        return f"[LLM_ERROR: {provider.name}/{model_name} returned no text]"
+    response_cache.put(cache_key, judgement)
+    return judgement
+
+def judge_with_gemini(client: "genai.Client", gemini_cleaned: str, ground_truth: str, limiter: AdaptiveLimiter = None) -> str:
+    """
+    Judges the quality of Gemini-generated text using a pre-initialized Gemini client.
+    If `client` is None, the shared pooled client is used.
+    """
+    # The client is passed in as an argument, or taken from the shared pool in llm_client.py.
+    provider = get_provider("gemini") if client is None else GeminiProvider(client)
+    return judge_with_provider(provider, GEMINI_MODEL_NAME, gemini_cleaned, ground_truth, limiter)
+
+
+def iter_judge_requests(data_dict: dict):
+    """Yields one ('<item_id>:<model>', prompt) batch request per non-empty cleaned text."""
+    for item_id, item in data_dict.items():
+        ground_truth = item.get('ground_truth', '')
+        if not ground_truth:
+            continue
+        for model in JUDGED_MODELS:
+            cleaned_text = item.get(f'{model}_cleaned', '')
+            if cleaned_text and cleaned_text.strip():
+                yield f"{item_id}:{model}", build_judge_prompt(cleaned_text, ground_truth)
+
+def batch_judgement(batch_results: dict, key: str, cleaned_text: str) -> str:
+    """Looks up a batch judgement, mirroring judge_with_gemini's "0" for empty texts."""
+    if not cleaned_text or not cleaned_text.strip():
+        return "0"
+    return batch_results.get(key, "[BATCH_ERROR: no result for this request]")
+
+
+# ----------------------------------------------- Prometheus Judge -----------------------------------------------
+
+# The absolute grading prompt of prometheus_judgeV4_ENG_ITA.ipynb, with the rubric moved ahead of
+# the per-item fields: task description and rubric then form a prefix shared by every prompt,
+# which the engines encode once instead of once per prompt.
+PROMETHEUS_SYSTEM_PROMPT = "You are a fair judge assistant tasked with providing clear, objective feedback based on a specific score rubric."
+
+PROMETHEUS_RUBRICS = {
+    "eng": {
+        "criteria": "How accurately and completely does the cleaned text represent the ground truth, minimizing OCR errors and maintaining readability?",
+        "score1_description": "Poor: The cleaned text is mostly unrelated to the ground truth, unreadable, nonsensical, or omits vast portions of the original content. Contains severe and numerous errors.",
+        "score2_description": "Fair: The cleaned text has multiple significant errors (e.g., many misrecognized words, incorrect formatting, missing phrases) that make it difficult to understand or misleading.",
+        "score3_description": "Good: The cleaned text is largely correct and understandable but contains some noticeable OCR errors (e.g., a few misrecognized words, minor formatting issues, small omissions/additions) that don't obscure the overall meaning.",
+        "score4_description": "Excellent: The cleaned text is highly accurate with only very minor errors (e.g., one or two typos, a single punctuation mistake, slight spacing issues) that do not affect meaning or readability significantly.",
+        "score5_description": "Perfect: The cleaned text is an exact or near-exact match to the ground truth. It is perfectly readable and free of OCR errors.",
+    },
+    "ita": {
+        "criteria": "Con quale accuratezza e completezza il testo corretto rappresenta il testo di riferimento, minimizzando gli errori OCR e mantenendo la leggibilità?",
+        "score1_description": "Pessimo: Il testo corretto è in gran parte non correlato al testo di riferimento, illeggibile, senza senso o omette ampie porzioni del contenuto originale. Contiene errori gravi e numerosi.",
+        "score2_description": "Sufficiente: Il testo corretto presenta molteplici errori significativi (es. molte parole riconosciute erroneamente, formattazione errata, frasi mancanti) che lo rendono difficile da comprendere o fuorviante.",
+        "score3_description": "Buono: Il testo corretto è in gran parte corretto e comprensibile, ma contiene alcuni errori OCR evidenti (es. alcune parole riconosciute erroneamente, problemi di formattazione minori, piccole omissioni/aggiunte) che non oscurano il significato generale.",
+        "score4_description": "Eccellente: Il testo corretto è estremamente accurato con solo errori molto lievi (es. uno o due errori di battitura, un singolo errore di punteggiatura, lievi problemi di spaziatura) che non influenzano significativamente il significato o la leggibilità.",
+        "score5_description": "Perfetto: Il testo corretto è una corrispondenza esatta o quasi esatta del testo di riferimento. È perfettamente leggibile e privo di errori OCR.",
+    },
+}
+
+PROMETHEUS_RUBRIC_TEMPLATE = """[{criteria}]
+Score 1: {score1_description}
+Score 2: {score2_description}
+Score 3: {score3_description}
+Score 4: {score4_description}
+Score 5: {score5_description}"""
+
+PROMETHEUS_PREFIXES = {
+    "eng": """###Task Description:
+You are a text judge, your task is to act as an impartial judge and evaluate the quality of the provided cleaned text againist the ground truth.
+
+###Evaluation Steps:
+1. Read the instruction, reference answer, and the model's response carefully.
+2. Compare the model's response to the reference answer and evaluate its quality based on the given rubric.
+3. Provide a clear and concise feedback for your score, explaining how the model's response aligns with the ground truth and the rubric criteria.
+4. IMPORTANT: you must give always a detailed feedback even if the model's response is a perfect match (Score 5). For example, explain that "The response is a perfect, character-for-character match with the ground truth, containing no errors and demonstrating perfect readability. Or is a very poor match, with many errors and unreadable text."
+5. IMPORTANT The output format MUST look as follows: "(write a detailed feedback for criteria) [RESULT] (an integer number between 1 and 5)"
+6. Please do not generate any other opening, closing, and explanations.
+
+###Evaluation Rubric:
+{rubric}
+
+""",
+    "ita": """###Descrizione del Compito:
+Sei un giudice di testi, il tuo compito è agire come un giudice imparziale e valutare la qualità del testo corretto fornito rispetto al testo di riferimento.
+
+###Fasi di Valutazione:
+1. Leggi attentamente l'istruzione, il testo di riferimento e la risposta del modello.
+2. Confronta la risposta del modello con il testo di riferimento e valutane la qualità in base alla rubrica fornita.
+3. Fornisci un feedback chiaro e conciso per il tuo punteggio, spiegando come la risposta del modello si allinea al testo di riferimento e ai criteri della rubrica.
+4. IMPORTANTE: devi sempre fornire un feedback dettagliato anche se la risposta del modello è una corrispondenza perfetta (Punteggio 5). Ad esempio, spiega che "La risposta è una corrispondenza perfetta, carattere per carattere, con il testo di riferimento, non contiene errori e dimostra una leggibilità perfetta. Oppure, è una corrispondenza molto scarsa, con molti errori e testo illeggibile."
+5. IMPORTANTE: Il formato dell'output DEVE essere il seguente: "(scrivi un feedback dettagliato per i criteri) [RISULTATO] (un numero intero tra 1 e 5)"
+6. Per favore, non generare altre introduzioni, conclusioni o spiegazioni.
+
+###Rubrica di Valutazione:
+{rubric}
+
+""",
+}
+
+PROMETHEUS_SUFFIXES = {
+    "eng": """###Instruction:
+{instruction}
+
+###Model Response to evaluate (cleaned text):
+{response}
+
+###Reference Answer (score 5) (Ground Truth):
+{reference_answer}
+
+###Feedback: """,
+    "ita": """###Istruzione:
+{instruction}
+
+###Risposta del Modello da Valutare (testo corretto):
+{response}
+
+###Testo di Riferimento (punteggio 5) (Ground Truth):
+{reference_answer}
+
+###Feedback:""",
+}
+
+# (with the OCR text, without it)
+PROMETHEUS_INSTRUCTIONS = {
+    "eng": ("The following text was extracted via OCR and may contain errors: \"{ocr}\". "
+            "Please clean this text to improve its accuracy and readability.",
+            "The task was to clean a piece of text obtained from OCR."),
+    "ita": ("Il seguente testo è stato estratto tramite OCR e potrebbe contenere errori. \"{ocr}\". "
+            "Per favore, correggi questo testo per migliorarne l'accuratezza e la leggibilità.",
+            "il compito è di pulire un pezzo di testo ottenuto tramite OCR."),
+}
+
+_PROMETHEUS_RESULT_RE = re.compile(r"\[(?:RESULT|RISULTATO)\]\s*\(?(\d)")
+
+
+def parse_prometheus_answer(answer: str) -> tuple:
+    """(feedback, score) of a Prometheus answer "<feedback> [RESULT] <score>"; the score is -1 if missing or on errors."""
+    if is_llm_error(answer):
+        return answer, -1
+    match = _PROMETHEUS_RESULT_RE.search(answer)
+    if match is None:
+        return answer.strip(), -1
+    return answer[:match.start()].strip(), int(match.group(1))
+
+
+class TransformersPrometheusEngine:
+    """
+    Prometheus on CPU with Hugging Face transformers. The shared prefix runs through the model
+    once and its key/value cache is copied into every batch, so a forward pass only encodes the
+    per-item part of its prompts. Needs torch and a transformers version with DynamicCache.
+    """
+
+    def __init__(self, model_name: str, max_new_tokens: int):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32).eval()
+        self.max_new_tokens = max_new_tokens
+        self.pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        self._prefix = None # (text, token IDs, key/value cache) of the last prefix encoded
+
+    def _split(self, prefix: str, suffix: str) -> tuple:
+        """The chat-formatted prompt, cut right after the shared prefix."""
+        text = self.tokenizer.apply_chat_template(
+            [{"role": "system", "content": PROMETHEUS_SYSTEM_PROMPT}, {"role": "user", "content": prefix + suffix}],
+            tokenize=False, add_generation_prompt=True)
+        cut = text.index(prefix) + len(prefix)
+        return text[:cut], text[cut:]
+
+    def _prefix_cache(self, head: str) -> tuple:
+        if self._prefix is None or self._prefix[0] != head:
+            ids = self.tokenizer(head, add_special_tokens=False).input_ids
+            with self.torch.no_grad():
+                cache = self.model(self.torch.tensor([ids]), use_cache=True).past_key_values
+            self._prefix = (head, ids, cache)
+        return self._prefix[1], self._prefix[2]
+
+    def generate(self, prefix: str, suffixes: list) -> list:
+        torch = self.torch
+        parts = [self._split(prefix, suffix) for suffix in suffixes]
+        prefix_ids, prefix_cache = self._prefix_cache(parts[0][0])
+        tails = [self.tokenizer(tail, add_special_tokens=False).input_ids for _, tail in parts]
+        width = max(len(tail) for tail in tails)
+        # Rows are prefix, padding, item: the padding goes before the item, so every row ends
+        # where generation starts. Masked padding also keeps the items' positions right.
+        input_ids = torch.tensor([prefix_ids + [self.pad_id] * (width - len(tail)) + tail for tail in tails])
+        attention_mask = torch.tensor([[1] * len(prefix_ids) + [0] * (width - len(tail)) + [1] * len(tail) for tail in tails])
+        cache = copy.deepcopy(prefix_cache)
+        cache.batch_repeat_interleave(len(suffixes))
+        with torch.no_grad():
+            output = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, past_key_values=cache,
+                                         max_new_tokens=self.max_new_tokens, do_sample=False, pad_token_id=self.pad_id)
+        return self.tokenizer.batch_decode(output[:, input_ids.shape[1]:], skip_special_tokens=True)
+
+class VLLMPrometheusEngine:
+    """Prometheus on GPU with vLLM, which schedules the batch and caches the shared prefix itself."""
+
+    def __init__(self, model_name: str, max_new_tokens: int):
+        from vllm import LLM, SamplingParams
+        self.llm = LLM(model=model_name, dtype="float16", trust_remote_code=True, enable_prefix_caching=True)
+        self.sampling_params = SamplingParams(temperature=0, max_tokens=max_new_tokens)
+
+    def generate(self, prefix: str, suffixes: list) -> list:
+        conversations = [[{"role": "system", "content": PROMETHEUS_SYSTEM_PROMPT}, {"role": "user", "content": prefix + suffix}]
+                         for suffix in suffixes]
+        return [output.outputs[0].text for output in self.llm.chat(conversations, self.sampling_params, use_tqdm=False)]
+
+class StubPrometheusEngine:
+    """No model: answers in Prometheus' format with the mock server's WER-based score (1-5), to rehearse a run."""
+
+    def __init__(self, model_name: str, max_new_tokens: int):
+        fields = r"(?P<instruction>.*?)", r"(?P<response>.*?)", r"(?P<reference>.*?)"
+        self.patterns = []
+        for template in PROMETHEUS_SUFFIXES.values():
+            pattern = re.escape(template)
+            for placeholder, field in zip(["{instruction}", "{response}", "{reference_answer}"], fields):
+                pattern = pattern.replace(re.escape(placeholder), field)
+            self.patterns.append(re.compile(pattern + "$", re.DOTALL))
+
+    def generate(self, prefix: str, suffixes: list) -> list:
+        # Imported here, like llm_providers.MockProvider.
+        from mock_llm_server import mock_completion
+        answers = []
+        for suffix in suffixes:
+            match = next(filter(None, (pattern.match(suffix) for pattern in self.patterns)))
+            score = int(mock_completion(build_judge_prompt(match.group("response"), match.group("reference"))))
+            answers.append(f"Stub grade from the word error rate of the cleaned text. [RESULT] {max(score, 1)}")
+        return answers
+
+_PROMETHEUS_ENGINES = {
+    "transformers": TransformersPrometheusEngine,
+    "vllm": VLLMPrometheusEngine,
+    "stub": StubPrometheusEngine,
+}
+
+
+class PrometheusJudge:
+    """
+    Absolute grading (1-5) of cleaned texts against their ground truth with a local Prometheus
+    model. Prompts go to the engine `batch_size` at a time, each batch one forward pass per
+    generated token, so a run costs about one pass per batch instead of one per prompt.
+    Prompts are sorted by length before batching, to keep the padding inside a batch small.
+    """
+
+    def __init__(self, engine: str = PROMETHEUS_ENGINE, model_name: str = PROMETHEUS_MODEL_NAME, language: str = PROMETHEUS_LANGUAGE,
+                 batch_size: int = PROMETHEUS_BATCH_SIZE, max_new_tokens: int = PROMETHEUS_MAX_NEW_TOKENS):
+        factory = _PROMETHEUS_ENGINES.get(engine)
+        if factory is None:
+            raise ValueError(f"Unknown Prometheus engine '{engine}'. Available: {sorted(_PROMETHEUS_ENGINES)}")
+        if language not in PROMETHEUS_RUBRICS:
+            raise ValueError(f"No Prometheus rubric for language '{language}'. Available: {sorted(PROMETHEUS_RUBRICS)}")
+        self.engine = factory(model_name, max_new_tokens)
+        self.cache_model = f"prometheus-{engine}:{model_name}" # stub answers never mix with a real model's
+        self.language = language
+        self.batch_size = batch_size
+        self.prefix = PROMETHEUS_PREFIXES[language].format(rubric=PROMETHEUS_RUBRIC_TEMPLATE.format(**PROMETHEUS_RUBRICS[language]))
+
+    def build_suffix(self, cleaned_text: str, ground_truth: str, original_ocr: str = None) -> str:
+        """The per-item part of a prompt, which follows the shared prefix."""
+        with_ocr, without_ocr = PROMETHEUS_INSTRUCTIONS[self.language]
+        instruction = with_ocr.format(ocr=original_ocr) if original_ocr else without_ocr
+        return PROMETHEUS_SUFFIXES[self.language].format(instruction=instruction, response=cleaned_text, reference_answer=ground_truth)
+
+    def grade(self, requests: list) -> list:
+        """
+        Grades (cleaned_text, ground_truth, original_ocr) requests. Empty texts get 1 and exact
+        matches 5 without a prompt; answers are cached like judge_with_provider's.
+
+        Returns:
+            list: One (feedback, score) per request, in order.
+        """
+        grades = [None] * len(requests)
+        pending = [] # (index, cache key, suffix) of the requests for the model
+        for index, (cleaned_text, ground_truth, original_ocr) in enumerate(requests):
+            if not cleaned_text or not cleaned_text.strip():
+                grades[index] = ("Cleaned text was empty.", 1)
+            elif cleaned_text.strip() == ground_truth.strip():
+                grades[index] = ("The response is a perfect match to the ground truth, containing no errors.", 5)
+            else:
+                suffix = self.build_suffix(cleaned_text, ground_truth, original_ocr)
+                cache_key = response_cache.make_key(self.cache_model, PROMETHEUS_PROMPT_VERSION, self.prefix, suffix)
+                cached = response_cache.get(cache_key)
+                if cached is not None:
+                    record_cache_hit()
+                    grades[index] = parse_prometheus_answer(cached)
+                else:
+                    pending.append((index, cache_key, suffix))
+
+        pending.sort(key=lambda request: len(request[2]))
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            try:
+                answers = self.engine.generate(self.prefix, [suffix for _, _, suffix in batch])
+            except Exception as e:
+                print(f"Error during Prometheus grading: {e}")
+                answers = [f"[LLM_ERROR: prometheus: {e}]"] * len(batch)
+            for (index, cache_key, _), answer in zip(batch, answers):
+                if not is_llm_error(answer):
+                    response_cache.put(cache_key, answer)
+                grades[index] = parse_prometheus_answer(answer)
+            print(f"  Graded {start + len(batch)}/{len(pending)} prompts")
+        return grades
+
+
+def judge_with_prometheus(data_dict: dict, judge: PrometheusJudge) -> list:
+    """
+    Grades the cleaned text of every JUDGED_MODELS model for every item with one `grade` call,
+    so prompts of all items and models share batches.
+
+    Returns:
+        list: One result per item with a ground truth: its 'id', its texts if OUTPUT_TEXTS, and
+              'score_<model>' and 'feedback_<model>' for each model.
+    """
+    items = [(item_id, item) for item_id, item in data_dict.items() if item.get('ground_truth')]
+    if len(items) < len(data_dict):
+        print(f"  Skipping {len(data_dict) - len(items)} items due to empty ground_truth.")
+    requests = [(item.get(f'{model}_cleaned', ''), item['ground_truth'], item.get('original_ocr'))
+                for _, item in items for model in JUDGED_MODELS]
+    grades = iter(judge.grade(requests))
+
+    results = []
+    for item_id, item in items:
+        result = {'id': item_id}
+        if OUTPUT_TEXTS:
+            result.update(original_ocr=item.get('original_ocr'), ground_truth=item['ground_truth'])
+        for model in JUDGED_MODELS:
+            feedback, score = next(grades)
+            if OUTPUT_TEXTS:
+                result[f'{model}_cleaned'] = item.get(f'{model}_cleaned', '')
+            result[f'score_{model}'] = score
+            result[f'feedback_{model}'] = feedback
+        results.append(result)
+    return results
+
+
+def save_results(results: list) -> None:
+    """Writes the judging results to OUTPUT_PATH."""
+    output_dir = os.path.dirname(OUTPUT_PATH)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+
+    print(f"\nJudging complete! Results saved to '{OUTPUT_PATH}'")
 
 
 #--------------------------------------------------------------------------------------------------------------------------------
@@ -61,73 +482,107 @@ def main():
     Main function to read data, judge it with Gemini, and save the results.
     """
 
-    # --- 1. Read Input File ---
-    try:
-        with open(INPUT_PATH, 'r', encoding='utf-8') as f:
-            data_dict = json.load(f)
-        print(f"Successfully loaded {len(data_dict)} items from '{INPUT_PATH}'")
-    except FileNotFoundError:
-        print(f"Error: Input file not found at '{INPUT_PATH}'")
+    # --- 1. Read Input File (or the stored cleaning outputs) ---
+    if STAGE_DATASET_PATH is not None:
+        data_dict = extract_from_stages(STAGE_DATASET_PATH)
+        if not data_dict:
+            print(f"Error: no stored cleaning outputs for the items of '{STAGE_DATASET_PATH}'. Run main.py first.")
+            return
+        print(f"Loaded the stored cleaning outputs of {len(data_dict)} items of '{STAGE_DATASET_PATH}'")
+    else:
+        try:
+            data_dict = load_extracted(INPUT_PATH)
+            print(f"Successfully loaded {len(data_dict)} items from '{INPUT_PATH}'")
+        except FileNotFoundError:
+            print(f"Error: Input file not found at '{INPUT_PATH}'")
+            return
+        except ValueError as e: # json.JSONDecodeError is a ValueError
+            print(f"Error: Could not read '{INPUT_PATH}'. Please check its format. ({e})")
+            return
+
+    # --- Prometheus Backend: every model's outputs graded locally, in batches ---
+    if JUDGE_BACKEND == "prometheus":
+        try:
+            judge = PrometheusJudge(PROMETHEUS_ENGINE, PROMETHEUS_MODEL_NAME, PROMETHEUS_LANGUAGE,
+                                    PROMETHEUS_BATCH_SIZE, PROMETHEUS_MAX_NEW_TOKENS)
+        except Exception as e:
+            print(f"Error initializing the Prometheus judge ({PROMETHEUS_ENGINE}, '{PROMETHEUS_MODEL_NAME}'): {e}")
+            return
+        save_results(judge_with_prometheus(data_dict, judge))
+        response_cache.report()
         return
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from '{INPUT_PATH}'. Please check its format.")
+
+    # --- Batch Mode, Phase One: only write the prompts ---
+    if BATCH_PHASE == "prepare":
+        write_batch_requests(iter_judge_requests(data_dict), JUDGE_REQUESTS_PATH,
+                             system_instruction=JUDGE_SYSTEM_INSTRUCTION, response_schema=JUDGE_RESPONSE_SCHEMA)
+        print(f"Run the batch job (python cli.py batch submit --requests {JUDGE_REQUESTS_PATH} --model {GEMINI_MODEL_NAME}, "
+              f"then batch download --requests {JUDGE_REQUESTS_PATH} --results {JUDGE_RESULTS_PATH}), "
+              f"then rerun with BATCH_PHASE = \"ingest\".")
         return
 
+    batch_results = None
+    if BATCH_PHASE == "ingest":
+        try:
+            batch_results = read_batch_results(JUDGE_RESULTS_PATH)
+        except FileNotFoundError:
+            print(f"Error: Batch results file not found at '{JUDGE_RESULTS_PATH}'")
+            return
+
     # --- 2. Initialize Client Once ---
     # --- FIX ---
     # Initialize the client here, ONE time, before the loop starts.
     # This uses the initialization method from your original code.
-    try:
-        client = genai.Client(api_key=api_key)
-        print("Gemini Client initialized successfully.")
-    except Exception as e:
-        print(f"Fatal Error: Could not initialize genai.Client. Check API Key. Error: {e}")
-        print("This might be an issue with your API key or an incompatible 'google-generativeai' library version.")
-        return
+    client = None
+    if batch_results is None:
+        try:
+            client = get_client("gemini", GEMINI_MODEL_NAME)
+            print("Gemini Client initialized successfully.")
+        except Exception as e:
+            print(f"Fatal Error: Could not initialize genai.Client. Check API Key. Error: {e}")
+            print("This might be an issue with your API key or an incompatible 'google-generativeai' library version.")
+            return
 
     # --- 3. Process Data ---
     results = []
+    limiter = AdaptiveLimiter(REQUESTS_PER_MINUTE, max_concurrent=1)
     # --- MAJOR FIX ---
     # The original error was because you were looping over a dictionary's keys (strings).
     # We must loop over its VALUES to get the data objects.
-    for i, item in enumerate(data_dict.values(), 1):
+    missing = set()
+    for i, (item_id, item) in enumerate(data_dict.items(), 1):
 
         print(f"Processing item {i}/{len(data_dict)}...")
-        # Your original code failed here because 'item' was a string. It is now a dictionary.
-        gemini_cleaned = item.get('gemini_cleaned', '')
-        llama_cleaned = item.get('llama_cleaned', '')
-        mistral_cleaned = item.get('mistral_cleaned', '')
         ground_truth = item.get('ground_truth', '')
 
         if not ground_truth:
             print(f"  Skipping item {i} due to empty ground_truth.")
             continue
-        
-        # --- FIX ---
-        # Pass the initialized 'client' object to each function call.
-        score_gemini = judge_with_gemini(client, gemini_cleaned, ground_truth)
-        score_llama = judge_with_gemini(client, llama_cleaned, ground_truth)
-        score_mistral = judge_with_gemini(client, mistral_cleaned, ground_truth)
-
-        results.append({
-            'ground_truth': ground_truth,
-            'gemini_cleaned': gemini_cleaned,
-            'score_gemini': score_gemini,
-            'llama_cleaned': llama_cleaned,
-            'score_llama': score_llama,
-            'mistral_cleaned': mistral_cleaned, 
-            'score_mistral': score_mistral
-        })
 
-    # --- 4. Save Results ---
-    output_dir = os.path.dirname(OUTPUT_PATH)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
+        result = {'id': item_id}
+        if OUTPUT_TEXTS:
+            result['ground_truth'] = ground_truth
+        for model in JUDGED_MODELS:
+            if f'{model}_cleaned' not in item:
+                missing.add(model)
+                continue
+            cleaned_text = item[f'{model}_cleaned']
+            if batch_results is not None:
+                response = batch_judgement(batch_results, f"{item_id}:{model}", cleaned_text)
+            else:
+                response = judge_with_gemini(client, cleaned_text, ground_truth, limiter)
+            if OUTPUT_TEXTS:
+                result[f'{model}_cleaned'] = cleaned_text
+            # The judge answers {"score": n}: each score is stored as an int, -1 when it cannot be parsed.
+            result[f'score_{model}'] = parse_score(response)
+        results.append(result)
 
-    with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
-    
-    print(f"\nJudging complete! Results saved to '{OUTPUT_PATH}'")
+    if missing:
+        print(f"Warning: no '<model>_cleaned' text for {sorted(missing)} in some items; those were not judged.")
+
+    # --- 4. Save Results ---
+    save_results(results)
+    response_cache.report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# --- Configuration ---
+CACHE_DIR = "cache/llm_responses"
+MAX_CACHE_BYTES = 500 * 1024 * 1024 # Oldest entries are evicted beyond this size
+MAX_CACHE_AGE_SECONDS = 30 * 24 * 3600 # Entries older than this are treated as misses and evicted
+
+
+class ResponseCache:
+    """
+    On-disk, content-addressed cache of LLM responses.
+
+    Each entry is a small JSON file named after the SHA-256 of (model name, prompt template
+    version, input texts), sharded into sub-directories by the first two hex characters.
+    Reads refresh the file's mtime, so size-based eviction drops the least recently used entries;
+    age-based expiry uses the "created" time stored in the entry, which reads leave alone.
+    The pipeline's stage outputs, kept for good, are in stage_store.py (see there for why both exist).
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES,
+                 max_age_seconds: float = MAX_CACHE_AGE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, prompt_version: str, *inputs: str) -> str:
+        """Hashes everything that determines the response into a cache key."""
+        payload = json.dumps([model_name, prompt_version, list(inputs)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str):
+        """Returns the cached response text, or None on a miss or an expired entry."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if self._expired(entry, os.path.getmtime(path)):
+                os.remove(path)
+                self._count(hit=False)
+                return None
+            value = entry["response"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return value
+
+    def _expired(self, entry: dict, mtime: float) -> bool:
+        """Whether an entry is older than `max_age_seconds`; entries without "created" count from their mtime."""
+        return time.time() - entry.get("created", mtime) > self.max_age_seconds
+
+    def put(self, key: str, response: str) -> None:
+        """Stores a response. The write is atomic, so concurrent readers never see partial files."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"response": response, "created": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write LLM cache entry {key[:12]}: {e}")
+
+    def evict(self) -> int:
+        """Removes expired entries, then the least recently used ones until under `max_bytes`."""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    # The mtime is refreshed by reads, so it is never older than the entry: only
+                    # entries it does not already show as expired need their "created" time read.
+                    expired = now - stat.st_mtime > self.max_age_seconds
+                    if not expired:
+                        with open(path, "r", encoding="utf-8") as f:
+                            expired = self._expired(json.load(f), stat.st_mtime)
+                    if expired:
+                        os.remove(path)
+                        removed += 1
+                        continue
+                except (OSError, ValueError):
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            removed += 1
+        return removed
+
+    def report(self) -> None:
+        """Prints hit/miss counts for this run and applies eviction."""
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        print(f"LLM response cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)")
+        removed = self.evict()
+        if removed:
+            print(f"LLM response cache: evicted {removed} entries.")
+
+
+# Shared by cleaner_LLM.py and judge_LLM.py so one run reports a single set of counts.
+response_cache = ResponseCache()
@@ -0,0 +1,66 @@
+import os
+import threading
+from typing import TYPE_CHECKING
+import httpx
+from dotenv import load_dotenv
+
+if TYPE_CHECKING: # Imported at run time in _create_gemini_client, where it is needed
+    from google import genai
+
+load_dotenv()
+
+# --- Connection Pool Configuration ---
+MAX_CONNECTIONS = 32 # Upper bound on simultaneous HTTP connections per client
+KEEPALIVE_EXPIRY_SECONDS = 120 # Idle connections are kept open this long for reuse
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _create_gemini_client() -> "genai.Client":
+    """Builds a Gemini client whose sync and async HTTP pools keep connections alive."""
+    # Imported here: the SDK takes about half a second to load, and only Gemini runs need it.
+    from google import genai
+    from google.genai import types
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+    http_options = types.HttpOptions(
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+_CLIENT_FACTORIES = {
+    "gemini": _create_gemini_client,
+}
+
+
+def get_client(provider: str = "gemini", model_name: str = None):
+    """
+    Returns the shared client for (provider, model_name), creating it on first use.
+
+    Clients are created once per process and reused by every caller, so connection setup and
+    TLS handshakes are paid once instead of per request. Creation is guarded by a lock, and the
+    returned clients are safe to use concurrently from threads and asyncio tasks.
+    """
+    key = (provider, model_name)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            factory = _CLIENT_FACTORIES.get(provider)
+            if factory is None:
+                raise ValueError(f"Unknown LLM provider '{provider}'. Available: {sorted(_CLIENT_FACTORIES)}")
+            client = factory()
+            _clients[key] = client
+    return client
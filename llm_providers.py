@@ -0,0 +1,286 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from dotenv import load_dotenv
+
+from chunker import estimate_tokens
+from instrumentation import record_retry, record_usage
+from llm_client import KEEPALIVE_EXPIRY_SECONDS, MAX_CONNECTIONS, get_client
+from rate_limiter import RetryBudget
+
+load_dotenv()
+
+# --- Configuration ---
+HTTP_TIMEOUT_SECONDS = 120 # Timeout of one attempt
+REQUEST_DEADLINE_SECONDS = 300 # A request (all its attempts and backoff sleeps) gives up after this long
+MAX_ATTEMPTS = 6 # Attempts per request, first one included
+BACKOFF_BASE_SECONDS = 1.0 # Backoff before retry k is uniform in [0, base * 2**k] ("full jitter")...
+BACKOFF_MAX_SECONDS = 60.0 # ...capped at this
+RETRY_BUDGET_RATIO = 0.2 # Retries allowed per run: this many per first attempt...
+RETRY_BUDGET_MINIMUM = 20 # ...plus this many
+BATCH_WORKERS = 8 # Default parallel requests of `batch_generate`
+
+# Error placeholders returned instead of text. The first two come from older code paths.
+ERROR_MARKERS = ("[GEMINI_", "[BATCH_ERROR", "[LLM_ERROR")
+
+
+def is_llm_error(text: str) -> bool:
+    """True for a missing response or one of the error placeholders of ERROR_MARKERS."""
+    return text is None or any(marker in text for marker in ERROR_MARKERS)
+
+
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MINIMUM) # Shared by every request of a run
+
+
+def classify_failure(error: Exception) -> tuple:
+    """
+    How a failed request should be handled.
+
+    Returns:
+        tuple: (outcome, retry_after) where outcome is "overload" (429, 5xx, timeout or lost
+               connection: retried, and the limiter backs off) or "error" (anything else: not
+               retried), and retry_after is the server's Retry-After in seconds, or None.
+    """
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError)):
+        return "overload", None
+    response = getattr(error, "response", None)
+    status = getattr(error, "status", None) or getattr(error, "code", None) or getattr(response, "status_code", None)
+    if not isinstance(status, int):
+        return "error", None
+    retry_after = None
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    if status in (408, 429) or status >= 500:
+        return "overload", retry_after
+    return "error", None
+
+def generate_with_retries(provider, prompt: str, model: str, limiter=None, deadline_seconds: float = REQUEST_DEADLINE_SECONDS,
+                          system_instruction: str = None, response_schema: dict = None) -> str:
+    """
+    `provider.generate` with retries. Overload failures are retried after a jittered
+    exponential backoff (or the server's Retry-After), while the run's retry budget lasts and
+    the request's deadline has not passed; each attempt's timeout is cut to fit the deadline.
+
+    If `limiter` (a rate_limiter.AdaptiveLimiter) is given, every attempt takes one of its
+    slots and reports how it ended, so the limiter can adapt to the backend.
+    `system_instruction` and `response_schema` are passed on to `generate`.
+
+    Raises:
+        The last attempt's exception once retrying stops.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    retry_budget.record_request()
+    for attempt in range(MAX_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        ticket = limiter.acquire() if limiter is not None else None
+        try:
+            text = provider.generate(prompt, model, timeout=max(1.0, min(HTTP_TIMEOUT_SECONDS, remaining)),
+                                     system_instruction=system_instruction, response_schema=response_schema)
+        except Exception as e:
+            outcome, retry_after = classify_failure(e)
+            if limiter is not None:
+                limiter.release(ticket, outcome)
+            backoff = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            if retry_after is not None:
+                backoff = max(backoff, retry_after)
+            if (outcome != "overload" or attempt + 1 == MAX_ATTEMPTS
+                    or time.monotonic() + backoff >= deadline or not retry_budget.try_spend()):
+                raise
+            record_retry()
+            time.sleep(backoff)
+            continue
+        if limiter is not None:
+            limiter.release(ticket, "success")
+        return text
+
+
+class LLMProvider:
+    """
+    Interface of a text-generation backend.
+
+    Backends are created once per process by `get_provider`, and their constructors fail early
+    (missing API key, unknown provider) so a misconfigured run stops before the first item.
+
+    Subclasses implement `generate`, reporting each request's tokens with
+    `instrumentation.record_usage`; `batch_generate` and `stream` have generic fallbacks built
+    on it. A `system_instruction` is sent ahead of the prompt as the backend's system message, so
+    static instructions form a prefix the backend can cache across requests; a `response_schema`
+    (JSON Schema) constrains the answer to matching JSON. Providers are shared by every thread and asyncio task of a run, so implementations
+    must be thread-safe.
+    """
+
+    name = "base"
+
+    def generate(self, prompt: str, model: str, timeout: float = None,
+                 system_instruction: str = None, response_schema: dict = None) -> str:
+        """Returns the completion of a single prompt; `timeout` (seconds) bounds this one attempt."""
+        raise NotImplementedError
+
+    def batch_generate(self, prompts: list, model: str, max_workers: int = BATCH_WORKERS, limiter=None) -> list:
+        """
+        Completions of many prompts, in order, each through `generate_with_retries`. Requests
+        run concurrently over the shared connection pool.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda prompt: generate_with_retries(self, prompt, model, limiter), prompts))
+
+    def stream(self, prompt: str, model: str):
+        """Yields the completion in pieces as they arrive. The fallback yields it whole."""
+        yield self.generate(prompt, model)
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through the pooled `genai.Client` of llm_client.py."""
+
+    name = "gemini"
+
+    def __init__(self, client=None):
+        self.client = client if client is not None else get_client("gemini")
+
+    def generate(self, prompt: str, model: str, timeout: float = None,
+                 system_instruction: str = None, response_schema: dict = None) -> str:
+        from google.genai import types # Imported here, like the client in llm_client.py
+        # Gemini caches repeated request prefixes implicitly; the system instruction comes first.
+        options = {}
+        if timeout is not None:
+            options["http_options"] = types.HttpOptions(timeout=int(timeout * 1000))
+        if system_instruction is not None:
+            options["system_instruction"] = system_instruction
+        if response_schema is not None:
+            options["response_mime_type"] = "application/json"
+            options["response_json_schema"] = response_schema
+        config = types.GenerateContentConfig(**options) if options else None
+        response = self.client.models.generate_content(model=model, contents=prompt, config=config)
+        usage = response.usage_metadata
+        if usage is not None:
+            record_usage(usage.prompt_token_count, usage.candidates_token_count, usage.cached_content_token_count)
+        else:
+            record_usage(estimate_tokens((system_instruction or "") + prompt), estimate_tokens(response.text or ""))
+        return response.text
+
+    def stream(self, prompt: str, model: str):
+        for chunk in self.client.models.generate_content_stream(model=model, contents=prompt):
+            if chunk.text:
+                yield chunk.text
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    Any server exposing the OpenAI chat completions API: Groq, a local vLLM server, or
+    mock_llm_server.py. One keep-alive connection pool per provider.
+    """
+
+    def __init__(self, name: str, base_url: str, api_key_env: str = None):
+        self.name = name
+        headers = {}
+        if api_key_env:
+            api_key = os.getenv(api_key_env)
+            if not api_key:
+                raise ValueError(f"{api_key_env} not found in environment variables.")
+            headers["Authorization"] = f"Bearer {api_key}"
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        )
+        self.http = httpx.Client(base_url=base_url.rstrip("/"), headers=headers, limits=limits, timeout=HTTP_TIMEOUT_SECONDS)
+
+    @staticmethod
+    def _payload(prompt: str, model: str, stream: bool, system_instruction: str = None, response_schema: dict = None) -> dict:
+        # A leading system message is the prefix vLLM's automatic prefix caching (and OpenAI-style
+        # prompt caching) reuses across requests.
+        messages = [{"role": "user", "content": prompt}]
+        if system_instruction is not None:
+            messages.insert(0, {"role": "system", "content": system_instruction})
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0,
+            "stream": stream,
+        }
+        if response_schema is not None:
+            payload["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": response_schema}}
+        return payload
+
+    def generate(self, prompt: str, model: str, timeout: float = None,
+                 system_instruction: str = None, response_schema: dict = None) -> str:
+        payload = self._payload(prompt, model, False, system_instruction, response_schema)
+        response = self.http.post("/chat/completions", json=payload, timeout=timeout or HTTP_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        body = response.json()
+        text = body["choices"][0]["message"]["content"]
+        usage = body.get("usage") or {}
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        record_usage(usage.get("prompt_tokens", estimate_tokens((system_instruction or "") + prompt)),
+                     usage.get("completion_tokens", estimate_tokens(text or "")), cached)
+        return text
+
+    def stream(self, prompt: str, model: str):
+        # Server-sent events: "data: {chunk}" lines, terminated by "data: [DONE]".
+        with self.http.stream("POST", "/chat/completions", json=self._payload(prompt, model, stream=True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                piece = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if piece:
+                    yield piece
+
+
+class MockProvider(LLMProvider):
+    """In-process deterministic backend with the same answers as mock_llm_server.py; no network at all."""
+
+    name = "mock"
+
+    def generate(self, prompt: str, model: str, timeout: float = None,
+                 system_instruction: str = None, response_schema: dict = None) -> str:
+        # Imported here: the mock's answers use the pre-cleaning and metrics modules.
+        from mock_llm_server import mock_completion, mock_usage
+        text = mock_completion(prompt, model, system_instruction, structured=response_schema is not None)
+        record_usage(*mock_usage(prompt, text, system_instruction))
+        return text
+
+
+_PROVIDER_FACTORIES = {
+    "gemini": GeminiProvider,
+    "groq": lambda: OpenAICompatibleProvider("groq", "https://api.groq.com/openai/v1", "GROQ_API_KEY"),
+    "vllm": lambda: OpenAICompatibleProvider("vllm", os.getenv("VLLM_BASE_URL", "http://localhost:8000/v1")),
+    "mock-server": lambda: OpenAICompatibleProvider("mock-server", os.getenv("MOCK_LLM_BASE_URL", "http://127.0.0.1:8765/v1")),
+    "mock": MockProvider,
+}
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: str) -> LLMProvider:
+    """Returns the shared provider called `name`, creating it on first use (see _PROVIDER_FACTORIES)."""
+    provider = _providers.get(name)
+    if provider is not None:
+        return provider
+
+    with _providers_lock:
+        provider = _providers.get(name)
+        if provider is None:
+            factory = _PROVIDER_FACTORIES.get(name)
+            if factory is None:
+                raise ValueError(f"Unknown LLM provider '{name}'. Available: {sorted(_PROVIDER_FACTORIES)}")
+            provider = factory()
+            _providers[name] = provider
+    return provider
+
+def register_provider(name: str, factory) -> None:
+    """Adds (or replaces) a backend: `factory()` must return an LLMProvider. Used for test and benchmark fakes."""
+    with _providers_lock:
+        _PROVIDER_FACTORIES[name] = factory
+        _providers.pop(name, None)
@@ -1,143 +1,718 @@
+import asyncio
+import hashlib
 import json
-import os
-import re
+import multiprocessing
 import time
-from google import genai
 from dotenv import load_dotenv
-import jiwer
-import evaluate
 
-from cleaner_LLM import clean_with_gemini
-from judge_LLM import judge_with_gemini
+from batch_jobs import batch_path, read_batch_results, write_batch_requests
+from chunker import MAX_CHUNK_TOKENS, chunk_text, stitch_chunks
+from dataset_handler import load_dataset
+from diff_engine import diff_words
+from cleaner_LLM import build_clean_prompt, clean_document, CLEAN_PROMPT_VERSION, GEMINI_MODEL_NAME as CLEANER_MODEL_NAME
+from judge_LLM import (build_judge_prompt, judge_with_provider, parse_score, GEMINI_MODEL_NAME as JUDGE_MODEL_NAME,
+                       JUDGE_PROMPT_VERSION, JUDGE_RESPONSE_SCHEMA, JUDGE_SYSTEM_INSTRUCTION)
+from instrumentation import print_summary, record_bytes, run_metrics, stage
+from llm_cache import response_cache
+from llm_providers import get_provider, is_llm_error, retry_budget
+from metrics_engine import corpus_error_rates, score_pairs
+from native_rouge import NativeRouge
+from pre_clean import pre_clean
+from triage import NOISE_THRESHOLD, has_wordlist, needs_llm
+from result_writer import JsonlResultWriter, finalize_results, iter_results, load_completed_ids, read_run_header
+from rate_limiter import AdaptiveLimiter
+from shard_queue import ShardQueue, worker_name
+from stage_store import stage_store
 
 # --- 1. Configuration ---
 load_dotenv()
 
 # Model and File Configuration
-INPUT_PATH = "dataset/eng/the_vampyre_subset.json"
+INPUT_PATH = "dataset/eng/the_vampyre_subset.json" # JSON object keyed by ID, or JSONL from dataset_handler.py
 OUTPUT_PATH = "results/full_pipeline_results.json"
+# OUTPUT_PATH layout: True writes the compact, versioned layout (every text stored once, in a text
+# table keyed by content hash; see result_writer.py), False the earlier one with the texts in every
+# record. result_writer.load_results and extracter.py read both.
+COMPACT_RESULTS = True
+CHECKPOINT_PATH = "results/full_pipeline_results.jsonl" # Each item is appended here as soon as it finishes
+RESUME = True # Skip items already in CHECKPOINT_PATH (only if it was written for the same input and configuration); False starts a fresh checkpoint
 NUM_ITEM_TO_PROCESS = 6 # Set to a larger number or `None` to process all
 
-def parse_score(response_text: str) -> int:
-    """Extracts the first integer from the judge's response for robustness."""
-    numbers = re.findall(r'\d+', response_text)
-    return int(numbers[0]) if numbers else -1 # -1 indicates a parsing error
+# Incremental reruns: every stage output is stored under a hash of its inputs and configuration
+# (stage_store.py), so a rerun with RESUME = False recomputes only the stages whose inputs changed,
+# e.g. only the judge after a judging prompt change. Bump a stage's version here when its code
+# changes; the cleaning and judging prompts have their own versions in cleaner_LLM.py and judge_LLM.py.
+USE_STAGE_STORE = True
+STAGE_VERSIONS = {"pre_process": "v3", "metrics": "v1", "diff": "v2"}
+
+# Pre-processing Configuration
+LANGUAGE = "eng" # "eng" or "ita": pre-cleaning rule set and triage wordlist
+PRE_CLEAN = True # Fix trivial OCR artifacts with rules before the LLM (pre_clean.py)
+TRIAGE_THRESHOLD = NOISE_THRESHOLD # Items scoring below this skip the LLM (triage.py); None sends every item
+
+# Model Configuration: every cleaner in MODELS_TO_RUN cleans every item, and JUDGE_CONFIG judges each output.
+# "provider" is a backend of llm_providers.py ("gemini", "groq", "vllm", "mock-server", "mock"). Each model
+# has its own limits: "max_concurrent" calls in flight (async mode) and a "requests_per_minute" token bucket.
+MODEL_CONFIGS = {
+    "Gemini-2.0-Flash": {"provider": "gemini", "model": CLEANER_MODEL_NAME, "max_concurrent": 8, "requests_per_minute": 60},
+    "Llama": {"provider": "groq", "model": "llama-3.3-70b-versatile", "max_concurrent": 4, "requests_per_minute": 30},
+    "Mistral": {"provider": "vllm", "model": "mistralai/Mistral-7B-Instruct-v0.3", "max_concurrent": 16, "requests_per_minute": 600},
+    "Mock": {"provider": "mock", "model": "mock", "max_concurrent": 32, "requests_per_minute": 6000},
+}
+MODELS_TO_RUN = ["Gemini-2.0-Flash"] # Keys of MODEL_CONFIGS; ["Mock"] runs the whole pipeline offline
+JUDGE_CONFIG = {"provider": "gemini", "model": JUDGE_MODEL_NAME, "max_concurrent": 8, "requests_per_minute": 60}
+
+# Execution Configuration
+ASYNC_MODE = True # Process items concurrently; set to False for the one-at-a-time loop
+
+# Sharded mode: with a SHARD_QUEUE_DIR, the items are split into shards of SHARD_SIZE and this process
+# becomes one worker of the queue in that directory (shard_queue.py). Every main.py started with the
+# same configuration, on this machine or another one sharing the directory, claims shards until none
+# is left, and the last worker to finish merges them into OUTPUT_PATH. SHARD_WORKERS > 1 also starts
+# that many workers here. Shards of crashed workers are taken over once their lease runs out.
+SHARD_QUEUE_DIR = None # e.g. "results/shards"
+SHARD_SIZE = 50
+SHARD_WORKERS = 1
+
+# Batch mode: None calls the API per item. For large runs on the offline batch endpoint, run in turn:
+#   "prepare-clean" -> writes every cleaning prompt to CLEAN_REQUESTS_PATH
+#   "prepare-judge" -> reads CLEAN_RESULTS_PATH, writes every judging prompt to JUDGE_REQUESTS_PATH
+#   "ingest"        -> reads both results files, computes metrics and writes OUTPUT_PATH as usual
+# After each prepare phase, `python cli.py batch submit` then `batch download` turn the requests file
+# into its results file through the Gemini Batch API (or `batch run-local`, one request at a time).
+# Batch files hold the requests of one Gemini model only: BATCH_MODEL.
+BATCH_PHASE = None
+BATCH_MODEL = "Gemini-2.0-Flash"
+CLEAN_REQUESTS_PATH = batch_path("clean_requests.jsonl")
+CLEAN_RESULTS_PATH = batch_path("clean_results.jsonl")
+JUDGE_REQUESTS_PATH = batch_path("judge_requests.jsonl")
+JUDGE_RESULTS_PATH = batch_path("judge_results.jsonl")
+
+# Telemetry: a run summary (time, tokens, requests, retries and bytes per stage and model) is always
+# saved in OUTPUT_PATH. METRICS_EXPORT also writes METRICS_PATH: None, "jsonl" (one line per stage
+# span, with its item and model) or "prometheus" (aggregates in the Prometheus text format).
+METRICS_EXPORT = None
+METRICS_PATH = "results/run_metrics.jsonl"
+
+# Columnar copy of the results (results_store.py, needs pyarrow): every run is also written to
+# RESULTS_STORE_DIR as Parquet, partitioned by run and model, for fast queries across runs. None skips it.
+RESULTS_STORE_DIR = "results/store"
 
 def calculate_metrics(reference: str, hypothesis: str) -> dict:
-    """Calculates WER and CER, handling edge cases."""
-    if not reference.strip() and not hypothesis.strip():
-        return {"wer": 0.0, "cer": 0.0}
-    if not reference.strip() or not hypothesis.strip():
-        return {"wer": 1.0, "cer": 1.0}
-    
+    """Calculates WER and CER, handling edge cases (see metrics_engine.score_pairs)."""
+    scores = score_pairs([reference], [hypothesis])["items"][0]
+    return {"wer": scores["wer"], "cer": scores["cer"]}
+
+def report_corpus_metrics(results_path: str, model_names: list) -> None:
+    """Prints micro-averaged WER/CER per model over every successfully cleaned output in a results file or JSONL checkpoint."""
+    for model_name in model_names:
+        pairs = (
+            (record["ground_truth"], output["cleaned_text"])
+            for record in iter_results(results_path)
+            for output in record.get("model_outputs", [])
+            if output.get("model_name") == model_name and output.get("metrics") is not None
+        )
+        corpus = corpus_error_rates(pairs)
+        print(f"Corpus metrics ({model_name}): WER={corpus['wer']:.4f} ({corpus['word_errors']}/{corpus['ref_words']} words), "
+              f"CER={corpus['cer']:.4f} ({corpus['char_errors']}/{corpus['ref_chars']} chars)")
+
+def open_lane(name: str, config: dict, concurrent: bool) -> dict:
+    """
+    The provider and limits of one model: its own adaptive limiter (see rate_limiter.AdaptiveLimiter)
+    and, in async mode, its own cap on calls in flight, so a slow or strict backend never holds
+    back the others. The configured limits are ceilings; the limiter backs off below them on 429s.
+    """
+    max_concurrent = config["max_concurrent"] if concurrent else 1
+    return {
+        "name": name,
+        "provider": get_provider(config["provider"]),
+        "model": config["model"],
+        "limiter": AdaptiveLimiter(config["requests_per_minute"], max_concurrent),
+        "in_flight": asyncio.Semaphore(max_concurrent) if concurrent else None,
+    }
+
+# --- 2. Per-Item Pipeline Steps ---
+
+def pre_process(ocr_text: str) -> list:
+    substitutions = 0
+    if PRE_CLEAN:
+        ocr_text, substitutions = pre_clean(ocr_text, LANGUAGE)
+    to_llm, score = needs_llm(ocr_text, LANGUAGE, TRIAGE_THRESHOLD) if TRIAGE_THRESHOLD is not None else (True, None)
+    return [ocr_text, {"pre_clean_substitutions": substitutions, "noise_score": score, "passthrough": not to_llm}]
+
+def prepare_ocr_text(ocr_text: str) -> tuple:
+    """
+    Step 0: rule-based pre-cleaning, then triage.
+
+    Returns:
+        tuple: (text for the LLM, {"pre_clean_substitutions", "noise_score", "passthrough"}). A
+               passthrough item is clean enough to be used as is, without cleaning or judging.
+    """
+    # The word and hyphen rules and the triage score use the wordlist, when pyspellchecker is installed.
+    config = {"version": STAGE_VERSIONS["pre_process"], "pre_clean": PRE_CLEAN, "language": LANGUAGE,
+              "triage_threshold": TRIAGE_THRESHOLD, "wordlist": has_wordlist(LANGUAGE)}
+    llm_input, pre_processing = stage_store.run("pre_process", config, [ocr_text], lambda: pre_process(ocr_text))
+    return llm_input, pre_processing
+
+def evaluate_cleaning(rouge_metric, ground_truth: str, cleaned_text: str) -> dict:
+    """Calculates WER, CER and ROUGE for one cleaned text."""
+    with stage("wer_cer"):
+        edit_metrics = calculate_metrics(ground_truth, cleaned_text)
+    with stage("rouge"):
+        rouge_scores = rouge_metric.compute(predictions=[cleaned_text], references=[ground_truth])
+    return {
+        "wer": edit_metrics['wer'],
+        "cer": edit_metrics['cer'],
+        "rouge": rouge_scores
+    }
+
+# ----- Stages: each output is read back from the stage store when its inputs have not changed -----
+
+def clean_stage_config(provider_name: str, model: str) -> dict:
+    return {"provider": provider_name, "model": model, "prompt_version": CLEAN_PROMPT_VERSION, "max_chunk_tokens": MAX_CHUNK_TOKENS}
+
+def clean_stage(lane: dict, item_id: str, llm_input: str, source: str) -> str:
+    """
+    Step 1: one model's cleaned text, recorded as the latest for that model of the item whose
+    dataset texts hash to `source`. Errors are not stored.
+    """
+    config = clean_stage_config(lane["provider"].name, lane["model"])
+    return stage_store.run("clean", config, [llm_input],
+                           lambda: clean_document(lane["provider"], lane["model"], llm_input, lane["limiter"]),
+                           item_id, lane["name"], keep=lambda text: not is_llm_error(text), source=source)
+
+def metrics_stage(rouge_metric, ground_truth: str, cleaned_text: str) -> dict:
+    """Step 2: WER, CER and ROUGE of a cleaned text."""
+    return stage_store.run("metrics", {"version": STAGE_VERSIONS["metrics"]}, [ground_truth, cleaned_text],
+                           lambda: evaluate_cleaning(rouge_metric, ground_truth, cleaned_text))
+
+def diff_stage(ground_truth: str, cleaned_text: str) -> list:
+    """Step 2b: word-level differences of a cleaned text from its ground truth."""
+    return stage_store.run("diff", {"version": STAGE_VERSIONS["diff"]}, [ground_truth, cleaned_text],
+                           lambda: diff_words(ground_truth, cleaned_text))
+
+def judge_stage(judge_lane: dict, cleaned_text: str, ground_truth: str) -> str:
+    """Step 3: the judge's raw response for a cleaned text. Errors are not stored."""
+    config = {"provider": judge_lane["provider"].name, "model": judge_lane["model"], "prompt_version": JUDGE_PROMPT_VERSION}
+    return stage_store.run("judge", config, [cleaned_text, ground_truth],
+                           lambda: judge_with_provider(judge_lane["provider"], judge_lane["model"], cleaned_text,
+                                                       ground_truth, judge_lane["limiter"]),
+                           keep=lambda judgement: not is_llm_error(judgement))
+
+def build_model_output(model_name: str, cleaned_text: str, metrics: dict = None, raw_judgement: str = None,
+                       diffs: list = None) -> dict:
+    """
+    One model's entry in an item's "model_outputs". `metrics` and `diffs` are None when cleaning
+    failed (the error placeholder is kept as the cleaned text, for review); `raw_judgement` is
+    None when the output was not judged (failed or passthrough items).
+    """
+    if metrics is None:
+        print(f"  -> {model_name}: cleaning failed ({cleaned_text})")
+    else:
+        print(f"  -> {model_name}: WER={metrics['wer']:.4f}, CER={metrics['cer']:.4f}")
+    judgement = None
+    if raw_judgement is not None:
+        parsed_judgement_score = parse_score(raw_judgement)
+        print(f"  -> {model_name}: Judgement Score={parsed_judgement_score} (Raw: '{raw_judgement}')")
+        judgement = {
+            "score": parsed_judgement_score,
+            #"raw_score_text": raw_judgement
+        }
+        if is_llm_error(raw_judgement):
+            judgement["error"] = raw_judgement # Kept so a resumed run judges the item again
+    return {
+        "model_name": model_name,
+        "cleaned_text": cleaned_text,
+        "metrics": metrics,
+        "diffs": diffs,
+        "judgement": judgement
+    }
+
+def build_result(item_id: str, ocr_text: str, ground_truth: str, model_outputs: list, pre_processing: dict = None) -> dict:
+    """Aggregates all information for one item, one entry per cleaning model."""
     return {
-        "wer": jiwer.wer(reference, hypothesis),
-        "cer": jiwer.cer(reference, hypothesis)
+        "item_id": item_id,
+        "original_ocr": ocr_text,
+        "ground_truth": ground_truth,
+        "pre_processing": pre_processing,
+        "model_outputs": model_outputs
+    }
+
+def clean_and_judge(lane: dict, judge_lane: dict, rouge_metric, item_id: str, llm_input: str, ground_truth: str,
+                    source: str) -> dict:
+    """Runs clean -> metrics -> judge for one model, blocking on each call."""
+    # Step 1: Clean the text
+    print(f"1. Cleaning text with {lane['name']}...")
+    with stage("clean", model=lane["name"]):
+        cleaned_text = clean_stage(lane, item_id, llm_input, source)
+    if is_llm_error(cleaned_text):
+        return build_model_output(lane["name"], cleaned_text)
+
+    # Step 2: Evaluate with quantitative metrics and word-level diffs
+    print("2. Calculating WER, CER, and ROUGE metrics...")
+    with stage("metrics", model=lane["name"]):
+        metrics = metrics_stage(rouge_metric, ground_truth, cleaned_text)
+    with stage("diff", model=lane["name"]):
+        diffs = diff_stage(ground_truth, cleaned_text)
+
+    # Step 3: Judge the quality with an LLM (the span is labelled with the model being judged)
+    print(f"3. Judging {lane['name']} output with {judge_lane['name']}...")
+    with stage("judge", model=lane["name"]):
+        raw_judgement = judge_stage(judge_lane, cleaned_text, ground_truth)
+    return build_model_output(lane["name"], cleaned_text, metrics, raw_judgement, diffs)
+
+async def clean_and_judge_async(lane: dict, judge_lane: dict, rouge_metric, item_id: str, llm_input: str, ground_truth: str,
+                                source: str, label: str) -> dict:
+    """
+    Async counterpart of `clean_and_judge`. The blocking calls run in worker threads; each
+    lane's semaphore caps how many of them are outstanding and its limiter how many are sent, and how fast.
+    """
+    async with lane["in_flight"]:
+        # Long texts are split into chunks, each going through the limiter inside the thread.
+        print(f"{label} 1. Cleaning text with {lane['name']}...")
+        with stage("clean", model=lane["name"]):
+            cleaned_text = await asyncio.to_thread(clean_stage, lane, item_id, llm_input, source)
+
+    if is_llm_error(cleaned_text):
+        return build_model_output(lane["name"], cleaned_text)
+
+    print(f"{label} 2. Calculating {lane['name']} WER, CER, and ROUGE metrics...")
+    with stage("metrics", model=lane["name"]):
+        metrics = await asyncio.to_thread(metrics_stage, rouge_metric, ground_truth, cleaned_text)
+    with stage("diff", model=lane["name"]):
+        diffs = await asyncio.to_thread(diff_stage, ground_truth, cleaned_text)
+
+    async with judge_lane["in_flight"]:
+        with stage("judge", model=lane["name"]):
+            print(f"{label} 3. Judging {lane['name']} output with {judge_lane['name']}...")
+            raw_judgement = await asyncio.to_thread(judge_stage, judge_lane, cleaned_text, ground_truth)
+    return build_model_output(lane["name"], cleaned_text, metrics, raw_judgement, diffs)
+
+def passthrough_outputs(rouge_metric, model_names: list, ground_truth: str, llm_input: str) -> list:
+    """Outputs of an item triage let through: the pre-cleaned text stands for every model, unjudged."""
+    with stage("metrics"):
+        metrics = metrics_stage(rouge_metric, ground_truth, llm_input)
+    with stage("diff"):
+        diffs = diff_stage(ground_truth, llm_input)
+    return [build_model_output(model_name, llm_input, metrics, diffs=diffs) for model_name in model_names]
+
+def process_item(lanes: list, judge_lane: dict, rouge_metric, item_id: str, item: dict) -> dict:
+    """Runs every model of `lanes` on one item, one call at a time."""
+    ocr_text = item.get('ocr', '')
+    ground_truth = item.get('clean', '')
+
+    # Step 0: Fix the trivial OCR artifacts with rules and triage the rest
+    with stage("pre_process"):
+        llm_input, pre_processing = prepare_ocr_text(ocr_text)
+    print(f"0. Pre-cleaning: {pre_processing['pre_clean_substitutions']} substitutions, noise score {pre_processing['noise_score']}")
+    if pre_processing["passthrough"]:
+        print("  -> Clean enough already: skipping the LLM for this item.")
+        outputs = passthrough_outputs(rouge_metric, [lane["name"] for lane in lanes], ground_truth, llm_input)
+        return build_result(item_id, ocr_text, ground_truth, outputs, pre_processing)
+
+    source = stage_store.source_key(ocr_text, ground_truth)
+    outputs = [clean_and_judge(lane, judge_lane, rouge_metric, item_id, llm_input, ground_truth, source) for lane in lanes]
+    return build_result(item_id, ocr_text, ground_truth, outputs, pre_processing)
+
+async def process_item_async(lanes: list, judge_lane: dict, rouge_metric, item_id: str, item: dict, label: str) -> dict:
+    """Async counterpart of `process_item`: the models of one item run concurrently."""
+    ocr_text = item.get('ocr', '')
+    ground_truth = item.get('clean', '')
+    with stage("pre_process"):
+        llm_input, pre_processing = prepare_ocr_text(ocr_text)
+    if pre_processing["passthrough"]:
+        print(f"{label} Clean enough already: skipping the LLM for this item.")
+        outputs = await asyncio.to_thread(
+            passthrough_outputs, rouge_metric, [lane["name"] for lane in lanes], ground_truth, llm_input)
+        return build_result(item_id, ocr_text, ground_truth, outputs, pre_processing)
+
+    source = stage_store.source_key(ocr_text, ground_truth)
+    outputs = await asyncio.gather(*(
+        clean_and_judge_async(lane, judge_lane, rouge_metric, item_id, llm_input, ground_truth, source, label) for lane in lanes
+    ))
+    print(f"{label} Done.")
+    return build_result(item_id, ocr_text, ground_truth, list(outputs), pre_processing)
+
+# --- 3. Execution Engines ---
+
+def report_lanes(lanes: list) -> None:
+    """Prints where each model's adaptive limits settled, and the retries spent."""
+    for lane in lanes:
+        print(f"Adaptive limits, {lane['name']}: {lane['limiter'].snapshot()}")
+    print(f"Retries: {retry_budget.retries} for {retry_budget.requests} requests")
+
+def save_result(writer: JsonlResultWriter, result: dict) -> None:
+    """Checkpoints one result, counting the bytes written."""
+    with stage("save"):
+        record_bytes(writer.write(result))
+
+def run_pipeline(rouge_metric, items_by_id: dict, writer: JsonlResultWriter) -> None:
+    """Processes items one at a time, checkpointing each result as it finishes."""
+    lanes = [open_lane(name, MODEL_CONFIGS[name], concurrent=False) for name in MODELS_TO_RUN]
+    judge_lane = open_lane("judge", JUDGE_CONFIG, concurrent=False)
+    for i, (item_id, item) in enumerate(items_by_id.items()):
+        print(f"\n--- Processing item {i+1}/{len(items_by_id)} (id {item_id}) ---")
+        with stage("item", item_id):
+            save_result(writer, process_item(lanes, judge_lane, rouge_metric, item_id, item))
+    report_lanes(lanes + [judge_lane])
+
+async def run_pipeline_async(rouge_metric, items_by_id: dict, writer: JsonlResultWriter) -> None:
+    """
+    Processes items concurrently, checkpointing each result as soon as its item finishes.
+    Completion order varies; `finalize_results` restores the item order afterwards.
+    """
+    lanes = [open_lane(name, MODEL_CONFIGS[name], concurrent=True) for name in MODELS_TO_RUN]
+    judge_lane = open_lane("judge", JUDGE_CONFIG, concurrent=True)
+
+    async def process_and_write(i: int, item_id: str, item: dict) -> None:
+        label = f"[item {i+1}/{len(items_by_id)}]"
+        with stage("item", item_id):
+            result = await process_item_async(lanes, judge_lane, rouge_metric, item_id, item, label)
+            save_result(writer, result)
+
+    await asyncio.gather(*(
+        process_and_write(i, item_id, item) for i, (item_id, item) in enumerate(items_by_id.items())
+    ))
+    report_lanes(lanes + [judge_lane])
+
+def clean_request_keys(item_id: str, ocr_text: str) -> list:
+    """
+    (key, chunk) pairs of the cleaning requests for one item: the item ID itself for text that
+    fits in one chunk, "<item_id>#<k>" for each chunk of a longer text.
+    """
+    chunks = chunk_text(ocr_text)
+    if len(chunks) == 1:
+        return [(item_id, ocr_text)]
+    return [(f"{item_id}#{k}", chunk) for k, chunk in enumerate(chunks)]
+
+def batch_cleaned_text(clean_results: dict, item_id: str, ocr_text: str) -> str:
+    """
+    Looks up (and stitches) batch cleaning results, mirroring clean_with_provider's "" for empty OCR.
+    `ocr_text` is the text the requests were built from, i.e. after pre-cleaning.
+    """
+    if not ocr_text.strip():
+        return ""
+    cleaned_chunks = []
+    for key, _ in clean_request_keys(item_id, ocr_text):
+        cleaned = clean_results.get(key, "[BATCH_ERROR: no result for this request]")
+        if "[BATCH_ERROR" in cleaned:
+            return cleaned
+        cleaned_chunks.append(cleaned)
+    return cleaned_chunks[0] if len(cleaned_chunks) == 1 else stitch_chunks(cleaned_chunks)
+
+def iter_llm_inputs(items_by_id: dict):
+    """Yields (item_id, item, pre-cleaned text) for the items that triage sends to the LLM."""
+    for item_id, item in items_by_id.items():
+        llm_input, pre_processing = prepare_ocr_text(item.get('ocr', ''))
+        if not pre_processing["passthrough"]:
+            yield item_id, item, llm_input
+
+def prepare_clean_batch(items_by_id: dict) -> None:
+    """Batch phase one: writes a cleaning request per item, or per chunk of a long item."""
+    requests = (
+        (key, build_clean_prompt(chunk))
+        for item_id, _, llm_input in iter_llm_inputs(items_by_id) if llm_input.strip()
+        for key, chunk in clean_request_keys(item_id, llm_input)
+    )
+    write_batch_requests(requests, CLEAN_REQUESTS_PATH)
+
+def prepare_judge_batch(items_by_id: dict) -> None:
+    """Batch phase two: writes a judging request per successfully cleaned item."""
+    clean_results = read_batch_results(CLEAN_RESULTS_PATH)
+    requests = []
+    for item_id, item, llm_input in iter_llm_inputs(items_by_id):
+        cleaned_text = batch_cleaned_text(clean_results, item_id, llm_input)
+        if cleaned_text.strip() and not is_llm_error(cleaned_text):
+            requests.append((item_id, build_judge_prompt(cleaned_text, item.get('clean', ''))))
+    write_batch_requests(requests, JUDGE_REQUESTS_PATH,
+                         system_instruction=JUDGE_SYSTEM_INSTRUCTION, response_schema=JUDGE_RESPONSE_SCHEMA)
+
+def ingest_item(rouge_metric, clean_results: dict, judge_results: dict, item_id: str, item: dict) -> dict:
+    """Joins the batch cleaning and judging results of one item into its result entry."""
+    ocr_text = item.get('ocr', '')
+    ground_truth = item.get('clean', '')
+    with stage("pre_process"):
+        llm_input, pre_processing = prepare_ocr_text(ocr_text)
+    if pre_processing["passthrough"]:
+        outputs = passthrough_outputs(rouge_metric, [BATCH_MODEL], ground_truth, llm_input)
+        return build_result(item_id, ocr_text, ground_truth, outputs, pre_processing)
+
+    cleaned_text = batch_cleaned_text(clean_results, item_id, llm_input)
+    if not is_llm_error(cleaned_text) and stage_store.enabled:
+        # Stored under the key a live run would use, so later runs, extracter.py and judge_LLM.py
+        # reuse it; never read back, as the batch result given here replaces any earlier output.
+        config = clean_stage_config(MODEL_CONFIGS[BATCH_MODEL]["provider"], MODEL_CONFIGS[BATCH_MODEL]["model"])
+        key = stage_store.make_key("clean", config, llm_input)
+        stage_store.put("clean", key, cleaned_text)
+        stage_store.record("clean", item_id, BATCH_MODEL, key, stage_store.source_key(ocr_text, ground_truth))
+    if is_llm_error(cleaned_text):
+        output = build_model_output(BATCH_MODEL, cleaned_text)
+    else:
+        with stage("metrics", model=BATCH_MODEL):
+            metrics = metrics_stage(rouge_metric, ground_truth, cleaned_text)
+        with stage("diff", model=BATCH_MODEL):
+            diffs = diff_stage(ground_truth, cleaned_text)
+        # judge_with_provider scores empty cleaned texts as "0" without a request
+        raw_judgement = judge_results.get(item_id, "[BATCH_ERROR: no result for this request]") if cleaned_text.strip() else "0"
+        output = build_model_output(BATCH_MODEL, cleaned_text, metrics, raw_judgement, diffs)
+    return build_result(item_id, ocr_text, ground_truth, [output], pre_processing)
+
+def ingest_batch_results(rouge_metric, items_by_id: dict, writer: JsonlResultWriter) -> None:
+    """Final batch phase: joins cleaning and judging results back to their items."""
+    clean_results = read_batch_results(CLEAN_RESULTS_PATH)
+    judge_results = read_batch_results(JUDGE_RESULTS_PATH)
+    for i, (item_id, item) in enumerate(items_by_id.items()):
+        print(f"\n--- Ingesting item {i+1}/{len(items_by_id)} (id {item_id}) ---")
+        with stage("item", item_id):
+            save_result(writer, ingest_item(rouge_metric, clean_results, judge_results, item_id, item))
+
+def store_run(results_path: str, started: float) -> None:
+    """Copies the results of a run to the results store, as the run named after its start time."""
+    if RESULTS_STORE_DIR is None:
+        return
+    from results_store import write_run # Imported here: it loads pyarrow, which nothing else needs
+    run_id = time.strftime("%Y%m%dT%H%M%S", time.localtime(started))
+    try:
+        rows = write_run(iter_results(results_path), run_id, LANGUAGE, RESULTS_STORE_DIR)
+        print(f"Results store: {rows} rows saved to '{RESULTS_STORE_DIR}' as run {run_id}")
+    except ImportError as e:
+        print(f"Results store skipped: {e}")
+    except (OSError, ValueError) as e:
+        print(f"Error saving to the results store: {e}")
+
+def run_shards(rouge_metric, items_by_id: dict, queue: ShardQueue) -> None:
+    """Claims and processes shards of the queue until none is left, checkpointing each shard separately."""
+    worker = worker_name()
+    for shard in queue.shards(worker):
+        # A shard taken over from a crashed worker skips the items that worker checkpointed.
+        completed_ids = queue.completed_ids(shard["index"])
+        pending_by_id = {item_id: items_by_id[item_id] for item_id in shard["item_ids"] if item_id not in completed_ids}
+        print(f"\n=== Shard {shard['index']} (attempt {shard['attempts']}): {len(pending_by_id)} of "
+              f"{len(shard['item_ids'])} items to process ===")
+        with queue.hold(shard, worker), JsonlResultWriter(queue.checkpoint_path(shard["index"], worker)) as writer:
+            if ASYNC_MODE:
+                asyncio.run(run_pipeline_async(rouge_metric, pending_by_id, writer))
+            else:
+                run_pipeline(rouge_metric, pending_by_id, writer)
+        queue.complete(shard["index"], worker)
+
+def current_config() -> dict:
+    """This module's configuration constants as they are now, including any changes made by cli.py."""
+    return {name: value for name, value in globals().items() if name.isupper()}
+
+def run_spawned_worker(config: dict) -> None:
+    """Entry point of the extra workers of sharded mode: a fresh process, configured like its parent."""
+    globals().update(config)
+    main(spawn_workers=False)
+
+def run_sharded(rouge_metric, items_by_id: dict, ids_to_process: list, spawn_workers: bool) -> None:
+    """
+    Sharded mode: joins (or creates) the queue in SHARD_QUEUE_DIR, works through its shards, and
+    merges every shard into OUTPUT_PATH if this worker is the last to finish.
+    """
+    queue = ShardQueue(SHARD_QUEUE_DIR)
+    try:
+        created = queue.create(ids_to_process, SHARD_SIZE, header=queue_header(items_by_id))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    print(f"{'Created' if created else 'Joined'} the shard queue in '{SHARD_QUEUE_DIR}' as worker {worker_name()}: {queue.status()}")
+
+    workers = []
+    if spawn_workers and SHARD_WORKERS > 1:
+        # Separate processes, each with its own providers and limiters, started like this one.
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=run_spawned_worker, args=(current_config(),)) for _ in range(SHARD_WORKERS - 1)]
+        for process in workers:
+            process.start()
+
+    stage_store.enabled = USE_STAGE_STORE
+    run_metrics.reset()
+    retry_budget.reset()
+    try:
+        run_shards(rouge_metric, items_by_id, queue)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    finally:
+        for process in workers:
+            process.join()
+
+    print(f"\n--- Worker {worker_name()} Complete ---")
+    run_metrics.close()
+    # The summary covers this worker only, so it is printed but not saved with the merged results.
+    print_summary({"config": {"models": MODELS_TO_RUN, "judge": JUDGE_CONFIG["model"], "shard_queue": SHARD_QUEUE_DIR},
+                   **run_metrics.summary()})
+    if not queue.take_merge():
+        print("Another worker merges the shards.")
+        return
+    try:
+        count = queue.merge(OUTPUT_PATH, compact=COMPACT_RESULTS)
+        print(f"\nAll shards merged ({count} items) into: {OUTPUT_PATH}")
+    except IOError as e:
+        print(f"\nError merging the shards: {e}")
+        return
+    store_run(OUTPUT_PATH, queue.created())
+    report_corpus_metrics(OUTPUT_PATH, MODELS_TO_RUN)
+    response_cache.report()
+    stage_store.report()
+
+# --- 4. Main Orchestration Logic ---
+
+def run_header() -> dict:
+    """
+    What the items of a checkpoint depend on: the input file and a hash of the models, judge,
+    prompt and stage versions and pre-processing settings. A checkpoint is only resumed by a run
+    with the same header, so its items never mix with those of another dataset or configuration.
+    """
+    models = MODELS_TO_RUN if BATCH_PHASE is None else [BATCH_MODEL]
+    config = {
+        "models": {name: [MODEL_CONFIGS[name]["provider"], MODEL_CONFIGS[name]["model"]] for name in models},
+        "judge": [JUDGE_CONFIG["provider"], JUDGE_CONFIG["model"]],
+        "clean_prompt_version": CLEAN_PROMPT_VERSION, "judge_prompt_version": JUDGE_PROMPT_VERSION,
+        "max_chunk_tokens": MAX_CHUNK_TOKENS, "stage_versions": STAGE_VERSIONS,
+        "language": LANGUAGE, "pre_clean": PRE_CLEAN, "triage_threshold": TRIAGE_THRESHOLD,
+        "wordlist": has_wordlist(LANGUAGE),
     }
+    config_hash = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return {"input_path": INPUT_PATH, "models": models, "config_hash": config_hash}
 
-# --- 3. Main Orchestration Logic ---
+def queue_header(items_by_id: dict) -> dict:
+    """
+    The run header of a shard queue: that of `run_header` with a hash of the items' texts in
+    place of the input path, which may differ between the machines sharing the queue.
+    """
+    header = run_header()
+    dataset_hash = hashlib.sha256("".join(stage_store.source_key(item.get("ocr", ""), item.get("clean", ""))
+                                          for item in items_by_id.values()).encode("utf-8")).hexdigest()[:16]
+    return {"models": header["models"], "config_hash": header["config_hash"], "dataset_hash": dataset_hash}
 
-def main():
+def main(spawn_workers: bool = True):
     """
     Main function to run the complete clean, evaluate, and judge pipeline.
+    `spawn_workers` is False in the extra workers started by sharded mode.
     """
+    # --- Load Data (streamed: only the items to process are read into memory) ---
+    try:
+        items_by_id = load_dataset(INPUT_PATH, NUM_ITEM_TO_PROCESS)
+        print(f"Successfully loaded {len(items_by_id)} items from '{INPUT_PATH}'")
+    except (FileNotFoundError, ValueError) as e: # json.JSONDecodeError is a ValueError
+        print(f"Error loading input file: {e}")
+        return
+
+    ids_to_process = list(items_by_id.keys())
+
+    # --- Batch Mode: writing requests needs neither the API nor the metrics ---
+    try:
+        if BATCH_PHASE == "prepare-clean":
+            prepare_clean_batch(items_by_id)
+            return
+        if BATCH_PHASE == "prepare-judge":
+            prepare_judge_batch(items_by_id)
+            return
+    except (FileNotFoundError, IOError) as e:
+        print(f"Error in batch phase '{BATCH_PHASE}': {e}")
+        return
+
     # --- Initialize APIs (ONCE) ---
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables.")
-        client = genai.Client(api_key=api_key)
-        rouge_metric = evaluate.load("rouge")
-        print("Successfully initialized Gemini Client and ROUGE metric evaluator.")
+        if BATCH_PHASE is None:
+            # Shared, pooled providers, reused by every call and worker thread; created here so a
+            # missing API key or unknown model stops the run before the first item.
+            for config in [MODEL_CONFIGS[name] for name in MODELS_TO_RUN] + [JUDGE_CONFIG]:
+                get_provider(config["provider"])
+            print(f"Successfully initialized providers for: {', '.join(MODELS_TO_RUN)} (judge: {JUDGE_CONFIG['model']}).")
+        rouge_metric = NativeRouge() # Same scores as evaluate.load("rouge"), computed offline
+        print("Successfully initialized ROUGE metric evaluator.")
     except Exception as e:
         print(f"Fatal Error during initialization: {e}")
         return
 
-    # --- Load Data ---
-    try:
-        with open(INPUT_PATH, 'r', encoding='utf-8') as f:
-            data_dict = json.load(f)
-        print(f"Successfully loaded {len(data_dict)} items from '{INPUT_PATH}'")
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error loading input file: {e}")
+    # --- Sharded Mode: this process is one of the workers of a shared queue ---
+    if SHARD_QUEUE_DIR is not None:
+        if BATCH_PHASE is not None:
+            print("Error: sharded mode runs the pipeline live; set BATCH_PHASE = None.")
+            return
+        run_sharded(rouge_metric, items_by_id, ids_to_process, spawn_workers)
         return
 
-    list_of_items = list(data_dict.values())
-    subset_to_process = list_of_items[:NUM_ITEM_TO_PROCESS] if NUM_ITEM_TO_PROCESS is not None else list_of_items
-    
-    all_results = []
-    print(f"\nStarting pipeline for {len(subset_to_process)} items...")
+    # --- Resume: skip items already checkpointed by an earlier run ---
+    # Items whose outputs hold LLM errors are processed again; their new records supersede the old ones.
+    header = run_header()
+    checkpointed_ids = load_completed_ids(CHECKPOINT_PATH, retry_failed=False) if RESUME else set()
+    if checkpointed_ids:
+        checkpoint_header = read_run_header(CHECKPOINT_PATH)
+        if checkpoint_header != header:
+            if checkpoint_header is None:
+                reason = "it has no run header, so its input and configuration are unknown"
+            elif checkpoint_header.get("input_path") != INPUT_PATH:
+                reason = f"it was written for '{checkpoint_header.get('input_path')}'"
+            else:
+                reason = "it was written with other models, prompts or settings"
+            print(f"Error: cannot resume '{CHECKPOINT_PATH}': {reason}. Set RESUME = False (--no-resume) "
+                  f"or choose another CHECKPOINT_PATH (--checkpoint).")
+            return
+    completed_ids = load_completed_ids(CHECKPOINT_PATH) if checkpointed_ids else set()
+    pending_by_id = {item_id: item for item_id, item in items_by_id.items() if item_id not in completed_ids}
+    if checkpointed_ids:
+        failed = sum(1 for item_id in pending_by_id if item_id in checkpointed_ids)
+        print(f"Resuming: {len(items_by_id) - len(pending_by_id)} items already in '{CHECKPOINT_PATH}'"
+              + (f", {failed} failed items retried." if failed else "."))
 
-    # --- Process Each Item in the Pipeline ---
-    for i, item in enumerate(subset_to_process):
-        print(f"\n--- Processing item {i+1}/{len(subset_to_process)} ---")
-        
-        ocr_text = item.get('ocr', '')
-        ground_truth = item.get('clean', '')
-
-        # Step 1: Clean the text
-        print("1. Cleaning text with Gemini...")
-        cleaned_text = clean_with_gemini(client, ocr_text)
-        
-        if "[GEMINI_" in cleaned_text:
-            print("  -> Skipping further processing for this item due to cleaning error.")
-            # Still save the failed attempt for review
-            result_item = {
-                "original_ocr": ocr_text,
-                "ground_truth": ground_truth,
-                "gemini_cleaned": cleaned_text,
-                "metrics": None,
-                "judgement": None
-            }
-            all_results.append(result_item)
-            time.sleep(1) # Still sleep to avoid hammering a failing API
-            continue
-
-        # Step 2: Evaluate with quantitative metrics
-        print("2. Calculating WER, CER, and ROUGE metrics...")
-        edit_metrics = calculate_metrics(ground_truth, cleaned_text)
-        rouge_scores = rouge_metric.compute(predictions=[cleaned_text], references=[ground_truth])
-        
-        # Step 3: Judge the quality with an LLM
-        print("3. Judging quality with Gemini...")
-        raw_judgement = judge_with_gemini(client, cleaned_text, ground_truth)
-        parsed_judgement_score = parse_score(raw_judgement)
+    print(f"\nStarting pipeline for {len(pending_by_id)} items...")
+    stage_store.enabled = USE_STAGE_STORE
+    run_metrics.reset()
+    retry_budget.reset()
+    if METRICS_EXPORT == "jsonl":
+        run_metrics.export_spans(METRICS_PATH)
 
-        # Step 4: Aggregate all information for this item
-        result_item = {
-            "original_ocr": ocr_text,
-            "ground_truth": ground_truth,
-            "gemini_cleaned": cleaned_text,
-            "metrics": {
-                "wer": edit_metrics['wer'],
-                "cer": edit_metrics['cer'],
-                "rouge": rouge_scores
-            },
-            "judgement": {
-                "score": parsed_judgement_score,
-                #"raw_score_text": raw_judgement
-            }
-        }
-        all_results.append(result_item)
-        
-        print(f"  -> Metrics: WER={edit_metrics['wer']:.4f}, CER={edit_metrics['cer']:.4f}")
-        print(f"  -> Judgement: Score={parsed_judgement_score} (Raw: '{raw_judgement}')")
-        
-        # Avoid hitting API rate limits
-        time.sleep(1) 
+    # --- Process Each Item in the Pipeline ---
+    # A checkpoint with no items is started afresh, under this run's header.
+    with JsonlResultWriter(CHECKPOINT_PATH, resume=bool(checkpointed_ids), header=header) as writer:
+        if BATCH_PHASE == "ingest":
+            try:
+                ingest_batch_results(rouge_metric, pending_by_id, writer)
+            except FileNotFoundError as e:
+                print(f"Error: Batch results file not found: {e}")
+                return
+        elif ASYNC_MODE:
+            for name in MODELS_TO_RUN:
+                config = MODEL_CONFIGS[name]
+                print(f"Async mode, {name}: up to {config['max_concurrent']} requests in flight, "
+                      f"{config['requests_per_minute']} requests/minute.")
+            asyncio.run(run_pipeline_async(rouge_metric, pending_by_id, writer))
+        else:
+            run_pipeline(rouge_metric, pending_by_id, writer)
 
     # --- Save Final Combined Results ---
     print("\n--- Pipeline Complete ---")
-    output_dir = os.path.dirname(OUTPUT_PATH)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        
+    run_metrics.close()
+    # The summary covers this run only; items resumed from an earlier run are not in it.
+    run_summary = {
+        "config": {"models": MODELS_TO_RUN if BATCH_PHASE is None else [BATCH_MODEL],
+                   "judge": JUDGE_CONFIG["model"], "batch_phase": BATCH_PHASE},
+        **run_metrics.summary(),
+    }
+    print_summary(run_summary)
     try:
-        with open(OUTPUT_PATH, "w", encoding="utf-8") as outfile:
-            json.dump(all_results, outfile, indent=2, ensure_ascii=False)
-        print(f"\nAll processed data and results saved to: {OUTPUT_PATH}")
+        if METRICS_EXPORT == "prometheus":
+            run_metrics.write_prometheus(METRICS_PATH)
+        if METRICS_EXPORT is not None:
+            print(f"Run metrics ({METRICS_EXPORT}) saved to: {METRICS_PATH}")
+    except IOError as e:
+        print(f"Error saving run metrics: {e}")
+    try:
+        count = finalize_results(CHECKPOINT_PATH, OUTPUT_PATH, order=ids_to_process, run_summary=run_summary,
+                                 compact=COMPACT_RESULTS)
+        print(f"\nAll processed data and results ({count} items) saved to: {OUTPUT_PATH}")
     except IOError as e:
         print(f"\nError saving final results file: {e}")
 
+    store_run(CHECKPOINT_PATH, run_metrics.started)
+    report_corpus_metrics(CHECKPOINT_PATH, [BATCH_MODEL] if BATCH_PHASE == "ingest" else MODELS_TO_RUN)
+
+    response_cache.report()
+    stage_store.report()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,240 @@
+import json
+import re
+import numpy as np
+
+from result_writer import load_results
+
+try:
+    # rapidfuzz ships with jiwer. Its cpdist runs a bit-parallel Levenshtein over whole lists
+    # of pairs in C++ threads; without it the pure NumPy dynamic program below is used.
+    from rapidfuzz.distance import Levenshtein
+    from rapidfuzz.process import cpdist
+except ImportError:
+    cpdist = None
+
+# --- Configuration ---
+BATCH_SIZE = 32 # Pairs whose DP rows are advanced together in one NumPy operation
+MIN_BAND = 16 # Initial half-width of the diagonal band searched for each pair's alignment
+WORKERS = -1 # Threads used by rapidfuzz's cpdist (-1 = all cores)
+INPUT_PATH = "results/full_pipeline_results_24.json" # Used when run as a script
+
+_MULTIPLE_SPACES = re.compile(r"\s\s+")
+
+
+# ----------------------------------------------- Tokenization -----------------------------------------------
+# Same normalisation as jiwer's defaults, so the figures match jiwer.wer / jiwer.cer.
+
+def words(text: str) -> list:
+    """jiwer `wer_default`: collapse runs of whitespace, strip, split on spaces."""
+    return [w for w in _MULTIPLE_SPACES.sub(" ", text).strip().split(" ") if w]
+
+def chars(text: str) -> list:
+    """jiwer `cer_default`: strip, then every character (spaces included) is a token."""
+    return list(text.strip())
+
+def _encode(token_lists: list) -> list:
+    """Maps tokens to integer IDs with one vocabulary shared by the whole batch."""
+    vocabulary = {}
+    return [np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for t in tokens), dtype=np.int32, count=len(tokens))
+            for tokens in token_lists]
+
+
+# ----------------------------------------------- Edit Distance -----------------------------------------------
+
+def _banded_distances(references: list, hypotheses: list, band: int) -> np.ndarray:
+    """
+    Edit distances restricted to the diagonal band |i - j| <= band, for one batch of pairs.
+
+    Row i of the DP table is stored by diagonal offset (j - i + band), so every pair advances
+    through its rows together and each step costs O(batch * band) instead of O(batch * len).
+    A returned distance <= band is exact; a larger one only means the band was too narrow.
+    """
+    batch = len(references)
+    len_r = np.array([len(r) for r in references], dtype=np.int64)
+    len_h = np.array([len(h) for h in hypotheses], dtype=np.int64)
+    max_r = int(len_r.max())
+    max_h = int(len_h.max())
+    width = 2 * band + 1
+    slots = np.arange(width, dtype=np.int64)
+    offsets = slots - band # j - i for each slot
+    infinity = np.int64(1 << 40)
+
+    # Distinct negative sentinels: padding never matches anything. H is padded by band + 1 on
+    # the left so that row i reads the tokens H[j - 1] for all its slots as H_padded[i : i + width].
+    R = np.full((batch, max(max_r, 1)), -1, dtype=np.int32)
+    H = np.full((batch, max(max_h, max_r) + width + 1), -2, dtype=np.int32)
+    for k in range(batch):
+        R[k, :len_r[k]] = references[k]
+        H[k, band + 1:band + 1 + len_h[k]] = hypotheses[k]
+
+    prev = np.tile(np.where(offsets >= 0, offsets, infinity), (batch, 1))
+    rows = np.arange(batch)
+    result = np.where(len_r == 0, len_h, infinity)
+
+    for i in range(1, max_r + 1):
+        cost = R[:, i - 1, None] != H[:, i:i + width]
+        current = prev + cost # substitution / match: D[i-1, j-1] sits in the same slot
+        np.minimum(current[:, :-1], prev[:, 1:] + 1, out=current[:, :-1]) # deletion: D[i-1, j]
+        if i <= band:
+            current[:, :band - i] = infinity # j < 0
+            current[:, band - i] = i # j == 0
+        # Insertions: D[i, j] = min_k<=j (D[i, k] + j - k)
+        current = np.minimum.accumulate(current - slots, axis=1) + slots
+
+        finished = len_r == i
+        if finished.any():
+            slot = len_h[finished] - i + band
+            inside = (slot >= 0) & (slot < width)
+            values = np.full(slot.shape, infinity)
+            values[inside] = current[rows[finished][inside], slot[inside]]
+            result[finished] = values
+        prev = current
+    return result
+
+def batch_edit_distances(references: list, hypotheses: list) -> np.ndarray:
+    """
+    Levenshtein distances between many pairs of integer sequences.
+
+    Uses rapidfuzz's batched `cpdist` when it is installed. Otherwise pairs are processed
+    BATCH_SIZE at a time with a banded dynamic program (see `_banded_distances`). The band is
+    doubled only for the pairs whose distance did not fit in it, so well-cleaned texts cost
+    time proportional to length * errors, not length squared.
+    """
+    n_pairs = len(references)
+    if n_pairs == 0:
+        return np.zeros(0, dtype=np.int64)
+    if cpdist is not None:
+        return cpdist([r.tolist() for r in references], [h.tolist() for h in hypotheses],
+                      scorer=Levenshtein.distance, workers=WORKERS).astype(np.int64)
+
+    distances = np.zeros(n_pairs, dtype=np.int64)
+    lengths = np.array([max(len(r), len(h)) for r, h in zip(references, hypotheses)], dtype=np.int64)
+    # Starting band per pair: MIN_BAND doubled until it covers the length difference. Pairs are
+    # batched with others of the same starting band and similar length, so a single badly
+    # mismatched pair does not widen the band (or the row loop) for the whole batch.
+    differences = np.array([abs(len(r) - len(h)) for r, h in zip(references, hypotheses)], dtype=np.int64)
+    bands = MIN_BAND * 2 ** np.ceil(np.log2(np.maximum(differences, MIN_BAND) / MIN_BAND)).astype(np.int64)
+
+    order = np.lexsort((lengths, bands))
+    for start in range(0, n_pairs, BATCH_SIZE):
+        pending = order[start:start + BATCH_SIZE]
+        band = int(bands[pending].max())
+        while len(pending):
+            found = _banded_distances([references[k] for k in pending], [hypotheses[k] for k in pending], band)
+            exact = (found <= band) | (lengths[pending] <= band)
+            distances[pending[exact]] = found[exact]
+            pending = pending[~exact]
+            band *= 2
+    return distances
+
+
+# ----------------------------------------------- Metrics -----------------------------------------------
+
+def score_pairs(references: list, hypotheses: list) -> dict:
+    """
+    Computes WER and CER for many (reference, hypothesis) pairs at once.
+
+    Every text is tokenized once per granularity and all pairs go through a single batched
+    edit-distance pass for words and one for characters. Edge cases follow
+    `main.calculate_metrics`: two empty texts score 0.0, one empty text scores 1.0.
+
+    Returns:
+        dict: {"items": [per-pair dicts with wer, cer and raw error/length counts],
+               "corpus": micro-averaged wer and cer over all pairs with their totals}
+    """
+    if len(references) != len(hypotheses):
+        raise ValueError("references and hypotheses must have the same length.")
+
+    ref_words = [words(r) for r in references]
+    hyp_words = [words(h) for h in hypotheses]
+    ref_chars = [chars(r) for r in references]
+    hyp_chars = [chars(h) for h in hypotheses]
+
+    word_ids = _encode(ref_words + hyp_words)
+    char_ids = _encode(ref_chars + hyp_chars)
+    n = len(references)
+    word_errors = batch_edit_distances(word_ids[:n], word_ids[n:])
+    char_errors = batch_edit_distances(char_ids[:n], char_ids[n:])
+
+    items = []
+    for k in range(n):
+        ref_empty = not references[k].strip()
+        hyp_empty = not hypotheses[k].strip()
+        n_words, n_chars = len(ref_words[k]), len(ref_chars[k])
+        if ref_empty and hyp_empty:
+            wer, cer = 0.0, 0.0
+        elif ref_empty or hyp_empty:
+            wer, cer = 1.0, 1.0
+        else:
+            wer = float(word_errors[k]) / n_words
+            cer = float(char_errors[k]) / n_chars
+        items.append({
+            "wer": wer,
+            "cer": cer,
+            "word_errors": int(word_errors[k]),
+            "ref_words": n_words,
+            "char_errors": int(char_errors[k]),
+            "ref_chars": n_chars,
+        })
+    return {"items": items, "corpus": aggregate_counts(items)}
+
+def aggregate_counts(items: list) -> dict:
+    """Micro-averages per-item error counts into corpus-level WER and CER."""
+    totals = {
+        "word_errors": sum(item["word_errors"] for item in items),
+        "ref_words": sum(item["ref_words"] for item in items),
+        "char_errors": sum(item["char_errors"] for item in items),
+        "ref_chars": sum(item["ref_chars"] for item in items),
+    }
+    totals["wer"] = totals["word_errors"] / totals["ref_words"] if totals["ref_words"] else 0.0
+    totals["cer"] = totals["char_errors"] / totals["ref_chars"] if totals["ref_chars"] else 0.0
+    return totals
+
+def corpus_error_rates(pairs, chunk_size: int = 4096) -> dict:
+    """Corpus WER/CER over an iterable of (reference, hypothesis) pairs, scored chunk by chunk."""
+    totals = []
+    references, hypotheses = [], []
+    for reference, hypothesis in pairs:
+        references.append(reference)
+        hypotheses.append(hypothesis)
+        if len(references) >= chunk_size:
+            totals.append(score_pairs(references, hypotheses)["corpus"])
+            references, hypotheses = [], []
+    if references:
+        totals.append(score_pairs(references, hypotheses)["corpus"])
+    return aggregate_counts(totals)
+
+
+# ----------------------------------------------- Results Files -----------------------------------------------
+
+def collect_model_pairs(results: list) -> dict:
+    """Groups (ground_truth, cleaned_text) pairs by model from a pipeline results list."""
+    pairs = {}
+    for item in results:
+        ground_truth = item.get("ground_truth", "")
+        if "model_outputs" in item:
+            for output in item["model_outputs"]:
+                pairs.setdefault(output.get("model_name"), []).append((ground_truth, output.get("cleaned_text", "")))
+        elif "gemini_cleaned" in item:
+            pairs.setdefault("gemini", []).append((ground_truth, item["gemini_cleaned"]))
+    return pairs
+
+def main():
+    """Scores every model in a pipeline results file and prints per-model corpus WER/CER."""
+    try:
+        results = load_results(INPUT_PATH)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error loading results file: {e}")
+        return
+
+    for model_name, pairs in collect_model_pairs(results).items():
+        references, hypotheses = zip(*pairs)
+        scores = score_pairs(list(references), list(hypotheses))
+        corpus = scores["corpus"]
+        mean_wer = np.mean([item["wer"] for item in scores["items"]])
+        print(f"{model_name}: corpus WER={corpus['wer']:.4f}, corpus CER={corpus['cer']:.4f} "
+              f"(mean per-item WER={mean_wer:.4f}, {len(pairs)} items)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chunker import estimate_tokens
+from metrics_engine import score_pairs
+from pre_clean import pre_clean
+
+# A local, deterministic stand-in for an OpenAI-compatible LLM server, so the whole pipeline can
+# run offline and repeatably: point the "mock-server" provider at it (MOCK_LLM_BASE_URL), or use
+# the in-process "mock" provider, which gives the same answers without HTTP.
+#
+# Cleaning prompts are answered with the OCR text after rule-based pre-cleaning and whitespace
+# normalisation; judging prompts with a 0-5 score derived from the WER of the cleaned text (as
+# {"score": n} when a structured answer is requested). Like vLLM's prefix caching, a system
+# message seen before is reported as cached prompt tokens.
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 8765
+MOCK_LATENCY_SECONDS = 0.0 # Added to every response, to rehearse concurrency and rate limits
+MOCK_LANGUAGE = "eng" # Pre-cleaning rules used for cleaning answers
+
+_CLEAN_PROMPT_RE = re.compile(r"OCR Text:\n---\n(.*)\n---\nCleaned Text:", re.DOTALL)
+_JUDGE_PROMPT_RE = re.compile(r"\[GROUND TRUTH\]:\n(.*?)\n---\n\[CLEANED TEXT\]:\n(.*?)\n---", re.DOTALL)
+# (maximum WER, score), checked in order
+_SCORE_STEPS = [(0.0, 5), (0.02, 4), (0.1, 3), (0.3, 2), (1.0, 1)]
+
+_cached_prefixes = set()
+_cached_prefixes_lock = threading.Lock()
+
+
+def mock_usage(prompt: str, text: str, system_instruction: str = None) -> tuple:
+    """(prompt_tokens, output_tokens, cached_tokens) of a request; a repeated system instruction counts as cached."""
+    cached = 0
+    if system_instruction:
+        with _cached_prefixes_lock:
+            if system_instruction in _cached_prefixes:
+                cached = estimate_tokens(system_instruction)
+            else:
+                _cached_prefixes.add(system_instruction)
+    return estimate_tokens((system_instruction or "") + prompt), estimate_tokens(text), cached
+
+def mock_completion(prompt: str, model: str = "mock", system_instruction: str = None, structured: bool = False) -> str:
+    """
+    The mock's answer to a prompt: a cleaned text, a judge score, or an echo of the prompt.
+    The system instruction only matters to the usage report (see `mock_usage`).
+    """
+    if MOCK_LATENCY_SECONDS:
+        time.sleep(MOCK_LATENCY_SECONDS)
+
+    match = _CLEAN_PROMPT_RE.search(prompt)
+    if match:
+        cleaned, _ = pre_clean(match.group(1), MOCK_LANGUAGE)
+        return re.sub(r"\s+", " ", cleaned).strip()
+
+    match = _JUDGE_PROMPT_RE.search(prompt)
+    if match:
+        ground_truth, cleaned_text = match.groups()
+        score = 0
+        if cleaned_text.strip():
+            wer = score_pairs([ground_truth], [cleaned_text])["items"][0]["wer"]
+            score = next((score for limit, score in _SCORE_STEPS if wer <= limit), 1)
+        return json.dumps({"score": score}) if structured else str(score)
+
+    return prompt
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Serves POST /v1/chat/completions (plain and streamed) and GET /v1/models."""
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            messages = request["messages"]
+            system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system") or None
+            prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") != "system")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": {"message": f"Malformed request: {e}"}})
+            return
+
+        model = request.get("model", "mock")
+        text = mock_completion(prompt, model, system, structured=request.get("response_format") is not None)
+        if not request.get("stream"):
+            prompt_tokens, completion_tokens, cached_tokens = mock_usage(prompt, text, system)
+            self._send_json(200, {
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for piece in re.findall(r"\S+\s*", text) or [""]:
+            chunk = {"object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format, *args):
+        pass # one line per request would drown the pipeline's own output
+
+
+def serve(host: str = HOST, port: int = PORT) -> ThreadingHTTPServer:
+    """Creates the server; call `serve_forever()` on it (or run it in a thread)."""
+    return ThreadingHTTPServer((host, port), MockLLMHandler)
+
+
+if __name__ == "__main__":
+    server = serve()
+    print(f"Mock LLM server listening on http://{HOST}:{PORT}/v1 (latency {MOCK_LATENCY_SECONDS}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
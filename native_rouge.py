@@ -0,0 +1,178 @@
+import re
+from collections import Counter
+import numpy as np
+
+# A self-contained ROUGE-1/2/L/Lsum scorer that reproduces `evaluate.load("rouge")` (which wraps
+# Google's rouge_score with its default tokenizer and no stemming) without the Hugging Face stack.
+
+ROUGE_TYPES = ["rouge1", "rouge2", "rougeL", "rougeLsum"]
+
+_NON_ALPHANUM_RE = re.compile(r"[^a-z0-9]+")
+_SPACES_RE = re.compile(r"\s+")
+_VALID_TOKEN_RE = re.compile(r"^[a-z0-9]+$")
+
+
+# ----------------------------------------------- Tokenization -----------------------------------------------
+
+def tokenize(text: str) -> list:
+    """rouge_score's default tokenizer: lowercase, non-alphanumerics become spaces, split."""
+    text = _NON_ALPHANUM_RE.sub(" ", text.lower())
+    return [token for token in _SPACES_RE.split(text) if _VALID_TOKEN_RE.match(token)]
+
+def _sentences(text: str) -> list:
+    """rougeLsum treats every non-empty line as a sentence."""
+    return [tokenize(line) for line in text.split("\n") if len(line)]
+
+
+# ----------------------------------------------- Scores -----------------------------------------------
+
+def _fmeasure(precision: float, recall: float) -> float:
+    return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+def _ngram_fmeasure(target: list, prediction: list, n: int) -> float:
+    target_ngrams = Counter(tuple(target[i:i + n]) for i in range(len(target) - n + 1))
+    prediction_ngrams = Counter(tuple(prediction[i:i + n]) for i in range(len(prediction) - n + 1))
+    overlap = sum((target_ngrams & prediction_ngrams).values())
+    precision = overlap / max(sum(prediction_ngrams.values()), 1)
+    recall = overlap / max(sum(target_ngrams.values()), 1)
+    return _fmeasure(precision, recall)
+
+def _lcs_length(target: list, prediction: list) -> int:
+    """
+    LCS length with the bit-parallel algorithm of Hyyrö (2004): one big-integer bit per target
+    token, a handful of integer operations per prediction token.
+    """
+    match_masks = {}
+    for i, token in enumerate(target):
+        match_masks[token] = match_masks.get(token, 0) | (1 << i)
+    full = (1 << len(target)) - 1
+    v = full
+    for token in prediction:
+        u = v & match_masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(target) - bin(v).count("1")
+
+def _lcs_tables(ref: list, candidates: list) -> tuple:
+    """
+    LCS DP tables of `ref` against every candidate sentence, computed together.
+
+    The candidates are laid side by side, each preceded by a never-matching separator column
+    that plays the role of the table's column 0, so one NumPy operation per reference token
+    advances all tables. Adding `segment * offset` before the running maximum keeps a
+    table's values from leaking into the next one.
+
+    Returns:
+        tuple: (table, starts) where candidate k's table is table[:, starts[k] : starts[k] + len(k) + 1].
+    """
+    vocabulary = {}
+    ref_ids = np.array([vocabulary.setdefault(t, len(vocabulary)) for t in ref])
+    can_ids, segments, starts = [], [], []
+    for k, can in enumerate(candidates):
+        starts.append(len(can_ids))
+        can_ids.append(-1) # separator
+        can_ids.extend(vocabulary.get(t, -1) for t in can)
+        segments.extend([k] * (len(can) + 1))
+    can_ids = np.array(can_ids)
+    offset = (len(ref) + 1) * np.array(segments, dtype=np.int64)
+
+    table = np.zeros((len(ref) + 1, len(can_ids)), dtype=np.int64)
+    for i in range(1, len(ref) + 1):
+        prev = table[i - 1]
+        # cur[j] = prev[j-1] + 1 on a match, else max(prev[j], cur[j-1]); on a match the
+        # diagonal value always dominates, so a running maximum resolves the whole row.
+        candidate = prev.copy()
+        match = np.flatnonzero(can_ids == ref_ids[i - 1])
+        candidate[match] = prev[match - 1] + 1
+        table[i] = np.maximum.accumulate(candidate + offset) - offset
+    return table, starts
+
+def _backtrack(table: np.ndarray, ref: list, can: list) -> list:
+    """Reference indices of one LCS, with the same tie-breaking as rouge_score's backtrack."""
+    i, j = len(ref), len(can)
+    indices = []
+    while i > 0 and j > 0:
+        if ref[i - 1] == can[j - 1]:
+            indices.append(i - 1)
+            i -= 1
+            j -= 1
+        elif table[i][j - 1] > table[i - 1][j]:
+            j -= 1
+        else:
+            i -= 1
+    return indices
+
+def _union_lcs_indices(ref: list, candidates: list) -> list:
+    """Sorted union of the LCS reference indices of `ref` against each candidate sentence."""
+    table, starts = _lcs_tables(ref, candidates)
+    union = set()
+    for start, can in zip(starts, candidates):
+        if table[-1, start + len(can)] > 0:
+            union.update(_backtrack(table[:, start:start + len(can) + 1], ref, can))
+    return sorted(union)
+
+def _rouge_l_fmeasure(target: list, prediction: list) -> float:
+    if not target or not prediction:
+        return 0.0
+    lcs = _lcs_length(target, prediction)
+    return _fmeasure(lcs / len(prediction), lcs / len(target))
+
+def _rouge_lsum_fmeasure(target_sentences: list, prediction_sentences: list) -> float:
+    """Summary-level LCS (ROUGE paper, section 3.2) with rouge_score's double-counting guard."""
+    if not target_sentences or not prediction_sentences:
+        return 0.0
+    m = sum(map(len, target_sentences))
+    n = sum(map(len, prediction_sentences))
+    if not n or not m:
+        return 0.0
+
+    target_counts = Counter(token for sentence in target_sentences for token in sentence)
+    prediction_counts = Counter(token for sentence in prediction_sentences for token in sentence)
+    hits = 0
+    for ref in target_sentences:
+        for token in (ref[i] for i in _union_lcs_indices(ref, prediction_sentences)):
+            if prediction_counts[token] > 0 and target_counts[token] > 0:
+                hits += 1
+                prediction_counts[token] -= 1
+                target_counts[token] -= 1
+    return _fmeasure(hits / n, hits / m)
+
+def score(prediction: str, reference: str, rouge_types: list = None) -> dict:
+    """ROUGE F-measures for a single pair, tokenizing each text once."""
+    rouge_types = rouge_types or ROUGE_TYPES
+    target = tokenize(reference)
+    predicted = tokenize(prediction)
+    scores = {}
+    for rouge_type in rouge_types:
+        if rouge_type == "rougeL":
+            scores[rouge_type] = _rouge_l_fmeasure(target, predicted)
+        elif rouge_type == "rougeLsum":
+            scores[rouge_type] = _rouge_lsum_fmeasure(_sentences(reference), _sentences(prediction))
+        elif re.match(r"rouge[0-9]$", rouge_type) and int(rouge_type[5:]) > 0:
+            scores[rouge_type] = _ngram_fmeasure(target, predicted, int(rouge_type[5:]))
+        else:
+            raise ValueError(f"Invalid rouge type: {rouge_type}")
+    return scores
+
+def score_batch(predictions: list, references: list, rouge_types: list = None) -> list:
+    """Per-pair ROUGE F-measures for many pairs."""
+    if len(predictions) != len(references):
+        raise ValueError("predictions and references must have the same length.")
+    return [score(prediction, reference, rouge_types) for prediction, reference in zip(predictions, references)]
+
+
+class NativeRouge:
+    """
+    Drop-in replacement for the object returned by `evaluate.load("rouge")`.
+
+    `compute` returns the same {"rouge1", "rouge2", "rougeL", "rougeLsum"} dict. For a single pair
+    the numbers are identical to evaluate's; for several pairs the aggregate is the plain mean
+    of the per-pair scores rather than evaluate's bootstrap median, which is random.
+    """
+
+    def compute(self, predictions: list, references: list, rouge_types: list = None, use_aggregator: bool = True) -> dict:
+        rouge_types = rouge_types or ROUGE_TYPES
+        scores = score_batch(predictions, references, rouge_types)
+        if not use_aggregator:
+            return {rouge_type: [s[rouge_type] for s in scores] for rouge_type in rouge_types}
+        return {rouge_type: float(np.mean([s[rouge_type] for s in scores])) if scores else 0.0
+                for rouge_type in rouge_types}
@@ -0,0 +1,226 @@
+import re
+import time
+from functools import lru_cache
+
+from dataset_handler import load_dataset
+from triage import _strip_accents, has_wordlist, is_known_word
+
+# Rule-based pre-cleaning that runs before the LLM: fixes the OCR artifacts that need no context
+# (long s, letters read as digits, a handful of very frequent misread words, words hyphenated
+# across line breaks), so prompts are shorter and the model has less left to fix.
+#
+# The word and hyphen rules consult the triage wordlist (pyspellchecker), so the rules applied
+# depend on whether it is installed: callers that store pre-cleaned text record `has_wordlist`
+# with it (main.py's pre_process stage). Without a wordlist, hyphens at line ends are left to the LLM.
+#
+# Every rule of a language is compiled into ONE regular expression and applied in a single pass;
+# the misread words become a prefix trie inside that pattern, so the matcher does not try each
+# word in turn at every position.
+
+# --- Configuration ---
+LANGUAGE = "eng" # "eng" or "ita"
+INPUT_PATH = "dataset/eng/the_vampyre_subset.json" # Used when run as a script (JSON or JSONL dataset)
+
+# Misread word -> correct word, matched as whole words. A lowercase entry also fixes its
+# capitalized form. Words that are also real words (e.g. "bad" for "had", "arid" for "and") are
+# left to the LLM: a rule whose misread word is in the triage wordlist is skipped (see `_word_rules`).
+WORD_RULES = {
+    "eng": {
+        "lhe": "the", "tbe": "the", "thc": "the", "tlie": "the", "ihe": "the",
+        "lhat": "that", "thal": "that", "tbat": "that", "tbis": "this", "tbey": "they",
+        "tbeir": "their", "thejr": "their", "thcre": "there", "tbough": "though", "lhrough": "through",
+        "hls": "his", "hjs": "his", "hif": "his", "hirn": "him", "sbe": "she",
+        "ond": "and", "wlth": "with", "whlle": "while", "whjch": "which",
+        "wben": "when", "vpon": "upon", "upori": "upon", "shovld": "should", "thari": "than",
+        "orily": "only", "wcls": "was", "waf": "was", "wos": "was", "hcld": "had", "fram": "from",
+        "srom": "from", "jn": "in",
+    },
+    "ita": {
+        "Ohe": "Che", "clie": "che", "cbe": "che", "gii": "gli",
+        "nn": "un", "nna": "una", "uua": "una", "Xon": "Non", "Kon": "Non", "Ko": "No",
+        "Pinoccliio": "Pinocchio", "fìnta": "finta",
+    },
+}
+
+# Single characters that are always wrong in modern text.
+CHAR_RULES = {
+    "eng": {"ſ": "s"},
+    "ita": {"ſ": "s"},
+}
+
+# Digits misread for letters inside a word ("c0nsumptions", "Au6rey", "bai1iff"): only between two
+# letters, so numbers with a letter attached ("1850s", "6pm", "A1", "10mila") are left alone.
+DIGIT_RULES = {
+    "eng": {"0": "o", "1": "l", "6": "b"},
+    "ita": {"0": "o", "1": "l"},
+}
+
+# Text -> expected pre-cleaned text, checked by `check_rules` when the module runs as a script.
+# HYPHEN_CHECKS are only checked with a wordlist, which the hyphen rule needs.
+RULE_CHECKS = {
+    "eng": [("lhe c0nsumptions of Au6rey's bai1iff", "the consumptions of Aubrey's bailiff"),
+            ("the 1850s", "the 1850s"), ("at 6pm", "at 6pm"), ("row A1", "row A1"), ("the 1st and 6th", "the 1st and 6th"),
+            ("arid plains", "arid plains"), ("bis", "bis"), ("Tho' ln bul", "Tho' ln bul"), ("ſo", "so")],
+    "ita": [("10mila lire", "10mila lire"), ("Ohi, clie c0sa", "Ohi, che cosa"), ("il 1848", "il 1848"),
+            ("fìnta", "finta")],
+}
+HYPHEN_CHECKS = {
+    "eng": [("the con-\nsumptions", "the consumptions"), ("a well-\n known fact", "a well-known fact"),
+            ("self-\nevident", "self-evident"), ("New-\nYork", "New-\nYork")],
+    "ita": [("ripe-\ntergli", "ripetergli")],
+}
+
+_LETTER = r"[^\W\d_]"
+
+
+# ----------------------------------------------- Rule Compilation -----------------------------------------------
+
+def _trie_pattern(words: list) -> str:
+    """Regex alternation of `words` factored into a prefix trie ("th(?:e|at)" rather than "the|that")."""
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[""] = {} # end of word
+
+    def build(node: dict) -> str:
+        ends = "" in node
+        branches = [re.escape(character) + build(child) for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if ends:
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+def _word_rules(language: str) -> dict:
+    """
+    The word rules of a language, without those whose misread word is a real word. A rule that
+    only fixes an accent ("fìnta" -> "finta") is kept: the wordlist ignores accents.
+    """
+    rules = {}
+    for wrong, right in WORD_RULES[language].items():
+        accent_only = _strip_accents(wrong) == _strip_accents(right)
+        if not accent_only and is_known_word(wrong, language):
+            print(f"Warning: skipping the pre-cleaning rule '{wrong}' -> '{right}': '{wrong}' is a real word.")
+            continue
+        rules[wrong] = right
+    return rules
+
+def _hyphen_replacement(match, language: str) -> str:
+    """
+    A hyphen at a line end, before a lowercase letter: the line break goes, and the hyphen too
+    unless it joins a compound. It is kept when both halves are words and their join is not
+    ("well-\nknown" -> "well-known"), dropped otherwise ("con-\nsumptions" -> "consumptions").
+    """
+    before = re.search(rf"{_LETTER}+$", match.string[:match.start()]).group()
+    after = re.match(rf"{_LETTER}+", match.string[match.end():]).group()
+    if (not is_known_word(before + after, language)
+            and is_known_word(before, language) and is_known_word(after, language)):
+        return "-"
+    return ""
+
+@lru_cache(maxsize=None)
+def _compiled_rules(language: str) -> tuple:
+    """
+    Builds the combined pattern of a language and the replacement of each of its groups.
+
+    Every alternative starts by consuming a known character (word boundaries are checked with
+    a lookbehind after it), and a leading lookahead lists those characters, so most positions
+    of the text are rejected after a single set lookup.
+    """
+    if language not in WORD_RULES:
+        raise ValueError(f"Unknown pre-cleaning language: {language}")
+
+    words = _word_rules(language)
+    for wrong, right in list(words.items()):
+        if wrong.islower():
+            words.setdefault(wrong.capitalize(), right.capitalize())
+    characters = CHAR_RULES[language]
+    digits = DIGIT_RULES[language]
+    digit_class = "[" + "".join(digits) + "]"
+
+    first_characters = sorted({word[0] for word in words})
+    word_pattern = "|".join(
+        # (?<!\w.) right after the first character is the \b that would precede it.
+        re.escape(first) + r"(?<!\w.)" + _trie_pattern([word[1:] for word in words if word[0] == first]) + r"\b"
+        for first in first_characters
+    )
+    hyphens = has_wordlist(language) # Telling a compound from a broken word needs the wordlist
+    if not hyphens:
+        print(f"Warning: no '{language}' wordlist (pyspellchecker); hyphens at line ends are left as they are.")
+    starts = "".join(map(re.escape, sorted(set(first_characters) | set(digits) | set(characters) | ({"-"} if hyphens else set()))))
+    pattern = rf"(?=[{starts}])(?:" + "|".join([
+        # A misread word, matched through a prefix trie
+        rf"(?P<word>{word_pattern})",
+        # A word broken across a line with a hyphen: "ripe- \ntergli" -> "ripetergli"
+        *([rf"(?P<hyphen>-(?<={_LETTER}-) *\n\s*(?=[^\W\d_A-ZÀ-Þ]))"] if hyphens else []),
+        # A digit between two letters ("c0nsumptions", "Au6rey")
+        rf"(?P<digit>{digit_class}(?<={_LETTER}{digit_class})(?={_LETTER}))",
+        "(?P<char>[" + "".join(map(re.escape, characters)) + "])",
+    ]) + ")"
+    replacements = {
+        "word": lambda match: words[match.group()],
+        "hyphen": lambda match: _hyphen_replacement(match, language),
+        "digit": lambda match: digits[match.group()],
+        "char": lambda match: characters[match.group()],
+    }
+    return re.compile(pattern), replacements
+
+
+# ----------------------------------------------- Pre-Cleaning -----------------------------------------------
+
+def pre_clean(text: str, language: str = LANGUAGE) -> tuple:
+    """
+    Applies every rule of `language` to `text` in one pass.
+
+    Returns:
+        tuple: (cleaned_text, substitutions) where substitutions is the number of rule matches replaced.
+    """
+    pattern, replacements = _compiled_rules(language)
+    return pattern.subn(lambda match: replacements[match.lastgroup](match), text)
+
+def pre_clean_items(items_by_id: dict, language: str = LANGUAGE) -> dict:
+    """Pre-cleans the "ocr" text of every item. Returns {item_id: (cleaned_text, substitutions)}."""
+    return {item_id: pre_clean(item.get("ocr", ""), language) for item_id, item in items_by_id.items()}
+
+
+def check_rules(language: str) -> list:
+    """The RULE_CHECKS of a language that the rules get wrong, as (text, expected, got)."""
+    failures = []
+    checks = RULE_CHECKS.get(language, []) + (HYPHEN_CHECKS.get(language, []) if has_wordlist(language) else [])
+    for text, expected in checks:
+        cleaned, _ = pre_clean(text, language)
+        if cleaned != expected:
+            failures.append((text, expected, cleaned))
+    return failures
+
+
+def main():
+    """Checks the rules, then pre-cleans a dataset and prints the substitutions per item and the throughput."""
+    for text, expected, cleaned in check_rules(LANGUAGE):
+        print(f"Rule check failed: {text!r} -> {cleaned!r}, expected {expected!r}")
+
+    try:
+        data_dict = load_dataset(INPUT_PATH)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error loading input file: {e}")
+        return
+
+    start = time.perf_counter()
+    results = pre_clean_items(data_dict, LANGUAGE)
+    elapsed = time.perf_counter() - start
+
+    for item_id, (_, substitutions) in results.items():
+        print(f"Item {item_id}: {substitutions} substitutions")
+    total_chars = sum(len(item.get("ocr", "")) for item in data_dict.values())
+    total_substitutions = sum(substitutions for _, substitutions in results.values())
+    print(f"\n{total_substitutions} substitutions in {len(results)} items "
+          f"({total_chars / max(elapsed, 1e-9) / 1e6:.1f} M chars/s)")
+
+
+if __name__ == "__main__":
+    main()
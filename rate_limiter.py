@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token-bucket limiter on requests per minute, shared by threads and asyncio tasks.
+
+    Each call to `acquire`/`acquire_async` reserves one token. If the bucket is empty the
+    reservation is still taken (the balance goes negative) and the caller sleeps until its
+    token would have been refilled, so waiting callers are served in arrival order.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive.")
+        self.rate = requests_per_minute / 60.0  # tokens per second
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes one token and returns how many seconds the caller must wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        """Blocks the current thread until a request may be sent."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Suspends the current task until a request may be sent."""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def set_rate(self, requests_per_minute: float, burst: int = None) -> None:
+        """Changes the refill rate (and, if given, the burst); tokens already in the bucket are kept up to the new burst."""
+        with self._lock:
+            now = time.monotonic()
+            if burst is not None:
+                self.capacity = max(1, burst)
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            self.rate = requests_per_minute / 60.0
+
+
+class AdaptiveLimiter:
+    """
+    AIMD (additive increase, multiplicative decrease) control of one model's request flow.
+
+    Two limits adapt together: how many requests may be in flight, and the token-bucket rate.
+    Every success adds about one slot per window of successes, and raises the rate by a small
+    step; a 429, 5xx or timeout halves both at once. Failures of requests sent before the last
+    decrease do not decrease again: they were sent at the old limits, which are already
+    corrected. The configured values are ceilings the limits never exceed.
+    """
+
+    def __init__(self, requests_per_minute: float, max_concurrent: int, min_concurrent: int = 1,
+                 min_rate_fraction: float = 0.01, decrease_factor: float = 0.5):
+        self.max_rate = requests_per_minute
+        self.min_rate = requests_per_minute * min_rate_fraction
+        self.max_concurrent = max(1, max_concurrent)
+        self.min_concurrent = max(1, min(min_concurrent, self.max_concurrent))
+        self.decrease_factor = decrease_factor
+        self.bucket = TokenBucket(requests_per_minute, burst=self.max_concurrent)
+        self.limit = float(self.max_concurrent) # optimistic start; the first overload halves it
+        self.rate = float(requests_per_minute)
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self._sent = 0 # requests started so far; tickets are taken from this count
+        self._last_decrease = -1 # ticket of the last request sent before the last decrease
+        self._condition = threading.Condition()
+
+    def acquire(self) -> int:
+        """
+        Blocks until a request slot is free and the rate allows another request.
+
+        Returns:
+            int: A ticket to hand back to `release`.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self._sent += 1
+            ticket = self._sent
+        self.bucket.acquire()
+        return ticket
+
+    def release(self, ticket: int, outcome: str) -> None:
+        """
+        Frees the slot of an `acquire` ticket and adapts the limits to how the request ended:
+        "success", "overload" (429, 5xx, timeout) or "error" (a failure that says nothing about load).
+        """
+        rate = None
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == "success":
+                self.successes += 1
+                self.limit = min(self.max_concurrent, self.limit + 1.0 / self.limit)
+                if self.rate < self.max_rate:
+                    self.rate = min(self.max_rate, self.rate + self.max_rate / (100.0 * self.limit))
+                    rate = self.rate
+            elif outcome == "overload":
+                self.overloads += 1
+                if ticket > self._last_decrease:
+                    self._last_decrease = self._sent
+                    self.limit = max(self.min_concurrent, self.limit * self.decrease_factor)
+                    self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                    rate = self.rate
+            self._condition.notify_all()
+        if rate is not None:
+            self.bucket.set_rate(rate, burst=int(self.limit))
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {"concurrency": round(self.limit, 2), "requests_per_minute": round(self.rate, 1),
+                    "successes": self.successes, "overloads": self.overloads}
+
+
+class RetryBudget:
+    """
+    Caps retries across a whole run: at most `minimum` retries plus `ratio` retries per first
+    attempt. When a backend is down, requests fail fast instead of multiplying its load.
+    """
+
+    def __init__(self, ratio: float = 0.2, minimum: int = 20):
+        self.ratio = ratio
+        self.minimum = minimum
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def try_spend(self) -> bool:
+        """Takes one retry from the budget; False once it is used up."""
+        with self._lock:
+            if self.retries >= self.minimum + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
@@ -0,0 +1,362 @@
+import hashlib
+import json
+import os
+import threading
+
+# Results files come in two layouts, both read by `load_results`:
+#
+# - version 1 ("full"): a JSON array of records, or {"run_summary", "items"}. Every record carries
+#   its OCR and ground truth texts, and every model output its cleaned text and its diffs as text.
+# - version 2 ("compact"): {"schema", "version", "run_summary", "items", "texts"}. Every text is
+#   stored once in the "texts" table, keyed by a hash of its content, and the records hold the
+#   keys; identical texts (passthrough items, models agreeing with the ground truth) share one
+#   entry. Diffs are stored as word ranges of the ground truth and the cleaned text, which the
+#   loader turns back into text. Records are written one per line.
+RESULTS_SCHEMA = "ocr-pipeline-results"
+RESULTS_SCHEMA_VERSION = 2
+_ITEM_TEXT_FIELDS = ("original_ocr", "ground_truth")
+
+
+class JsonlResultWriter:
+    """
+    Append-only JSONL checkpoint of pipeline results.
+
+    Every result is written as one line and flushed to disk as soon as its item finishes, so a
+    crash loses at most the item in progress and memory does not grow with the corpus.
+    Safe to call from several threads or asyncio tasks.
+
+    A new checkpoint given a `header` starts with a {"run_header": header} line describing the
+    run that wrote it (see `read_run_header`), so a later run can tell whether it may resume it.
+    Readers of the checkpoint (`iter_jsonl`) skip that line.
+    """
+
+    def __init__(self, path: str, resume: bool = True, header: dict = None):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        if resume:
+            _drop_partial_last_line(path)
+        self.path = path
+        self.bytes_written = 0
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        if header is not None and self._file.tell() == 0:
+            self.write({"run_header": header})
+
+    def write(self, result: dict) -> int:
+        """Appends one result and returns the number of bytes written."""
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        size = len(line.encode("utf-8"))
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.bytes_written += size
+        return size
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _drop_partial_last_line(path: str) -> None:
+    """Truncates a line left half-written by a crash, so appended lines stay valid JSON."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line.
+        position = size - 1
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                break
+            position -= step
+        else:
+            f.truncate(0)
+    print(f"Warning: dropped an incomplete last line from '{path}'.")
+
+
+def iter_jsonl(path: str):
+    """Yields (byte_offset, record) for every valid line of a JSONL file, except a checkpoint's run header."""
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: skipping malformed line at byte {offset} in '{path}'.")
+                else:
+                    if not (isinstance(record, dict) and "run_header" in record):
+                        yield offset, record
+            offset += len(line)
+
+
+def read_run_header(path: str):
+    """
+    The run header a checkpoint starts with (see `JsonlResultWriter`).
+
+    Returns:
+        dict: The header; None if the checkpoint has none (it predates run headers) or is
+              missing or empty.
+    """
+    try:
+        with open(path, "rb") as f:
+            line = f.readline()
+    except FileNotFoundError:
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return record.get("run_header") if isinstance(record, dict) else None
+
+
+def has_llm_error(record: dict) -> bool:
+    """True if a model output of a result record holds an LLM error placeholder, as its cleaned text or judgement."""
+    from llm_providers import is_llm_error # Imported here: only checkpoint readers need it, not every results reader
+    for output in record.get("model_outputs", []):
+        if is_llm_error(output.get("cleaned_text")) or "error" in (output.get("judgement") or {}):
+            return True
+    return False
+
+
+def load_completed_ids(path: str, retry_failed: bool = True) -> set:
+    """
+    Returns the item IDs already checkpointed in a JSONL results file. If an item was
+    checkpointed twice, its last record counts; with `retry_failed`, items whose last record
+    holds an LLM error (see `has_llm_error`) are left out, so a resumed run processes them again.
+    """
+    if not os.path.exists(path):
+        return set()
+    completed = {}
+    for _, record in iter_jsonl(path):
+        completed[str(record.get("item_id"))] = not (retry_failed and has_llm_error(record))
+    return {item_id for item_id, done in completed.items() if done}
+
+
+def finalize_results(jsonl_path: str, output_path: str, order: list = None, run_summary: dict = None,
+                     compact: bool = False, include_unlisted: bool = False) -> int:
+    """
+    Converts a JSONL checkpoint into the pretty-printed JSON array used by the results files.
+    With a `run_summary`, the file is instead an object {"run_summary": ..., "items": [...]};
+    with `compact`, it is a version 2 file (see RESULTS_SCHEMA_VERSION). `load_results` reads
+    every layout.
+
+    Only item IDs and byte offsets are held in memory; records are re-read one at a time while
+    writing. If an item was checkpointed twice, the last record wins.
+
+    Args:
+        jsonl_path (str): The JSONL checkpoint file.
+        output_path (str): The JSON file to write.
+        order (list): Item IDs to write, in this order. None writes every item, in file order.
+        run_summary (dict): Telemetry of the run (see instrumentation.RunMetrics.summary).
+        compact (bool): Write the compact layout, every text stored once.
+        include_unlisted (bool): With an `order`, also write the items it does not list, after
+            the listed ones in file order. By default they are left out.
+
+    Returns:
+        int: Number of items written.
+    """
+    offsets = {}
+    for offset, record in iter_jsonl(jsonl_path):
+        item_id = str(record.get("item_id"))
+        offsets.pop(item_id, None) # Re-insert so a duplicate takes the later position
+        offsets[item_id] = offset
+
+    if order is None:
+        ordered_ids = list(offsets)
+    else:
+        ordered_ids = [str(item_id) for item_id in order if str(item_id) in offsets]
+        if include_unlisted:
+            listed = set(ordered_ids)
+            ordered_ids += [item_id for item_id in offsets if item_id not in listed]
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if compact:
+        _write_compact(jsonl_path, offsets, ordered_ids, output_path, run_summary)
+        return len(ordered_ids)
+
+    indent = "\n  " if run_summary is None else "\n    "
+    with open(jsonl_path, "rb") as source, open(output_path, "w", encoding="utf-8") as outfile:
+        if run_summary is not None:
+            summary_text = json.dumps(run_summary, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+            outfile.write('{\n  "run_summary": ' + summary_text + ',\n  "items": ')
+        outfile.write("[")
+        for i, item_id in enumerate(ordered_ids):
+            source.seek(offsets[item_id])
+            record = json.loads(source.readline())
+            pretty = json.dumps(record, indent=2, ensure_ascii=False).replace("\n", indent)
+            outfile.write(("," if i else "") + indent + pretty)
+        outfile.write(indent[:-2] + "]" if ordered_ids else "]")
+        if run_summary is not None:
+            outfile.write("\n}")
+    return len(ordered_ids)
+
+
+def _write_compact(jsonl_path: str, offsets: dict, ordered_ids: list, output_path: str, run_summary: dict) -> None:
+    """
+    Writes a version 2 results file. The text table goes last, so records are streamed out as
+    they are compacted and each new text is set aside in a side file; only the keys of the texts
+    seen so far are held in memory.
+    """
+    texts_path = f"{output_path}.texts.tmp"
+    seen = set()
+    with open(texts_path, "w", encoding="utf-8") as texts_file:
+        def store_text(text: str) -> str:
+            key = text_key(text)
+            if key not in seen:
+                texts_file.write(("," if seen else "") + f"\n    {json.dumps(key)}: {json.dumps(text, ensure_ascii=False)}")
+                seen.add(key)
+            return key
+
+        with open(jsonl_path, "rb") as source, open(output_path, "w", encoding="utf-8") as outfile:
+            outfile.write(f'{{\n  "schema": "{RESULTS_SCHEMA}",\n  "version": {RESULTS_SCHEMA_VERSION},\n')
+            if run_summary is not None:
+                summary_text = json.dumps(run_summary, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+                outfile.write(f'  "run_summary": {summary_text},\n')
+            outfile.write('  "items": [')
+            for i, item_id in enumerate(ordered_ids):
+                source.seek(offsets[item_id])
+                record = compact_record(json.loads(source.readline()), store_text)
+                outfile.write(("," if i else "") + "\n    " + json.dumps(record, ensure_ascii=False))
+            outfile.write("\n  ],\n" if ordered_ids else "],\n")
+            outfile.write('  "texts": {')
+            texts_file.close()
+            with open(texts_path, "r", encoding="utf-8") as texts:
+                while True:
+                    chunk = texts.read(1 << 20)
+                    if not chunk:
+                        break
+                    outfile.write(chunk)
+            outfile.write("\n  }\n}" if seen else "}\n}")
+    os.remove(texts_path)
+
+
+def text_key(text: str) -> str:
+    """The key of a text in the text table of a compact results file: a hash of its content."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def _diff_ranges(reference: str, hypothesis: str, diffs: list) -> list:
+    """
+    `diffs` (as produced by diff_engine.diff_words) as [type, ref_start, ref_end, hyp_start,
+    hyp_end] word ranges, or None if they are not the diff of these texts (e.g. made by an
+    older version of the diff).
+    """
+    # Imported here: diff_engine imports this module.
+    from diff_engine import encode, myers_opcodes
+    ref_words, hyp_words = reference.split(), hypothesis.split()
+    vocabulary = {}
+    ranges = [list(opcode) for opcode in myers_opcodes(encode(ref_words, vocabulary), encode(hyp_words, vocabulary))
+              if opcode[0] != "equal"]
+    if _diffs_of(ranges, ref_words, hyp_words) != diffs:
+        return None
+    return ranges
+
+def _diffs_of(ranges: list, ref_words: list, hyp_words: list) -> list:
+    return [{"type": tag, "reference": " ".join(ref_words[i1:i2]), "hypothesis": " ".join(hyp_words[j1:j2])}
+            for tag, i1, i2, j1, j2 in ranges]
+
+def compact_record(record: dict, store_text) -> dict:
+    """
+    A record in the compact layout: its texts replaced by the keys `store_text(text)` returns,
+    and the diffs of each model output by "diff_ranges" where they match the texts. Other fields,
+    and their order, are kept.
+    """
+    compact = {key: store_text(value) if key in _ITEM_TEXT_FIELDS and isinstance(value, str) else value
+               for key, value in record.items()}
+    ground_truth = record.get("ground_truth")
+    outputs = []
+    for output in record.get("model_outputs") or []:
+        cleaned_text = output.get("cleaned_text")
+        ranges = None
+        if isinstance(cleaned_text, str) and isinstance(ground_truth, str) and isinstance(output.get("diffs"), list):
+            ranges = _diff_ranges(ground_truth, cleaned_text, output["diffs"])
+        compact_output = {}
+        for key, value in output.items():
+            if key == "cleaned_text" and isinstance(value, str):
+                compact_output[key] = store_text(value)
+            elif key == "diffs" and ranges is not None:
+                compact_output["diff_ranges"] = ranges
+            else:
+                compact_output[key] = value
+        outputs.append(compact_output)
+    if "model_outputs" in record:
+        compact["model_outputs"] = outputs
+    return compact
+
+def expand_record(record: dict, texts: dict, diffs: bool = True) -> dict:
+    """
+    A record of a compact results file in the full layout. Texts are shared with `texts`, not
+    copied. With `diffs` False, "diff_ranges" are left as they are, for readers that do not
+    need the diffs.
+    """
+    expanded = {key: texts[value] if key in _ITEM_TEXT_FIELDS and isinstance(value, str) else value
+                for key, value in record.items()}
+    ref_words = None
+    outputs = []
+    for output in record.get("model_outputs") or []:
+        expanded_output = {}
+        for key, value in output.items():
+            if key == "cleaned_text" and isinstance(value, str):
+                expanded_output[key] = texts[value]
+            elif key == "diff_ranges" and diffs:
+                if ref_words is None:
+                    ref_words = expanded.get("ground_truth", "").split()
+                expanded_output["diffs"] = _diffs_of(value, ref_words, texts[output["cleaned_text"]].split())
+            else:
+                expanded_output[key] = value
+        outputs.append(expanded_output)
+    if "model_outputs" in record:
+        expanded["model_outputs"] = outputs
+    return expanded
+
+
+def load_results(path: str, diffs: bool = True) -> list:
+    """
+    Reads the items of a results file, in the full layout whatever the file's version: a JSON
+    array, an object with a "run_summary" and an "items" array (see finalize_results), or a
+    compact file (see `expand_record`; `diffs` False skips rebuilding the diffs).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return results_of(json.load(f), diffs)
+
+def is_results(data) -> bool:
+    """True if parsed JSON is a results file, in any layout (a JSON array counts as one)."""
+    return isinstance(data, list) or (isinstance(data, dict) and ("items" in data or data.get("schema") == RESULTS_SCHEMA))
+
+def results_of(data, diffs: bool = True) -> list:
+    """The items, in the full layout, of a results file already parsed from JSON (see `load_results`)."""
+    if isinstance(data, dict):
+        if data.get("schema") == RESULTS_SCHEMA:
+            if data.get("version", 1) > RESULTS_SCHEMA_VERSION:
+                raise ValueError(f"Results schema version {data['version']} is newer than this code "
+                                 f"(reads up to {RESULTS_SCHEMA_VERSION}).")
+            texts = data.get("texts", {})
+            return [expand_record(record, texts, diffs) for record in data.get("items", [])]
+        return data.get("items", [])
+    return data
+
+def iter_results(path: str):
+    """The items of a results file, JSON (see `load_results`) or a JSONL checkpoint, which is streamed."""
+    if path.endswith(".jsonl"):
+        return (record for _, record in iter_jsonl(path))
+    return iter(load_results(path))
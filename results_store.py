@@ -0,0 +1,184 @@
+import os
+import re
+
+from result_writer import iter_jsonl, load_results
+
+try:
+    # Parquet I/O and the queries need pyarrow; without it the store is unavailable and main.py
+    # only writes its JSON results.
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+# A columnar copy of the pipeline results: one row per (item, model) with the metrics and judge
+# score as flat columns, stored as Parquet files partitioned by run and model
+# (<store>/run_id=<run>/model_name=<model>/). Queries read only the columns and partitions they
+# need, so comparing models or runs never deserializes the nested JSON results.
+
+# --- Configuration ---
+STORE_DIR = "results/store"
+IMPORT_PATHS = ["results/full_pipeline_results_24.json", "results/full_pipeline_results_12_ita.json"] # Used when run as a script
+
+ROUGE_COLUMNS = ["rouge1", "rouge2", "rougeL", "rougeLsum"]
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("The results store needs pyarrow: pip install pyarrow")
+
+def _schema():
+    return pa.schema([
+        ("run_id", pa.string()),
+        ("language", pa.string()),
+        ("item_id", pa.string()),
+        ("model_name", pa.string()),
+        ("original_ocr", pa.string()),
+        ("ground_truth", pa.string()),
+        ("cleaned_text", pa.string()),
+        ("failed", pa.bool_()), # cleaning returned an error placeholder: no metrics, no score
+        ("passthrough", pa.bool_()), # triage skipped the LLM
+        ("noise_score", pa.float64()),
+        ("wer", pa.float64()),
+        ("cer", pa.float64()),
+        *[(name, pa.float64()) for name in ROUGE_COLUMNS],
+        ("score", pa.int64()), # judge score; -1 = unparseable, null = not judged
+    ])
+
+def _partitioning():
+    return ds.partitioning(pa.schema([("run_id", pa.string()), ("model_name", pa.string())]), flavor="hive")
+
+
+def result_rows(results, run_id: str, language: str):
+    """Yields one flat row per model output of pipeline results (dicts as written by main.py)."""
+    for result in results:
+        pre_processing = result.get("pre_processing") or {}
+        for output in result.get("model_outputs", []):
+            metrics = output.get("metrics") or {}
+            rouge = metrics.get("rouge") or {}
+            judgement = output.get("judgement") or {}
+            yield {
+                "run_id": run_id,
+                "language": language,
+                "item_id": str(result.get("item_id")),
+                "model_name": output.get("model_name"),
+                "original_ocr": result.get("original_ocr"),
+                "ground_truth": result.get("ground_truth"),
+                "cleaned_text": output.get("cleaned_text"),
+                "failed": not metrics,
+                "passthrough": bool(pre_processing.get("passthrough", False)),
+                "noise_score": pre_processing.get("noise_score"),
+                "wer": metrics.get("wer"),
+                "cer": metrics.get("cer"),
+                **{name: rouge.get(name) for name in ROUGE_COLUMNS},
+                "score": judgement.get("score"),
+            }
+
+def write_run(results, run_id: str, language: str, store_dir: str = STORE_DIR) -> int:
+    """
+    Writes the results of one run to the store, replacing any earlier copy of the same run and model.
+
+    Returns:
+        int: Number of rows written.
+    """
+    _require_pyarrow()
+    table = pa.Table.from_pylist(list(result_rows(results, run_id, language)), schema=_schema())
+    if table.num_rows:
+        ds.write_dataset(table, store_dir, format="parquet", partitioning=_partitioning(),
+                         existing_data_behavior="delete_matching", basename_template="part-{i}.parquet")
+    return table.num_rows
+
+def import_results(path: str, run_id: str = None, language: str = None, store_dir: str = STORE_DIR) -> int:
+    """
+    Imports a results file of main.py (the final JSON, with or without run summary, or the JSONL
+    checkpoint). `run_id` defaults to the file name; `language` to "ita" for the "_ita" files
+    and "eng" otherwise.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    if run_id is None:
+        run_id = name
+    if language is None:
+        language = "ita" if re.search(r"(^|_)ita(_|$)", name) else "eng"
+    if path.endswith(".jsonl"):
+        results = (record for _, record in iter_jsonl(path))
+    else:
+        results = load_results(path)
+    return write_run(results, run_id, language, store_dir)
+
+
+# ----------------------------------------------- Queries -----------------------------------------------
+
+def _filter(runs: list = None, models: list = None, languages: list = None, judged_only: bool = False):
+    """A dataset filter on the given runs, models and languages (None = all)."""
+    expression = None
+    for column, values in [("run_id", runs), ("model_name", models), ("language", languages)]:
+        if values is not None:
+            condition = ds.field(column).isin(values)
+            expression = condition if expression is None else expression & condition
+    if judged_only:
+        condition = ds.field("score") >= 0
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def load_table(columns: list = None, store_dir: str = STORE_DIR, **filters):
+    """
+    The rows of the store as a pyarrow Table, reading only `columns` (None = all) and the
+    partitions the filters (`runs`, `models`, `languages`, `judged_only`) select.
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(store_dir, format="parquet", partitioning=_partitioning())
+    return dataset.to_table(columns=columns, filter=_filter(**filters))
+
+def aggregate(metric: str, by: list = ("model_name",), store_dir: str = STORE_DIR, **filters) -> list:
+    """
+    Mean, min, max and count of a metric column (e.g. "wer", "score") per group, over the
+    outputs that have it (failed outputs have no metrics, unjudged ones no score).
+
+    Returns:
+        list: One dict per group, sorted by the group columns.
+    """
+    by = list(by)
+    table = load_table(by + [metric], store_dir, **filters)
+    table = table.filter(pc.is_valid(table[metric]))
+    grouped = table.group_by(by).aggregate([(metric, "mean"), (metric, "min"), (metric, "max"), (metric, "count")])
+    return sorted(grouped.to_pylist(), key=lambda row: [str(row[column]) for column in by])
+
+def score_distribution(by: list = ("language",), store_dir: str = STORE_DIR, **filters) -> dict:
+    """
+    How many judged outputs got each score, per group.
+
+    Returns:
+        dict: Maps each group (a tuple of the `by` values) to {score: count}.
+    """
+    by = list(by)
+    table = load_table(by + ["score"], store_dir, **filters)
+    table = table.filter(pc.is_valid(table["score"]))
+    distribution = {}
+    for row in table.group_by(by + ["score"]).aggregate([("score", "count")]).to_pylist():
+        group = tuple(row[column] for column in by)
+        distribution.setdefault(group, {})[row["score"]] = row["score_count"]
+    return {group: dict(sorted(counts.items())) for group, counts in sorted(distribution.items())}
+
+
+def main():
+    """Imports IMPORT_PATHS into the store and prints mean WER per model and the score distribution per language."""
+    if pa is None:
+        print("pyarrow is not installed; install it to use the results store.")
+        return
+    for path in IMPORT_PATHS:
+        try:
+            print(f"Imported {import_results(path)} rows from '{path}'")
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Error importing '{path}': {e}")
+
+    print("\nMean WER by model:")
+    for row in aggregate("wer", by=["model_name"]):
+        print(f"  {row['model_name']:<20} {row['wer_mean']:.4f} over {row['wer_count']} outputs")
+    print("\nScore distribution by language:")
+    for (language,), counts in score_distribution(by=["language"]).items():
+        print(f"  {language}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import glob
+import json
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from result_writer import finalize_results, iter_results, load_completed_ids
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# A work queue for sharded runs of main.py. The item IDs of a run are split into shards, listed in
+# <queue>/queue.json; worker processes, on one machine or on several sharing the directory, claim
+# shards one at a time under an exclusive file lock and write the results of each shard to their
+# own JSONL checkpoint. A claimed shard is a lease, renewed by a heartbeat while its worker runs:
+# when a worker crashes the lease runs out and the next worker to ask reclaims the shard, skipping
+# the items the crashed worker already checkpointed. Once every shard is done, `merge` joins the
+# checkpoints into one ordered results file, so no index ranges have to be picked or combined by hand.
+# The queue also keeps the run header of the worker that created it (models, configuration and
+# dataset hashes, see main.queue_header): a worker started with another one is refused, so shards
+# of different runs are never merged together.
+
+# --- Configuration ---
+QUEUE_DIR = "results/shards"
+SHARD_SIZE = 50 # Items per shard
+LEASE_SECONDS = 300 # A claimed shard whose lease is not renewed for this long is handed to another worker
+POLL_SECONDS = 10 # How often an idle worker checks for shards to take over while others finish theirs
+MERGE_PATHS = ["results/full_pipeline_results_1_3.json", "results/full_pipeline_results_4_6_ita.json", "results/full_pipeline_results_7_9_ita.json",
+               "results/full_pipeline_results_10_12_ita.json"] # Used when run as a script
+MERGE_OUTPUT_PATH = "results/full_pipeline_results_merged_ita.json"
+MERGE_COMPACT = True # Write the merged file in the compact layout (result_writer.RESULTS_SCHEMA_VERSION)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Holds an exclusive lock on `path` (created if missing), waiting for other processes to release it."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.lockf(f, fcntl.LOCK_EX) # POSIX record lock: also honoured over NFS
+            try:
+                yield
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # LK_LOCK gives up after 10 seconds
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def worker_name() -> str:
+    """This process' name in the queue: host and process ID."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _natural_key(item_id: str) -> tuple:
+    return (0, int(item_id), "") if item_id.isdigit() else (1, 0, item_id)
+
+def _range_of(path: str) -> tuple:
+    """(first, last) item of a hand-split results file named like "..._4_6_ita.json", or None."""
+    match = re.search(r"_(\d+)_(\d+)(?:_[a-z]+)?\.json$", os.path.basename(path))
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+class ShardQueue:
+    """
+    The shards of one run and who holds them. Shards are "pending", "claimed" (with a worker and
+    a lease deadline) or "done". Every change is made under the queue's file lock, and the state
+    file is replaced atomically, so readers never see a half-written queue.
+    """
+
+    def __init__(self, queue_dir: str = QUEUE_DIR, lease_seconds: float = LEASE_SECONDS):
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.state_path = os.path.join(queue_dir, "queue.json")
+        self.lock_path = os.path.join(queue_dir, "queue.lock")
+        self.header = None # This worker's run header, checked against the queue's by `create` and `claim`
+        self._lock = threading.Lock() # file locks are per process: the heartbeat thread needs this too
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.queue_dir, exist_ok=True)
+        with self._lock, _file_lock(self.lock_path):
+            yield
+
+    def _load(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _check_header(self, state: dict) -> None:
+        """Raises ValueError if the queue was created for another run than this worker's (see `create`)."""
+        if self.header is not None and state.get("run_header") != self.header:
+            raise ValueError(f"The queue in '{self.queue_dir}' was created by a run with other models, settings or "
+                             f"dataset texts (queue: {state.get('run_header')}, this worker: {self.header}); "
+                             "remove it or use another directory for this run.")
+
+    def _save(self, state: dict) -> None:
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def create(self, item_ids: list, shard_size: int = SHARD_SIZE, header: dict = None) -> bool:
+        """
+        Splits `item_ids` into shards, unless the queue already holds them (the first worker
+        creates the queue, the others join it). `header` describes this worker's run; the queue
+        stores the header of its creator, and only workers with the same header may join it.
+
+        Returns:
+            bool: True if the queue was created, False if joined.
+
+        Raises:
+            ValueError: The queue holds a different list of items, or another run header.
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        self.header = header
+        with self._locked():
+            state = self._load()
+            if state is not None:
+                if state["item_ids"] != item_ids:
+                    raise ValueError(f"The queue in '{self.queue_dir}' holds a different set of items; "
+                                     "remove it or use another directory for a new run.")
+                self._check_header(state)
+                return False
+            shards = [{"index": index, "item_ids": item_ids[start:start + shard_size], "status": "pending",
+                       "worker": None, "lease_until": None, "attempts": 0}
+                      for index, start in enumerate(range(0, len(item_ids), shard_size))]
+            self._save({"created": time.time(), "run_header": header, "item_ids": item_ids, "shards": shards})
+            return True
+
+    def created(self) -> float:
+        """When the queue was created (the shared start time of the run)."""
+        return self._load()["created"]
+
+    def claim(self, worker: str) -> dict:
+        """
+        Takes the first pending shard, or a claimed one whose lease has run out.
+
+        Returns:
+            dict: The shard ("index", "item_ids", "attempts"), or None when no shard is left to claim.
+
+        Raises:
+            ValueError: The queue was replaced by one of another run since this worker joined it.
+        """
+        with self._locked():
+            state = self._load()
+            self._check_header(state)
+            now = time.time()
+            for shard in state["shards"]:
+                expired = shard["status"] == "claimed" and shard["lease_until"] < now
+                if shard["status"] == "pending" or expired:
+                    if expired:
+                        print(f"Reclaiming shard {shard['index']} from {shard['worker']} (lease expired).")
+                    shard.update(status="claimed", worker=worker, lease_until=now + self.lease_seconds,
+                                 attempts=shard["attempts"] + 1)
+                    self._save(state)
+                    return dict(shard)
+            return None
+
+    def renew(self, index: int, worker: str) -> bool:
+        """Extends a lease. False if the shard no longer belongs to `worker`."""
+        with self._locked():
+            state = self._load()
+            shard = state["shards"][index]
+            if shard["status"] != "claimed" or shard["worker"] != worker:
+                return False
+            shard["lease_until"] = time.time() + self.lease_seconds
+            self._save(state)
+            return True
+
+    def complete(self, index: int, worker: str) -> None:
+        """Marks a shard done."""
+        with self._locked():
+            state = self._load()
+            shard = state["shards"][index]
+            if shard["worker"] != worker:
+                print(f"Warning: shard {index} was reclaimed by {shard['worker']}; both results are kept and merged.")
+            shard.update(status="done", lease_until=None)
+            self._save(state)
+
+    @contextmanager
+    def hold(self, shard: dict, worker: str):
+        """Renews the lease of `shard` from a background thread while the block runs."""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(shard["index"], worker):
+                    print(f"Warning: lost the lease of shard {shard['index']}.")
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f"shard-{shard['index']}-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def status(self) -> dict:
+        """How many shards are pending, claimed and done."""
+        counts = {"pending": 0, "claimed": 0, "done": 0}
+        for shard in (self._load() or {}).get("shards", []):
+            counts[shard["status"]] += 1
+        return counts
+
+    def finished(self) -> bool:
+        state = self._load()
+        return state is not None and all(shard["status"] == "done" for shard in state["shards"])
+
+    def shards(self, worker: str, poll_seconds: float = POLL_SECONDS):
+        """
+        Yields the shards `worker` claims, until every shard is done. While the remaining shards
+        are held by other workers it waits instead of returning, so it can take over the shard of
+        a worker that dies.
+        """
+        while True:
+            shard = self.claim(worker)
+            if shard is not None:
+                yield shard
+            elif self.finished():
+                return
+            else:
+                time.sleep(poll_seconds)
+
+    def take_merge(self) -> bool:
+        """True for the first caller once every shard is done: that worker merges the results."""
+        with self._locked():
+            state = self._load()
+            if state.get("merged") or not all(shard["status"] == "done" for shard in state["shards"]):
+                return False
+            state["merged"] = True
+            self._save(state)
+            return True
+
+    def checkpoint_path(self, index: int, worker: str) -> str:
+        """The JSONL checkpoint of one worker's attempt at a shard."""
+        return os.path.join(self.queue_dir, f"shard-{index:05d}.{worker}.jsonl")
+
+    def shard_paths(self, index: int = None) -> list:
+        """Checkpoints of every attempt at a shard (all shards if `index` is None), oldest first."""
+        pattern = "*" if index is None else f"{index:05d}"
+        return sorted(glob.glob(os.path.join(self.queue_dir, f"shard-{pattern}.*.jsonl")), key=os.path.getmtime)
+
+    def completed_ids(self, index: int) -> set:
+        """Item IDs of a shard already checkpointed by any attempt."""
+        return set().union(*(load_completed_ids(path) for path in self.shard_paths(index)))
+
+    def merge(self, output_path: str, run_summary: dict = None, compact: bool = False) -> int:
+        """Merges the shard checkpoints into one results file, in the queue's item order."""
+        state = self._load()
+        return merge_results(self.shard_paths(), output_path, order=state["item_ids"], run_summary=run_summary,
+                             compact=compact)
+
+
+def merge_results(paths: list, output_path: str, order: list = None, run_summary: dict = None,
+                  compact: bool = False) -> int:
+    """
+    Merges results files (JSON results of main.py, in any layout, or JSONL checkpoints) into one,
+    in the compact layout with `compact` (so a single older file is converted by merging it alone).
+    An item found more than once keeps its record from the last file listed. Items are written
+    in `order`, then the rest by item ID (numerically where the IDs are numbers). Items of files
+    named after an index range ("..._4_6_ita.json") are renumbered from the start of the range.
+
+    Returns:
+        int: Number of items written.
+    """
+    merged_path = f"{output_path}.merging.jsonl"
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    item_ids = set()
+    with open(merged_path, "w", encoding="utf-8") as merged:
+        for path in paths:
+            # Hand-split runs numbered their items from 1 within their range: shifted to the range.
+            item_range = _range_of(path)
+            for record in iter_results(path):
+                item_id = str(record.get("item_id"))
+                if item_range is not None and item_id.isdigit() and int(item_id) <= item_range[1] - item_range[0] + 1:
+                    record["item_id"] = int(item_id) + item_range[0] - 1
+                item_ids.add(str(record.get("item_id")))
+                merged.write(json.dumps(record, ensure_ascii=False) + "\n")
+    listed = [str(item_id) for item_id in order or []]
+    order = listed + sorted(item_ids - set(listed), key=_natural_key)
+    try:
+        return finalize_results(merged_path, output_path, order=order, run_summary=run_summary, compact=compact)
+    finally:
+        os.remove(merged_path)
+
+
+def main():
+    """Merges MERGE_PATHS into MERGE_OUTPUT_PATH and prints the state of the queue in QUEUE_DIR, if any."""
+    try:
+        count = merge_results(MERGE_PATHS, MERGE_OUTPUT_PATH, compact=MERGE_COMPACT)
+        print(f"Merged {count} items from {len(MERGE_PATHS)} files into: {MERGE_OUTPUT_PATH}")
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error merging results: {e}")
+    if os.path.exists(os.path.join(QUEUE_DIR, "queue.json")):
+        print(f"Shard queue in '{QUEUE_DIR}': {ShardQueue(QUEUE_DIR).status()}")
+
+
+if __name__ == "__main__":
+    main()
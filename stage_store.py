@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from instrumentation import record_cache_hit
+
+# Stage-level memoisation of the pipeline: every stage (pre-processing, cleaning, metrics,
+# judging, diffs) stores its output under a hash of the stage name, its configuration and its
+# inputs. A rerun then only recomputes the stages whose inputs or configuration changed: after a
+# judge prompt change, cleaning and metrics are read back and only the judge runs again.
+#
+# Stage outputs are kept until removed by hand: they are the pipeline's intermediate results.
+# The cleaning and judging calls behind the "clean" and "judge" stages also go through llm_cache.py,
+# so those texts are stored twice, on purpose. The response cache holds one entry per LLM call,
+# i.e. per chunk of a long text, keyed by model, prompt version and prompt inputs only, and is
+# shared with cleaner_LLM.py and judge_LLM.py run on their own: when a stage key changes for a
+# reason that leaves some calls the same (a new chunk size or pre-cleaning rule touching only some
+# chunks, USE_STAGE_STORE = False), those calls are still not paid for again. Being a cache of
+# calls, it is bounded and evicts (size and age); the stage store is the pipeline's record and
+# does not.
+#
+# Each stage also keeps an index of the latest output per (item, model, source), where the source
+# is a hash of the item's dataset texts, so other scripts can reuse outputs without recomputing
+# their keys (see `latest`): item IDs repeat across datasets, the source tells their items apart.
+
+# --- Configuration ---
+STAGE_DIR = "cache/stages"
+
+
+class StageStore:
+    """
+    On-disk, content-addressed store of stage outputs (any JSON value).
+
+    Entries live in <root>/<stage>/<key[:2]>/<key>.json; the index of a stage is the append-only
+    file <root>/<stage>/index.jsonl, where later lines win. A line is only appended when it
+    changes the index, so reruns that reuse every output leave it as it is.
+    """
+
+    def __init__(self, root: str = STAGE_DIR):
+        self.root = root
+        self.enabled = True # False recomputes every stage and stores nothing
+        self.hits = {}
+        self.misses = {}
+        self._indexes = {} # stage -> {(item_id, model, source): key}, read on the first `record`
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(stage: str, config: dict, *inputs) -> str:
+        """Hashes the stage, its configuration and its inputs into a key."""
+        payload = json.dumps([stage, config, list(inputs)], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def source_key(*texts: str) -> str:
+        """Hash of an item's dataset texts (OCR and ground truth), recorded with its outputs in the index."""
+        return hashlib.sha256(json.dumps(list(texts), ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key[:2], f"{key}.json")
+
+    def _count(self, stage: str, hit: bool) -> None:
+        with self._lock:
+            counts = self.hits if hit else self.misses
+            counts[stage] = counts.get(stage, 0) + 1
+
+    def get(self, stage: str, key: str):
+        """Returns the stored output, or None if there is none."""
+        try:
+            with open(self._path(stage, key), "r", encoding="utf-8") as f:
+                return json.load(f)["output"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, stage: str, key: str, output) -> None:
+        """Stores an output. The write is atomic, so concurrent readers never see partial files."""
+        path = self._path(stage, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"output": output, "created": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write {stage} stage output {key[:12]}: {e}")
+
+    def _read_index(self, stage: str) -> list:
+        """The entries of a stage's index, oldest first."""
+        entries = []
+        try:
+            with open(os.path.join(self.root, stage, "index.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue # a line cut short by an interrupted run
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def record(self, stage: str, item_id: str, model: str, key: str, source: str = None) -> None:
+        """Marks `key` as the latest output of `stage` for one item (of the dataset texts `source`) and model."""
+        with self._lock:
+            if stage not in self._indexes:
+                self._indexes[stage] = {(entry["item_id"], entry["model"], entry.get("source")): entry["key"]
+                                        for entry in self._read_index(stage)}
+            index = self._indexes[stage]
+            if index.get((item_id, model, source)) == key:
+                return
+            line = json.dumps({"item_id": item_id, "model": model, "source": source, "key": key}, ensure_ascii=False) + "\n"
+            try:
+                os.makedirs(os.path.join(self.root, stage), exist_ok=True)
+                with open(os.path.join(self.root, stage, "index.jsonl"), "a", encoding="utf-8") as f:
+                    f.write(line)
+                index[(item_id, model, source)] = key
+            except OSError as e:
+                print(f"Warning: could not index {stage} stage output {key[:12]}: {e}")
+
+    def latest(self, stage: str, sources: dict) -> dict:
+        """
+        The latest output of `stage` for every item of `sources` and every model it was recorded
+        for. Only outputs recorded for the same dataset texts count: an item ID of another
+        dataset, or of an earlier version of the item, is not matched.
+
+        Args:
+            sources (dict): Maps item IDs to the `source_key` of their dataset texts.
+
+        Returns:
+            dict: Maps (item_id, model) to the output. Missing or unreadable entries are left out.
+        """
+        keys = {}
+        for entry in self._read_index(stage):
+            if entry.get("source") is not None and sources.get(entry["item_id"]) == entry["source"]:
+                keys[(entry["item_id"], entry["model"])] = entry["key"]
+        outputs = {}
+        for item_model, key in keys.items():
+            output = self.get(stage, key)
+            if output is not None:
+                outputs[item_model] = output
+        return outputs
+
+    def run(self, stage: str, config: dict, inputs: list, compute, item_id: str = None, model: str = None, keep=None,
+            source: str = None):
+        """
+        The output of a stage: read back if an output for the same configuration and inputs is
+        stored, otherwise `compute()`, stored unless `keep(output)` is False (e.g. an error
+        placeholder, which should be retried next run). With `item_id`, the output is also
+        recorded as that item's latest for `model` (and the item's dataset texts `source`).
+        """
+        if not self.enabled:
+            return compute()
+        key = self.make_key(stage, config, *inputs)
+        output = self.get(stage, key)
+        self._count(stage, hit=output is not None)
+        if output is not None:
+            record_cache_hit()
+        else:
+            output = compute()
+            if keep is not None and not keep(output):
+                return output
+            self.put(stage, key, output)
+        if item_id is not None:
+            self.record(stage, item_id, model, key, source)
+        return output
+
+    def report(self) -> None:
+        """Prints, per stage, how many outputs were reused and how many recomputed."""
+        for stage in sorted(set(self.hits) | set(self.misses)):
+            print(f"Stage store, {stage}: {self.hits.get(stage, 0)} reused, {self.misses.get(stage, 0)} computed")
+
+
+# Shared by main.py, extracter.py and judge_LLM.py.
+stage_store = StageStore()
@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from llm_cache import response_cache
+from result_writer import iter_jsonl, load_completed_ids, load_results
+from stage_store import stage_store
+
+GROUND_TRUTH = "The quick brown fox jumps over the lazy dog in a field."
+OCR_TEXT = "T~b3 qu1ck br0wn f0x jnmps 0ver tbe lazv d0g iu a fie1d ,, ; ^^"
+
+
+def _configure(monkeypatch, tmp_path):
+    """Runs main.py offline on two items, every file it reads or writes under `tmp_path`."""
+    dataset_path = tmp_path / "dataset.jsonl"
+    dataset_path.write_text("".join(json.dumps({"id": item_id, "ocr": OCR_TEXT, "clean": GROUND_TRUTH}) + "\n"
+                                    for item_id in ["1", "2"]), encoding="utf-8")
+    for name, value in {"INPUT_PATH": str(dataset_path), "OUTPUT_PATH": str(tmp_path / "results.json"),
+                        "CHECKPOINT_PATH": str(tmp_path / "results.jsonl"), "NUM_ITEM_TO_PROCESS": None,
+                        "MODELS_TO_RUN": ["Mock"], "JUDGE_CONFIG": dict(main.MODEL_CONFIGS["Mock"]),
+                        "RESUME": True, "ASYNC_MODE": False, "TRIAGE_THRESHOLD": None,
+                        "RESULTS_STORE_DIR": None, "METRICS_EXPORT": None}.items():
+        monkeypatch.setattr(main, name, value)
+    monkeypatch.setattr(stage_store, "root", str(tmp_path / "stages"))
+    monkeypatch.setattr(response_cache, "cache_dir", str(tmp_path / "llm_responses"))
+
+
+def test_resume_reprocesses_failed_items(monkeypatch, tmp_path):
+    _configure(monkeypatch, tmp_path)
+    # A checkpoint of this run where item 2 failed to clean and item 1 is done.
+    done = {"item_id": "1", "original_ocr": OCR_TEXT, "ground_truth": GROUND_TRUTH, "model_outputs": [
+        {"model_name": "Mock", "cleaned_text": GROUND_TRUTH, "metrics": None, "diffs": [], "judgement": {"score": 5}}]}
+    failed = {"item_id": "2", "original_ocr": OCR_TEXT, "ground_truth": GROUND_TRUTH, "model_outputs": [
+        {"model_name": "Mock", "cleaned_text": "[LLM_ERROR: 503 Service Unavailable]", "metrics": None,
+         "diffs": None, "judgement": None}]}
+    with open(main.CHECKPOINT_PATH, "w", encoding="utf-8") as f:
+        for record in [{"run_header": main.run_header()}, done, failed]:
+            f.write(json.dumps(record) + "\n")
+    assert load_completed_ids(main.CHECKPOINT_PATH) == {"1"}
+
+    main.main()
+
+    # Only item 2 ran again, and its new record replaced the failed one in the results.
+    assert [record["item_id"] for _, record in iter_jsonl(main.CHECKPOINT_PATH)] == ["1", "2", "2"]
+    assert load_completed_ids(main.CHECKPOINT_PATH) == {"1", "2"}
+    results = {record["item_id"]: record for record in load_results(main.OUTPUT_PATH)}
+    assert list(results) == ["1", "2"]
+    assert results["1"]["model_outputs"][0]["judgement"] == {"score": 5}
+    retried = results["2"]["model_outputs"][0]
+    assert not retried["cleaned_text"].startswith("[LLM_ERROR") and retried["metrics"] is not None
+
+
+def test_failed_judgement_is_retried(monkeypatch, tmp_path):
+    _configure(monkeypatch, tmp_path)
+    output = main.build_model_output("Mock", GROUND_TRUTH, {"wer": 0.0, "cer": 0.0}, "[LLM_ERROR: timeout]")
+    assert output["judgement"] == {"score": -1, "error": "[LLM_ERROR: timeout]"}
+    with open(main.CHECKPOINT_PATH, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"item_id": "1", "model_outputs": [output]}) + "\n")
+    assert load_completed_ids(main.CHECKPOINT_PATH) == set()
+    assert load_completed_ids(main.CHECKPOINT_PATH, retry_failed=False) == {"1"}
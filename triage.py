@@ -0,0 +1,123 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+from dataset_handler import load_dataset
+
+try:
+    # pyspellchecker ships frequency lists for English and Italian; without it the
+    # out-of-vocabulary signal is skipped and triage relies on the character-level signals.
+    from spellchecker import SpellChecker
+except ImportError:
+    SpellChecker = None
+
+# Scores how noisy a segment's OCR text looks, with cheap local signals, so segments that are
+# already clean can skip the LLM cleaning and judging calls.
+
+# --- Configuration ---
+NOISE_THRESHOLD = 0.02 # Segments whose noise score is below this are passed through without the LLM
+RUN_TOGETHER_LENGTH = 20 # Longer tokens are treated as words run together
+INPUT_PATH = "dataset/eng/the_vampyre_subset.json" # Used when run as a script
+LANGUAGE = "eng" # Used when run as a script
+
+_SPELLCHECKER_LANGUAGES = {"eng": "en", "ita": "it"}
+_TOKEN_RE = re.compile(r"\S+")
+_WORD_RE = re.compile(r"[^\W\d_]{2,}(?![^\W\d_'’])") # words, except elided ones such as the "dell" of "dell'acqua"
+_DIGIT_IN_WORD_RE = re.compile(r"[^\W\d_]\d|\d[^\W\d_]")
+_CASE_JOIN_RE = re.compile(r"[a-z][A-Z]") # "theLondon"
+# Characters that should not appear in clean modern text of these books: long s, the
+# replacement character, stray marks that OCR produces from specks and ornaments.
+_SUSPICIOUS_RE = re.compile(r"[ſ�|¦^~`\\{}<>¬§¤■□●]")
+
+
+def _strip_accents(word: str) -> str:
+    """"perchè" and "perché" are the same word to the wordlist; older editions use either accent."""
+    return "".join(c for c in unicodedata.normalize("NFD", word) if not unicodedata.combining(c))
+
+@lru_cache(maxsize=None)
+def _vocabulary(language: str):
+    """The lowercased, accent-free wordlist of a language, or None if no wordlist is available."""
+    if SpellChecker is None or language not in _SPELLCHECKER_LANGUAGES:
+        return None
+    words = SpellChecker(language=_SPELLCHECKER_LANGUAGES[language]).word_frequency.dictionary
+    return {_strip_accents(word) for word in words}
+
+
+def has_wordlist(language: str) -> bool:
+    """Whether a wordlist of `language` is available (pyspellchecker is installed and knows the language)."""
+    return _vocabulary(language) is not None
+
+
+def is_known_word(word: str, language: str) -> bool:
+    """Whether the wordlist of `language` has `word` (ignoring case and accents); False without a wordlist."""
+    vocabulary = _vocabulary(language)
+    return vocabulary is not None and _strip_accents(word.lower()) in vocabulary
+
+
+def noise_signals(text: str, language: str) -> dict:
+    """
+    Counts the noisy tokens of a text, by signal. A token counts once per signal it shows.
+
+    Out-of-vocabulary checks only apply to all-lowercase words: capitalized words are mostly
+    names and titles, which a wordlist does not know.
+    """
+    vocabulary = _vocabulary(language)
+    signals = {"tokens": 0, "out_of_vocabulary": 0, "suspicious_chars": 0, "digits_in_words": 0, "run_together": 0}
+    for token in _TOKEN_RE.findall(text):
+        signals["tokens"] += 1
+        if _SUSPICIOUS_RE.search(token):
+            signals["suspicious_chars"] += 1
+        if _DIGIT_IN_WORD_RE.search(token):
+            signals["digits_in_words"] += 1
+        if len(token) > RUN_TOGETHER_LENGTH or _CASE_JOIN_RE.search(token):
+            signals["run_together"] += 1
+        if vocabulary is not None:
+            for word in _WORD_RE.findall(token):
+                if word.islower() and _strip_accents(word) not in vocabulary:
+                    signals["out_of_vocabulary"] += 1
+                    break
+    return signals
+
+
+def noise_score(text: str, language: str) -> float:
+    """Fraction of tokens showing at least one noise signal, weighted by how many they show (0 = clean)."""
+    signals = noise_signals(text, language)
+    if not signals["tokens"]:
+        return 0.0
+    flagged = sum(count for name, count in signals.items() if name != "tokens")
+    return flagged / signals["tokens"]
+
+
+def needs_llm(text: str, language: str, threshold: float = NOISE_THRESHOLD) -> tuple:
+    """
+    Triage decision for one segment.
+
+    Returns:
+        tuple: (needs_llm, score). Empty text never needs the LLM.
+    """
+    if not text.strip():
+        return False, 0.0
+    score = noise_score(text, language)
+    return score >= threshold, score
+
+
+def main():
+    """Prints the noise score of every item in a dataset and how many would skip the LLM."""
+    try:
+        data_dict = load_dataset(INPUT_PATH)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error loading input file: {e}")
+        return
+    if SpellChecker is None:
+        print("pyspellchecker is not installed; scoring without the out-of-vocabulary signal.")
+
+    passthrough = 0
+    for item_id, item in data_dict.items():
+        to_llm, score = needs_llm(item.get("ocr", ""), LANGUAGE)
+        passthrough += not to_llm
+        print(f"Item {item_id}: noise={score:.3f} -> {'LLM' if to_llm else 'passthrough'}")
+    print(f"\n{passthrough}/{len(data_dict)} items would skip the LLM (threshold {NOISE_THRESHOLD}).")
+
+
+if __name__ == "__main__":
+    main()